@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""追加写入的区块存储，节点重启时不必重新同步整条链
+
+目录中的四个文件：
+- blocks.dat : 区块记录依次追加，每条记录 = 内容长度(4B) + 内容 + CRC32(4B)
+- index.dat  : 文件头 + 按高度排列的定长索引项 = 区块哈希(32B) | 记录偏移(8B) | 记录长度(4B) | 累计工作量(32B)
+- hashes.dat : 文件头 + 开放寻址哈希表，槽位 = 区块哈希前8字节 | 高度+1(4B)
+- txids.dat  : 文件头 + 开放寻址哈希表，槽位 = txid(32B) | 高度+1(4B) | 区块内位置(4B)
+
+三个索引文件都通过 mmap 访问：启动时只需映射文件，按高度、按哈希、按txid查找都是O(1)，
+不需要把整条链或所有交易反序列化到内存。
+
+崩溃恢复：写入顺序是 区块记录 -> 索引项 -> 索引头中的区块数，以索引头为准。
+打开时丢弃校验失败的末尾记录，并把 blocks.dat 截断到最后一条完整记录之后。
+hashes.dat 是派生数据，和索引不一致时直接重建。
+txids.dat 的文件头记录已经索引交易的区块数(txids_indexed)：区块内容由调用方解析，
+重启后由调用方补上这个数之后的区块；删除txid前先把这个数降到txid所在高度，中途崩溃也只会多补几个区块。
+"""
+
+import mmap
+import os
+import struct
+import zlib
+
+RECORD_HEADER = struct.Struct(">I")
+RECORD_TRAILER = struct.Struct(">I")
+INDEX_HEADER = struct.Struct(">8sQ")  # magic | 区块数
+INDEX_ENTRY = struct.Struct(">32sQI32s")  # 哈希 | 偏移 | 长度 | 累计工作量
+HASH_HEADER = struct.Struct(">8sQQQ")  # magic | 槽位数 | 已用槽位(含墓碑) | 已索引的区块数
+HASH_SLOT = struct.Struct(">QI")  # 哈希前8字节 | 高度+1 (0表示空槽)
+TXID_HEADER = struct.Struct(">8sQQQQ")  # magic | 槽位数 | 已用槽位(含墓碑) | 有效txid数 | 已索引交易的区块数
+TXID_SLOT = struct.Struct(">32sII")  # txid | 高度+1 (0表示空槽) | 区块内位置
+
+INDEX_MAGIC = b"POWIDX01"
+HASH_MAGIC = b"POWHSH01"
+TXID_MAGIC = b"POWTXI01"
+TOMBSTONE = 0xFFFFFFFF  # 已删除的槽位，查找时跳过但不终止探测
+INITIAL_ENTRIES = 1024
+INITIAL_SLOTS = 2048
+INITIAL_TXID_SLOTS = 4096
+
+
+class BlockStore:
+    """按高度存储主链区块的追加写入存储
+    - append 在链末端追加一个区块
+    - truncate 在链重组时丢弃分叉点之后的区块
+    记录内容由调用方序列化，这里只关心字节
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._data = open(os.path.join(directory, "blocks.dat"), "a+b")
+        self._index_file, self._index = self._open_mapped("index.dat", INDEX_HEADER.size + INITIAL_ENTRIES * INDEX_ENTRY.size)
+        self._hash_file, self._hashes = self._open_mapped("hashes.dat", HASH_HEADER.size + INITIAL_SLOTS * HASH_SLOT.size)
+
+        magic, count = INDEX_HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, 0)
+            count = 0
+        self._count = count
+        self._recover()
+
+        magic, _, _, indexed = HASH_HEADER.unpack_from(self._hashes, 0)
+        if magic != HASH_MAGIC or indexed != self._count:
+            self._rebuild_hashes(INITIAL_SLOTS)
+
+        self._txid_file, self._txids = self._open_mapped("txids.dat", TXID_HEADER.size + INITIAL_TXID_SLOTS * TXID_SLOT.size)
+        magic, capacity, _, _, indexed = TXID_HEADER.unpack_from(self._txids, 0)
+        if magic != TXID_MAGIC:
+            self._rebuild_txids(INITIAL_TXID_SLOTS, [], 0)  # 新建，或者旧版本的存储：调用方从头补索引
+        elif indexed > self._count:
+            # 恢复时丢掉了末尾的区块，它们的txid也要删掉(只在这种情况下扫描整张表)
+            stale = [txid for txid, (height, _) in self.txid_items() if height >= self._count]
+            for txid in stale:
+                self.remove_txid(txid)
+            self.txids_indexed = self._count
+
+    def _open_mapped(self, name: str, initial_size: int):
+        path = os.path.join(self.directory, name)
+        file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(file.fileno()).st_size < initial_size:
+            file.truncate(initial_size)
+        return file, mmap.mmap(file.fileno(), 0)
+
+    def _grow(self, file, mapped: mmap.mmap, size: int) -> mmap.mmap:
+        mapped.flush()
+        mapped.close()
+        file.truncate(size)
+        return mmap.mmap(file.fileno(), 0)
+
+    def _recover(self) -> None:
+        """丢弃不完整的末尾记录，把数据文件截断到最后一条完整记录之后"""
+        data_size = os.fstat(self._data.fileno()).st_size
+        while self._count > 0:
+            _, offset, length, _ = self._entry(self._count - 1)
+            if offset + length <= data_size and self._read_record(offset, length) is not None:
+                break
+            self._count -= 1
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._count)
+        end = 0
+        if self._count:
+            _, offset, length, _ = self._entry(self._count - 1)
+            end = offset + length
+        if data_size != end:
+            self._data.truncate(end)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _entry(self, height: int) -> tuple[bytes, int, int, bytes]:
+        return INDEX_ENTRY.unpack_from(self._index, INDEX_HEADER.size + height * INDEX_ENTRY.size)
+
+    def _read_record(self, offset: int, length: int) -> bytes | None:
+        self._data.seek(offset)
+        record = self._data.read(length)
+        if len(record) != length or length < RECORD_HEADER.size + RECORD_TRAILER.size:
+            return None
+        (size,) = RECORD_HEADER.unpack_from(record, 0)
+        payload = record[RECORD_HEADER.size:RECORD_HEADER.size + size]
+        (checksum,) = RECORD_TRAILER.unpack_from(record, length - RECORD_TRAILER.size)
+        if RECORD_HEADER.size + size + RECORD_TRAILER.size != length or zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def read(self, height: int) -> bytes:
+        if not 0 <= height < self._count:
+            raise IndexError(height)
+        _, offset, length, _ = self._entry(height)
+        payload = self._read_record(offset, length)
+        if payload is None:
+            raise ValueError(f"Corrupted block record at height {height}")
+        return payload
+
+    def block_hash(self, height: int) -> str:
+        return self._entry(height)[0].hex()
+
+    def chain_work(self, height: int) -> int:
+        return int.from_bytes(self._entry(height)[3], "big")
+
+    def height_of(self, block_hash: str) -> int | None:
+        key = bytes.fromhex(block_hash)
+        prefix = int.from_bytes(key[:8], "big")
+        for slot in self._probe(prefix):
+            slot_prefix, value = HASH_SLOT.unpack_from(self._hashes, slot)
+            if value == 0:
+                return None
+            # 前8字节相同还要用索引里的完整哈希确认
+            if value != TOMBSTONE and slot_prefix == prefix and self._entry(value - 1)[0] == key:
+                return value - 1
+        return None
+
+    def _probe(self, prefix: int):
+        capacity = HASH_HEADER.unpack_from(self._hashes, 0)[1]
+        position = prefix & (capacity - 1)
+        for _ in range(capacity):
+            yield HASH_HEADER.size + position * HASH_SLOT.size
+            position = (position + 1) & (capacity - 1)
+
+    def _insert_hash(self, key: bytes, height: int) -> None:
+        _, capacity, used, indexed = HASH_HEADER.unpack_from(self._hashes, 0)
+        if (used + 1) * 2 > capacity:
+            self._rebuild_hashes(capacity * 2)
+            _, capacity, used, indexed = HASH_HEADER.unpack_from(self._hashes, 0)
+        prefix = int.from_bytes(key[:8], "big")
+        for slot in self._probe(prefix):
+            if HASH_SLOT.unpack_from(self._hashes, slot)[1] == 0:
+                HASH_SLOT.pack_into(self._hashes, slot, prefix, height + 1)
+                break
+        HASH_HEADER.pack_into(self._hashes, 0, HASH_MAGIC, capacity, used + 1, indexed)
+
+    def _rebuild_hashes(self, capacity: int) -> None:
+        # 容量至少是区块数的两倍，保持较低的装载率
+        while capacity < 2 * (self._count + 1):
+            capacity *= 2
+        self._hashes.close()
+        self._hash_file.truncate(0)  # 清空旧表，扩展出来的部分全部为0(空槽)
+        self._hash_file.truncate(HASH_HEADER.size + capacity * HASH_SLOT.size)
+        self._hashes = mmap.mmap(self._hash_file.fileno(), 0)
+        HASH_HEADER.pack_into(self._hashes, 0, HASH_MAGIC, capacity, 0, 0)
+        for height in range(self._count):
+            self._insert_hash(self._entry(height)[0], height)
+        HASH_HEADER.pack_into(self._hashes, 0, HASH_MAGIC, capacity, HASH_HEADER.unpack_from(self._hashes, 0)[2], self._count)
+
+    @property
+    def txids_indexed(self) -> int:
+        """高度 0..txids_indexed-1 的区块的交易都已经在 txids.dat 里"""
+        return TXID_HEADER.unpack_from(self._txids, 0)[4]
+
+    @txids_indexed.setter
+    def txids_indexed(self, count: int) -> None:
+        magic, capacity, used, live, _ = TXID_HEADER.unpack_from(self._txids, 0)
+        TXID_HEADER.pack_into(self._txids, 0, magic, capacity, used, live, count)
+
+    @property
+    def txid_count(self) -> int:
+        return TXID_HEADER.unpack_from(self._txids, 0)[3]
+
+    def _probe_txid(self, txid: bytes):
+        capacity = TXID_HEADER.unpack_from(self._txids, 0)[1]
+        position = int.from_bytes(txid[:8], "big") & (capacity - 1)
+        for _ in range(capacity):
+            yield TXID_HEADER.size + position * TXID_SLOT.size
+            position = (position + 1) & (capacity - 1)
+
+    def _find_txid(self, txid: bytes) -> tuple[int | None, int | None]:
+        """(txid所在槽位, 可以写入的第一个空槽或墓碑)"""
+        free = None
+        for slot in self._probe_txid(txid):
+            slot_txid, value, _ = TXID_SLOT.unpack_from(self._txids, slot)
+            if value == 0:
+                return None, slot if free is None else free
+            if value == TOMBSTONE:
+                free = slot if free is None else free
+            elif slot_txid == txid:
+                return slot, free
+        return None, free
+
+    def txid_location(self, txid: bytes) -> tuple[int, int] | None:
+        """txid 所在的 (高度, 区块内位置)"""
+        slot, _ = self._find_txid(txid)
+        if slot is None:
+            return None
+        _, value, position = TXID_SLOT.unpack_from(self._txids, slot)
+        return value - 1, position
+
+    def put_txid(self, txid: bytes, height: int, position: int) -> None:
+        magic, capacity, used, live, indexed = TXID_HEADER.unpack_from(self._txids, 0)
+        slot, free = self._find_txid(txid)
+        if slot is not None:
+            TXID_SLOT.pack_into(self._txids, slot, txid, height + 1, position)
+            return
+        if (used + 1) * 2 > capacity:
+            self._rebuild_txids(capacity * 2, list(self.txid_items()), indexed)
+            magic, capacity, used, live, indexed = TXID_HEADER.unpack_from(self._txids, 0)
+            _, free = self._find_txid(txid)
+        if TXID_SLOT.unpack_from(self._txids, free)[1] == 0:
+            used += 1  # 复用墓碑不增加已用槽位
+        TXID_SLOT.pack_into(self._txids, free, txid, height + 1, position)
+        TXID_HEADER.pack_into(self._txids, 0, magic, capacity, used, live + 1, indexed)
+
+    def remove_txid(self, txid: bytes) -> tuple[int, int] | None:
+        """删除txid，返回它原来的 (高度, 区块内位置)"""
+        slot, _ = self._find_txid(txid)
+        if slot is None:
+            return None
+        _, value, position = TXID_SLOT.unpack_from(self._txids, slot)
+        magic, capacity, used, live, indexed = TXID_HEADER.unpack_from(self._txids, 0)
+        # 先降低已索引的区块数再删除：中途崩溃时重启会把这个高度之后的交易重新补上
+        TXID_HEADER.pack_into(self._txids, 0, magic, capacity, used, live - 1, min(indexed, value - 1))
+        TXID_SLOT.pack_into(self._txids, slot, txid, TOMBSTONE, 0)
+        return value - 1, position
+
+    def txid_items(self):
+        """遍历所有 (txid, (高度, 区块内位置))，顺序不固定"""
+        capacity = TXID_HEADER.unpack_from(self._txids, 0)[1]
+        for i in range(capacity):
+            txid, value, position = TXID_SLOT.unpack_from(self._txids, TXID_HEADER.size + i * TXID_SLOT.size)
+            if value not in (0, TOMBSTONE):
+                yield txid, (value - 1, position)
+
+    def _rebuild_txids(self, capacity: int, items: list, indexed: int) -> None:
+        while capacity < 2 * (len(items) + 1):
+            capacity *= 2
+        self._txids.close()
+        self._txid_file.truncate(0)
+        self._txid_file.truncate(TXID_HEADER.size + capacity * TXID_SLOT.size)
+        self._txids = mmap.mmap(self._txid_file.fileno(), 0)
+        TXID_HEADER.pack_into(self._txids, 0, TXID_MAGIC, capacity, 0, 0, indexed)
+        for txid, (height, position) in items:
+            self.put_txid(txid, height, position)
+
+    def append(self, block_hash: str, payload: bytes, chain_work: int) -> int:
+        """在链末端追加一个区块，返回它的高度"""
+        height = self._count
+        # 1. 先写区块记录
+        offset = os.fstat(self._data.fileno()).st_size
+        record = RECORD_HEADER.pack(len(payload)) + payload + RECORD_TRAILER.pack(zlib.crc32(payload))
+        self._data.write(record)
+        self._data.flush()
+
+        # 2. 再写索引项，最后更新区块数：崩溃时最多丢掉这一个区块
+        if INDEX_HEADER.size + (height + 1) * INDEX_ENTRY.size > len(self._index):
+            self._index = self._grow(self._index_file, self._index, 2 * len(self._index))
+        key = bytes.fromhex(block_hash)
+        INDEX_ENTRY.pack_into(self._index, INDEX_HEADER.size + height * INDEX_ENTRY.size, key, offset, len(record), chain_work.to_bytes(32, "big"))
+        self._count = height + 1
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._count)
+
+        self._insert_hash(key, height)
+        _, capacity, used, _ = HASH_HEADER.unpack_from(self._hashes, 0)
+        HASH_HEADER.pack_into(self._hashes, 0, HASH_MAGIC, capacity, used, self._count)
+        return height
+
+    def truncate(self, length: int) -> None:
+        """只保留高度 0..length-1 的区块"""
+        if length >= self._count:
+            return
+        _, capacity, used, _ = HASH_HEADER.unpack_from(self._hashes, 0)
+        for height in range(length, self._count):
+            key = self._entry(height)[0]
+            prefix = int.from_bytes(key[:8], "big")
+            for slot in self._probe(prefix):
+                if HASH_SLOT.unpack_from(self._hashes, slot)[1] == height + 1:
+                    HASH_SLOT.pack_into(self._hashes, slot, prefix, TOMBSTONE)
+                    break
+        end = self._entry(length)[1]
+        self._count = length
+        if self.txids_indexed > length:
+            self.txids_indexed = length
+        INDEX_HEADER.pack_into(self._index, 0, INDEX_MAGIC, self._count)
+        HASH_HEADER.pack_into(self._hashes, 0, HASH_MAGIC, capacity, used, self._count)
+        self._data.truncate(end)
+
+    def flush(self) -> None:
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        self._index.flush()
+        self._hashes.flush()
+        self._txids.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._index.close()
+        self._hashes.close()
+        self._txids.close()
+        self._data.close()
+        self._index_file.close()
+        self._hash_file.close()
+        self._txid_file.close()
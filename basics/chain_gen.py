@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""确定性的合成链和负载生成器
+
+同一个种子总是生成同一条链(区块哈希也相同)，用于基准测试和性能分析：
+- 普通模式的难度保持在创世区块的目标值，每个区块都要真实挖矿
+- 平凡目标模式(trivial_target)：出块间隔远大于目标时间，前几个调整周期把目标值放宽到上限，之后每个区块只需一次哈希
+- 交易的金额只花发送方已确认余额的一部分，区块都能通过 verify_block
+- 可以每隔 fork_every 个区块生成一条短分叉(只含区块奖励)，以及乱序的投递顺序
+- 结果是内存中的 Block/Transaction 对象，也可以序列化到文件
+
+用法: python basics/chain_gen.py 区块数 输出文件 [--seed N] [--txs-per-block N] [--addresses N] [--fork-every N]
+"""
+
+import argparse
+import datetime
+import hashlib
+import random
+import struct
+import time
+
+from mining_backend import search_nonce
+from pow_demo import Block, BlockIndexEntry, Transaction, ValidatorNode, genesis_block, hash_to_bytes, target_to_bytes
+
+# 序列化文件：magic | 创世区块哈希(32B) | 区块数(4B) | 每个区块 = 长度(4B) + Block.to_bytes()
+FILE_MAGIC = b"POWGEN04"
+FILE_HEADER = struct.Struct(">8s32sI")
+RECORD_LENGTH = struct.Struct(">I")
+
+
+def seal(block: Block, target: int) -> None:
+    """静默版的 mine_block：生成大量区块时不逐个打印"""
+    block.target = target
+    midstate = hashlib.sha256(block.header_prefix())
+    block.nonce, digest, _ = search_nonce(midstate, target_to_bytes(target), 0)
+    block.hash = digest.hex()
+
+
+class ChainGenerator:
+    """按种子生成主链、分叉和交易
+    内部用一个 ValidatorNode 维护生成中的主链和已确认余额，生成的交易据此保证有效；
+    生成结束后 node 就是已经同步好整条主链的节点，可以直接用来测量
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        num_addresses: int = 100,
+        txs_per_block: int = 10,
+        trivial_target: bool = True,
+        fork_every: int | None = None,
+        fork_length: int = 2,
+    ):
+        self.rng = random.Random(seed)
+        self.addresses = [f"addr{i:06d}" for i in range(num_addresses)]
+        self.txs_per_block = txs_per_block
+        self.fork_every = fork_every
+        self.fork_length = fork_length
+        self.node = ValidatorNode()
+        # 出块间隔等于目标时间时难度不变；远大于目标时间时每个调整点目标值按上限放宽，直到 MAX_TARGET
+        target = self.node.blockchain.target_block_time
+        self.block_spacing = datetime.timedelta(seconds=target * 10 if trivial_target else target)
+        self.main_blocks: list[Block] = []
+        self.fork_blocks: list[Block] = []
+        self.nonces: dict[str, int] = {}  # 每个发送方最后用过的交易nonce
+
+    def _transactions(self) -> list[Transaction]:
+        # 和 verify_block 一样以可用余额为准，同一区块内依次扣减
+        balances = self.node.spendable_balances()
+        spent: dict[str, float] = {}
+        senders = [address for address in balances if balances[address] > 1]
+        txs = []
+        for _ in range(self.txs_per_block if senders else 0):
+            sender = self.rng.choice(senders)
+            available = balances[sender] - spent.get(sender, 0)
+            if available <= 1:
+                continue
+            amount = round(self.rng.uniform(0.01, available / 2), 2)
+            fee = round(self.rng.uniform(0.001, 0.1), 3)
+            nonce = self.nonces[sender] = self.nonces.get(sender, -1) + 1  # 每个发送方的交易依次编号
+            spent[sender] = spent.get(sender, 0) + amount + fee
+            txs.append(Transaction(sender, self.rng.choice(self.addresses), amount, fee, nonce))
+        return txs
+
+    def _make_block(self, parent: BlockIndexEntry, txs: list[Transaction], jitter: datetime.timedelta = datetime.timedelta(0)) -> Block:
+        block = Block(txs, parent.block.hash)
+        block.timestamp = parent.block.timestamp + self.block_spacing + jitter
+        block.miner_address = self.rng.choice(self.addresses)
+        seal(block, self.node.expected_target_after(parent, block))
+        return block
+
+    def _make_fork(self, parent: BlockIndexEntry) -> None:
+        # 分叉只含区块奖励；比主链短，不会引起重组，但验证节点需要索引和裁剪它们
+        for _ in range(self.fork_length):
+            block = self._make_block(parent, [], datetime.timedelta(microseconds=1))  # 时间戳错开，与主链区块区分开
+            self.fork_blocks.append(block)
+            parent = BlockIndexEntry(block, parent)
+
+    def extend_to(self, length: int) -> list[Block]:
+        """把主链延长到 length 个区块(含创世区块)，返回新生成的主链区块"""
+        node = self.node
+        new_blocks = []
+        while len(node.blockchain.chain) < length:
+            parent = node.block_index[node.blockchain.chain[-1].hash]
+            if self.fork_every and parent.height and parent.height % self.fork_every == 0:
+                self._make_fork(parent)
+            block = self._make_block(parent, self._transactions())
+            node.append_to_main_chain(block)
+            new_blocks.append(block)
+        self.main_blocks.extend(new_blocks)
+        return new_blocks
+
+    def all_blocks(self) -> list[Block]:
+        return self.main_blocks + self.fork_blocks
+
+    def delivery_order(self, blocks: list[Block] | None = None, window: int | None = None) -> list[Block]:
+        """模拟网络投递顺序
+        window=None: 完全打乱；window=k: 每个区块最多偏离原位置约k个，模拟轻度乱序
+        """
+        blocks = list(self.all_blocks() if blocks is None else blocks)
+        if window is None:
+            self.rng.shuffle(blocks)
+            return blocks
+        keys = [i + self.rng.uniform(0, window) for i in range(len(blocks))]
+        return [block for _, block in sorted(zip(keys, blocks), key=lambda item: item[0])]
+
+
+def save_blocks(path: str, blocks: list[Block]) -> None:
+    with open(path, "wb") as f:
+        f.write(FILE_HEADER.pack(FILE_MAGIC, hash_to_bytes(genesis_block.hash), len(blocks)))
+        for block in blocks:
+            payload = block.to_bytes()
+            f.write(RECORD_LENGTH.pack(len(payload)))
+            f.write(payload)
+
+
+def load_blocks(path: str) -> list[Block]:
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, genesis_hash, count = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC:
+        raise ValueError(f"{path} is not a generated chain file")
+    if genesis_hash != hash_to_bytes(genesis_block.hash):
+        raise ValueError(f"{path} was generated for a different genesis block")
+    blocks = []
+    offset = FILE_HEADER.size
+    for _ in range(count):
+        (length,) = RECORD_LENGTH.unpack_from(data, offset)
+        offset += RECORD_LENGTH.size
+        blocks.append(Block.from_bytes(data[offset:offset + length]))
+        offset += length
+    return blocks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic chain")
+    parser.add_argument("blocks", type=int, help="main chain length, including genesis")
+    parser.add_argument("output", help="file to write the serialized blocks to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--addresses", type=int, default=100)
+    parser.add_argument("--txs-per-block", type=int, default=10)
+    parser.add_argument("--fork-every", type=int, default=None)
+    parser.add_argument("--real-difficulty", action="store_true", help="keep the genesis difficulty instead of a trivial target")
+    parser.add_argument("--shuffle-window", type=int, default=None, help="bounded out-of-order delivery (default: in order)")
+    parser.add_argument("--shuffle", action="store_true", help="fully shuffled delivery")
+    args = parser.parse_args()
+
+    generator = ChainGenerator(args.seed, args.addresses, args.txs_per_block, not args.real_difficulty, args.fork_every)
+    begin = time.perf_counter()
+    generator.extend_to(args.blocks)
+    elapsed = time.perf_counter() - begin
+    blocks = generator.all_blocks()
+    if args.shuffle or args.shuffle_window is not None:
+        blocks = generator.delivery_order(blocks, None if args.shuffle else args.shuffle_window)
+    save_blocks(args.output, blocks)
+    num_txs = sum(len(block.data) for block in generator.main_blocks)
+    print(f"Generated {len(generator.main_blocks)} main blocks, {len(generator.fork_blocks)} fork blocks, {num_txs} transactions in {elapsed:.1f}s")
+    print(f"Tip {generator.main_blocks[-1].hash if generator.main_blocks else genesis_block.hash}, written to {args.output}")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""紧凑区块转发(参考比特币 BIP152)
+
+发送方只发区块头和每笔交易的6字节短ID，接收方用自己交易池里的交易还原区块，
+只向发送方请求缺少的交易。交易池和区块里的交易大部分重合时，转发一个区块只需要区块头加几个字节/笔。
+
+- 短ID = sha256(区块哈希 + txid) 的前6字节：以区块哈希为盐，构造碰撞的交易只能影响一个区块
+- 还原后先核对Merkle根，短ID碰撞导致拼错交易时退回到请求完整区块
+"""
+
+import hashlib
+
+from pow_demo import BLOCK_STRUCT, COUNT_STRUCT, Block, Transaction, TransactionPool, hash_to_bytes, merkle_root
+
+SHORT_ID_SIZE = 6
+
+
+def short_id(block_hash: str, txid: bytes) -> bytes:
+    return hashlib.sha256(hash_to_bytes(block_hash) + txid).digest()[:SHORT_ID_SIZE]
+
+
+class CompactBlock:
+    """区块头字段 + Merkle根 + 按区块内顺序排列的短ID，不携带交易本身"""
+
+    def __init__(self, block: Block):
+        self.hash = block.hash
+        self.previous_hash = block.previous_hash
+        self.timestamp_us = block.timestamp_us
+        self.nonce = block.nonce
+        self.target = block.target
+        self.block_reward = block.block_reward
+        self.miner_address = block.miner_address
+        self.merkle_root = block.merkle_root()
+        self.short_ids = [short_id(block.hash, tx.txid) for tx in block.data]
+
+    @property
+    def size(self) -> int:
+        """编码后的字节数：区块头 + 矿工地址 + Merkle根 + 交易数 + 短ID"""
+        miner = len((self.miner_address or "").encode())
+        return BLOCK_STRUCT.size + 2 + miner + 32 + COUNT_STRUCT.size + SHORT_ID_SIZE * len(self.short_ids)
+
+    def _header_block(self, txs: list[Transaction]) -> Block:
+        block = Block.__new__(Block)
+        block.hash = self.hash
+        block.previous_hash = self.previous_hash
+        block.timestamp_us = self.timestamp_us
+        block.nonce = self.nonce
+        block.target = self.target
+        block.block_reward = self.block_reward
+        block.miner_address = self.miner_address
+        block.data = txs
+        block._merkle_root = None
+        return block
+
+    def match(self, mempool: TransactionPool) -> list[Transaction | None]:
+        """用交易池填充交易位置，缺少的位置为None"""
+        by_short_id = {short_id(self.hash, tx.txid): tx for tx in mempool.pending_transactions}
+        return [by_short_id.get(sid) for sid in self.short_ids]
+
+    def reconstruct(self, slots: list[Transaction | None]) -> Block | None:
+        """所有位置都已填充且Merkle根一致时返回还原的区块，否则返回None"""
+        if any(tx is None for tx in slots):
+            return None
+        if merkle_root([tx.txid for tx in slots]) != self.merkle_root:
+            return None  # 短ID碰撞，拼出的交易不对
+        return self._header_block(list(slots))
+
+
+class CompactRelayStats:
+    """紧凑区块转发的统计
+    - immediate: 只用交易池就还原成功
+    - after_request: 请求缺少的交易后还原成功
+    - failed: 还原失败(短ID碰撞)，退回到请求完整区块
+    - full_relays: 紧凑编码不比完整区块小，直接发送了完整区块
+    """
+
+    def __init__(self):
+        self.blocks = 0
+        self.immediate = 0
+        self.after_request = 0
+        self.failed = 0
+        self.missing_txs = 0
+        self.full_relays = 0
+        self.full_bytes = 0  # 如果发送完整区块需要的字节数
+        self.relay_bytes = 0  # 实际发送的字节数(紧凑区块 + 交易请求和响应)
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.full_bytes - self.relay_bytes
+
+    @property
+    def success_rate(self) -> float:
+        """不需要额外往返就还原成功的比例"""
+        return self.immediate / self.blocks if self.blocks else 0.0
+
+    def summary(self) -> str:
+        return (f"compact blocks={self.blocks}, immediate={self.immediate}, after_request={self.after_request}, "
+                f"failed={self.failed}, full_relays={self.full_relays}, missing_txs={self.missing_txs}, bytes_saved={self.bytes_saved}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""主链区块头的列式内存存储
+
+每个字段一列，用 array/bytearray 连续保存，不为每个高度创建Python对象：
+- 32字节字段(哈希、Merkle根、目标值、累计工作量)各占一个 bytearray
+- 时间戳、nonce、区块奖励是 array 里的定长整数，矿工地址存成地址表的下标
+- previous_hash 不单独保存，主链上就是前一个高度的哈希
+- 哈希 -> 高度 的查找表以哈希前8字节(int)为键，前缀相同时用完整哈希确认
+
+与 BlockStore 的索引部分接口相同(__len__/block_hash/chain_work/height_of/truncate)，可以直接支撑 StoredBlockIndex。
+"""
+
+from array import array
+
+HASH_SIZE = 32
+
+
+class HeaderStore:
+    """按高度追加的主链区块头列"""
+
+    def __init__(self):
+        self._hashes = bytearray()
+        self._merkle_roots = bytearray()
+        self._targets = bytearray()
+        self._chain_work = bytearray()
+        self._timestamps = array("q")
+        self._nonces = array("Q")
+        self._rewards = array("q")
+        self._miners = array("I")
+        self._miner_names: list[str | None] = []  # 地址表，同一个矿工只保存一次
+        self._miner_ids: dict[str | None, int] = {}
+        self._heights: dict[int, int] = {}  # 哈希前8字节 -> 高度
+        self._colliding: dict[bytes, int] = {}  # 前8字节与已有哈希相同的少数哈希 -> 高度
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    @staticmethod
+    def _column(column: bytearray, height: int) -> bytes:
+        return bytes(column[height * HASH_SIZE:(height + 1) * HASH_SIZE])
+
+    def append(
+        self,
+        block_hash: bytes,
+        merkle_root: bytes,
+        timestamp_us: int,
+        nonce: int,
+        target: int,
+        block_reward: int,
+        miner_address: str | None,
+        chain_work: int,
+    ) -> int:
+        """在链末端追加一个区块头，返回它的高度"""
+        height = len(self)
+        self._hashes += block_hash
+        self._merkle_roots += merkle_root
+        self._targets += target.to_bytes(HASH_SIZE, "big")
+        self._chain_work += chain_work.to_bytes(HASH_SIZE, "big")
+        self._timestamps.append(timestamp_us)
+        self._nonces.append(nonce)
+        self._rewards.append(block_reward)
+        miner_id = self._miner_ids.get(miner_address)
+        if miner_id is None:
+            miner_id = self._miner_ids[miner_address] = len(self._miner_names)
+            self._miner_names.append(miner_address)
+        self._miners.append(miner_id)
+        prefix = int.from_bytes(block_hash[:8], "big")
+        if prefix in self._heights:
+            self._colliding[block_hash] = height
+        else:
+            self._heights[prefix] = height
+        return height
+
+    def fields(self, height: int) -> tuple[bytes, bytes, bytes, int, int, int, int, str | None]:
+        """(哈希, 前一个哈希, Merkle根, 时间戳, nonce, 目标值, 区块奖励, 矿工地址)"""
+        if not 0 <= height < len(self):
+            raise IndexError(height)
+        return (
+            self._column(self._hashes, height),
+            self._column(self._hashes, height - 1) if height else bytes(HASH_SIZE),
+            self._column(self._merkle_roots, height),
+            self._timestamps[height],
+            self._nonces[height],
+            int.from_bytes(self._column(self._targets, height), "big"),
+            self._rewards[height],
+            self._miner_names[self._miners[height]],
+        )
+
+    def block_hash(self, height: int) -> str:
+        return self._column(self._hashes, height).hex()
+
+    def chain_work(self, height: int) -> int:
+        return int.from_bytes(self._column(self._chain_work, height), "big")
+
+    def height_of(self, block_hash: str) -> int | None:
+        key = bytes.fromhex(block_hash)
+        height = self._heights.get(int.from_bytes(key[:8], "big"))
+        if height is not None and self._column(self._hashes, height) == key:
+            return height
+        return self._colliding.get(key)
+
+    def truncate(self, length: int) -> None:
+        """只保留高度 0..length-1 的区块头"""
+        if length >= len(self):
+            return
+        for height in range(length, len(self)):
+            key = self._column(self._hashes, height)
+            if self._colliding.pop(key, None) is None:
+                del self._heights[int.from_bytes(key[:8], "big")]
+        del self._hashes[length * HASH_SIZE:]
+        del self._merkle_roots[length * HASH_SIZE:]
+        del self._targets[length * HASH_SIZE:]
+        del self._chain_work[length * HASH_SIZE:]
+        del self._timestamps[length:]
+        del self._nonces[length:]
+        del self._rewards[length:]
+        del self._miners[length:]
+
+    @property
+    def nbytes(self) -> int:
+        """各列数据本身占用的字节数(不含查找表)"""
+        columns = (self._hashes, self._merkle_roots, self._targets, self._chain_work)
+        arrays = (self._timestamps, self._nonces, self._rewards, self._miners)
+        return sum(len(column) for column in columns) + sum(len(column) * column.itemsize for column in arrays)
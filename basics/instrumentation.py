@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""分级事件输出和运行指标
+
+验证热路径上的调试输出和计数都经过这里：
+- 事件按级别过滤，调用方先检查 debug/info 标志再格式化消息，关闭的级别只多一次属性读取
+- 计数器(counter)、瞬时值(gauge)、耗时/深度分布(histogram)可以通过 snapshot() 读取
+- 设置 summary_interval 后，maybe_report() 每隔这么多秒输出一行汇总
+"""
+
+import math
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100  # 关闭所有事件输出，指标照常统计
+
+
+class Histogram:
+    """按2的幂分桶的分布统计：记录一次是O(1)，分位数是桶上界的近似值"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: dict[int, int] = {}  # 指数e -> 落在 [2^(e-1), 2^e) 的样本数
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        exponent = math.frexp(value)[1] if value > 0 else -1074  # 0和负数都放进最小的桶
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q: float) -> float:
+        """第q百分位(0-100)所在桶的上界，不超过观测到的最大值"""
+        if not self.count:
+            return 0.0
+        rank = math.ceil(q / 100 * self.count)
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= rank:
+                return min(math.ldexp(1.0, exponent), self.max)
+        return self.max
+
+    def snapshot(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+
+class Instrumentation:
+    """分级事件 + 指标
+    - level: 低于这个级别的事件直接丢弃
+    - sink: 事件和汇总行的输出函数，默认 print
+    - summary_interval: 汇总行的输出间隔(秒)，None表示不输出
+    """
+
+    def __init__(self, level: int = INFO, sink=print, summary_interval: float | None = None):
+        self.sink = sink
+        self.summary_interval = summary_interval
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self._last_report = time.monotonic()
+        self.set_level(level)
+
+    def set_level(self, level: int) -> None:
+        self.level = level
+        # 调用方在格式化消息之前检查这两个标志
+        self.debug = level <= DEBUG
+        self.info = level <= INFO
+
+    def event(self, level: int, message: str) -> None:
+        if level >= self.level:
+            self.sink(message)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self) -> dict:
+        """当前所有指标的只读副本"""
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    def summary(self) -> str:
+        parts = [f"{name}={value}" for name, value in sorted(self.counters.items())]
+        parts += [f"{name}={value:g}" for name, value in sorted(self.gauges.items())]
+        for name, histogram in sorted(self.histograms.items()):
+            parts.append(f"{name}[n={histogram.count} mean={histogram.mean:.3g} p50={histogram.percentile(50):.3g} p99={histogram.percentile(99):.3g}]")
+        return "Stats: " + ", ".join(parts)
+
+    def maybe_report(self) -> None:
+        """到了汇总间隔就输出一行汇总；没有设置间隔时什么也不做"""
+        if self.summary_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._last_report >= self.summary_interval:
+            self._last_report = now
+            self.sink(self.summary())
+
+
+# 默认实例，所有节点共享；需要单独统计时给节点的 instrumentation 属性换一个实例
+instrumentation = Instrumentation()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""可替换的挖矿后端
+
+挖矿的内层循环只依赖区块头前缀(除nonce以外的部分，挖矿过程中不变)和目标值的32字节表示：
+- pure     : 每个nonce对完整区块头重新做一次SHA-256，作为参考实现
+- midstate : 区块头前缀只哈希一次，每个nonce复制中间状态后再哈希8个字节(search_nonce)
+- numpy    : 用NumPy数组同时计算一批nonce的SHA-256，只在安装了NumPy时可用
+
+所有后端按相同顺序尝试nonce，对同一个区块头找到的nonce相同。
+select_backend 在当前机器上测量各后端的算力并选择最快的，每个进程只测量一次；
+指定后端(名称或实例)或设置环境变量 POW_MINING_BACKEND 时跳过测量。
+"""
+
+import hashlib
+import itertools
+import os
+import struct
+import time
+from abc import ABC, abstractmethod
+
+from instrumentation import INFO, instrumentation
+
+try:
+    import numpy as np
+except ImportError:  # NumPy是可选依赖，没有安装时 numpy 后端不可用
+    np = None
+
+NONCE_STRUCT = struct.Struct(">Q")  # 区块头前缀之后的nonce(8B，大端)
+BACKEND_ENV_VAR = "POW_MINING_BACKEND"
+
+
+def search_nonce(midstate, target: bytes, start_nonce: int, step: int = 1, count: int | None = None):
+    """挖矿内核：从 start_nonce 开始按 step 递增尝试nonce
+    返回 (nonce, digest, 尝试次数)；尝试 count 次仍未找到时 nonce 和 digest 为 None
+    """
+    pack = NONCE_STRUCT.pack
+    nonce = start_nonce
+    tried = 0
+    for _ in itertools.repeat(None) if count is None else itertools.repeat(None, count):
+        sha = midstate.copy()
+        sha.update(pack(nonce))
+        digest = sha.digest()
+        tried += 1
+        if digest <= target:
+            return nonce, digest, tried
+        nonce += step
+    return None, None, tried
+
+
+class MiningBackend(ABC):
+    """挖矿后端的接口
+    search 尝试 start_nonce, start_nonce+step, ... 共 count 个nonce(None表示直到找到)，
+    返回 (nonce, digest, 尝试次数)，含义与 search_nonce 相同
+    """
+
+    name = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        return True
+
+    @abstractmethod
+    def search(self, header_prefix: bytes, target: bytes, start_nonce: int, step: int = 1, count: int | None = None):
+        ...
+
+
+class PureLoopBackend(MiningBackend):
+    """每个nonce重新哈希完整区块头"""
+
+    name = "pure"
+
+    def search(self, header_prefix: bytes, target: bytes, start_nonce: int, step: int = 1, count: int | None = None):
+        pack = NONCE_STRUCT.pack
+        sha256 = hashlib.sha256
+        nonce = start_nonce
+        tried = 0
+        for _ in itertools.repeat(None) if count is None else itertools.repeat(None, count):
+            digest = sha256(header_prefix + pack(nonce)).digest()
+            tried += 1
+            if digest <= target:
+                return nonce, digest, tried
+            nonce += step
+        return None, None, tried
+
+
+class MidstateBackend(MiningBackend):
+    """区块头前缀的SHA-256中间状态只算一次"""
+
+    name = "midstate"
+
+    def search(self, header_prefix: bytes, target: bytes, start_nonce: int, step: int = 1, count: int | None = None):
+        return search_nonce(hashlib.sha256(header_prefix), target, start_nonce, step, count)
+
+
+# SHA-256 的轮常数和初始哈希值(FIPS 180-4)
+_K = [
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2,
+]
+_H0 = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]
+
+
+def _rotr(x, n: int):
+    return (x >> n) | (x << (32 - n))
+
+
+class NumpyBackend(MiningBackend):
+    """一次计算 batch_size 个nonce的SHA-256
+    每个数组元素是一个nonce的32位字，64轮压缩对整批nonce同时进行；不含nonce的完整64字节块只压缩一次(相当于midstate)
+    """
+
+    name = "numpy"
+
+    def __init__(self, batch_size: int = 8192):
+        self.batch_size = batch_size
+        self._prefix: bytes | None = None
+
+    @classmethod
+    def available(cls) -> bool:
+        return np is not None
+
+    @staticmethod
+    def _compress(state: list, words) -> list:
+        """SHA-256 压缩函数；state 是8个uint32数组，words 是 (批大小, 16) 的uint32数组，数组之间按广播规则运算"""
+        w = [words[:, i] for i in range(16)]
+        for i in range(16, 64):
+            s0 = _rotr(w[i - 15], 7) ^ _rotr(w[i - 15], 18) ^ (w[i - 15] >> 3)
+            s1 = _rotr(w[i - 2], 17) ^ _rotr(w[i - 2], 19) ^ (w[i - 2] >> 10)
+            w.append(w[i - 16] + s0 + w[i - 7] + s1)
+        a, b, c, d, e, f, g, h = state
+        for i in range(64):
+            t1 = h + (_rotr(e, 6) ^ _rotr(e, 11) ^ _rotr(e, 25)) + ((e & f) ^ (~e & g)) + np.uint32(_K[i]) + w[i]
+            t2 = (_rotr(a, 2) ^ _rotr(a, 13) ^ _rotr(a, 22)) + ((a & b) ^ (a & c) ^ (b & c))
+            h, g, f, e, d, c, b, a = g, f, e, d + t1, c, b, a, t1 + t2
+        return [x + y for x, y in zip(state, (a, b, c, d, e, f, g, h))]
+
+    def _prepare(self, header_prefix: bytes) -> None:
+        # 前缀中完整的64字节块压缩一次；剩下的前缀字节、nonce和填充组成每个nonce各自的尾部
+        fixed = len(header_prefix) // 64 * 64
+        length = len(header_prefix) + NONCE_STRUCT.size
+        tail = bytearray(-(-(length - fixed + 9) // 64) * 64)
+        tail[:len(header_prefix) - fixed] = header_prefix[fixed:]
+        tail[length - fixed] = 0x80
+        tail[-8:] = (length * 8).to_bytes(8, "big")
+        state = [np.array([value], dtype=np.uint32) for value in _H0]
+        for offset in range(0, fixed, 64):
+            words = np.frombuffer(header_prefix[offset:offset + 64], dtype=">u4").astype(np.uint32)
+            state = self._compress(state, words.reshape(1, 16))
+        self._prefix = header_prefix
+        self._midstate = state
+        self._tail = np.frombuffer(bytes(tail), dtype=np.uint8)
+        self._nonce_offset = len(header_prefix) - fixed
+
+    def _hash_batch(self, nonces) -> list:
+        batch = np.tile(self._tail, (len(nonces), 1))
+        batch[:, self._nonce_offset:self._nonce_offset + NONCE_STRUCT.size] = nonces.astype(">u8").view(np.uint8).reshape(-1, 8)
+        words = batch.view(">u4").astype(np.uint32)
+        state = self._midstate
+        for offset in range(0, words.shape[1], 16):
+            state = self._compress(state, words[:, offset:offset + 16])
+        return state
+
+    def search(self, header_prefix: bytes, target: bytes, start_nonce: int, step: int = 1, count: int | None = None):
+        if header_prefix != self._prefix:
+            self._prepare(header_prefix)
+        target_words = [np.uint32(int.from_bytes(target[i:i + 4], "big")) for i in range(0, 32, 4)]
+        tried = 0
+        while count is None or tried < count:
+            size = self.batch_size if count is None else min(self.batch_size, count - tried)
+            nonces = np.uint64(start_nonce + step * tried) + np.uint64(step) * np.arange(size, dtype=np.uint64)
+            state = self._hash_batch(nonces)
+            # 按大端字逐个比较：digest <= target
+            below = np.zeros(size, dtype=bool)
+            equal = np.ones(size, dtype=bool)
+            for word, target_word in zip(state, target_words):
+                below |= equal & (word < target_word)
+                equal &= word == target_word
+            hits = np.flatnonzero(below | equal)
+            if hits.size:
+                i = int(hits[0])
+                digest = b"".join(int(word[i]).to_bytes(4, "big") for word in state)
+                return int(nonces[i]), digest, tried + i + 1
+            tried += size
+        return None, None, tried
+
+
+BACKENDS: dict[str, type[MiningBackend]] = {backend.name: backend for backend in (PureLoopBackend, MidstateBackend, NumpyBackend)}
+
+
+def get_backend(name: str) -> MiningBackend:
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(f"Unknown mining backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    if not backend.available():
+        raise ValueError(f"Mining backend {name!r} is not available on this machine")
+    return backend()
+
+
+def available_backends() -> list[MiningBackend]:
+    return [backend() for backend in BACKENDS.values() if backend.available()]
+
+
+def calibrate(backends: list[MiningBackend] | None = None, seconds: float = 0.05, rounds: int = 3) -> dict[str, float]:
+    """在当前机器上测量每个后端的算力(hashes/s)，每个后端共测 seconds 秒左右
+    分 rounds 轮交替测量、每个后端取最快的一轮，一次调度抖动或频率变化不会只落在某一个后端上
+    """
+    header_prefix = bytes(124)
+    unreachable = bytes(32)  # 不可能满足的目标值，每次都跑满 count 个nonce
+    backends = available_backends() if backends is None else backends
+    for backend in backends:
+        backend.search(header_prefix, unreachable, 0, count=256)  # 预热(NumPy后端在这里建立midstate)
+    rates = {backend.name: 0.0 for backend in backends}
+    for _ in range(rounds):
+        for backend in backends:
+            hashes = 0
+            begin = time.perf_counter()
+            while time.perf_counter() - begin < seconds / rounds:
+                hashes += backend.search(header_prefix, unreachable, hashes, count=4096)[2]
+            rates[backend.name] = max(rates[backend.name], hashes / (time.perf_counter() - begin))
+    return rates
+
+
+DEFAULT_BACKEND = MidstateBackend.name
+CALIBRATION_MARGIN = 1.1  # 其他后端要比默认后端快这么多倍才被选中，测量误差范围内保留默认后端
+
+_calibrated: str | None = None  # 本进程校准选出的后端名称
+
+
+def select_backend(backend: str | MiningBackend | None = None) -> MiningBackend:
+    """按实例或名称(其次是环境变量 POW_MINING_BACKEND)选择后端，不做测量；
+    都没有指定时用校准结果中最快的，每个进程只校准一次
+    按名称选择时返回新的实例：NumPy后端缓存了区块头前缀的中间状态，不在矿工之间共享
+    """
+    global _calibrated
+    if isinstance(backend, MiningBackend):
+        return backend
+    name = backend or os.environ.get(BACKEND_ENV_VAR)
+    if name:
+        return get_backend(name)
+    if _calibrated is None:
+        rates = calibrate()
+        fastest = max(rates, key=rates.get)
+        _calibrated = fastest if rates[fastest] > rates[DEFAULT_BACKEND] * CALIBRATION_MARGIN else DEFAULT_BACKEND
+        if instrumentation.info:
+            instrumentation.event(INFO, f"Mining backend: {_calibrated} (" + ", ".join(f"{n} {rate:,.0f} H/s" for n, rate in rates.items()) + ")")
+    return get_backend(_calibrated)
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""asyncio 多节点网络模拟
+
+每个节点是一个 asyncio 任务，按随机生成的对等图互相连接：
+- 链路有延迟、带宽(按消息字节数排队发送)和丢包率，消息通过 loop.call_at 在到达时间投递
+- 节点之间泛洪转发区块和交易；收到孤块时向发送方请求父区块，丢包后也能补齐
+- 默认用紧凑区块转发(compact_block.py)：只发区块头和短ID，接收方从交易池还原，缺少的交易再向发送方请求
+- 出块过程：所有矿工的算力竞争用指数分布的等待时间模拟(平均出块间隔 block_interval)，
+  轮到某个矿工时再在线程池里完成真正的PoW，挖矿期间节点照常处理消息
+- 测试网络设置：目标出块时间为0，目标值在前几个调整周期放宽到上限，PoW本身几乎不花时间
+
+运行结束后汇报区块传播延迟分位数、孤块/陈旧区块比例和吞吐量。
+
+用法: python basics/net_sim.py [--nodes 10,50,100] [--intervals 1,2] [--duration 20] [--degree 8]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import random
+import time
+from collections import Counter
+
+from chain_gen import seal
+from compact_block import CompactBlock, CompactRelayStats
+from instrumentation import OFF, Instrumentation
+from pow_demo import Block, Transaction, TransactionPool, ValidatorNode
+
+
+class Link:
+    """单向链路：消息按发送顺序排队占用带宽，传完后再经过传播延迟到达"""
+
+    def __init__(self, latency: float, bandwidth: float, loss: float):
+        self.latency = latency  # 秒
+        self.bandwidth = bandwidth  # 字节/秒
+        self.loss = loss  # 丢包概率
+        self.busy_until = 0.0
+
+    def arrival_time(self, now: float, size: int) -> float:
+        start = max(now, self.busy_until)
+        self.busy_until = start + size / self.bandwidth
+        return self.busy_until + self.latency
+
+
+class SimNode:
+    """模拟网络中的一个节点：Node + 交易池 + 收件箱"""
+
+    def __init__(self, network: "Network", node_id: int, is_miner: bool):
+        self.network = network
+        self.node_id = node_id
+        self.address = f"node{node_id:04d}"
+        self.is_miner = is_miner
+        self.node = ValidatorNode()
+        self.node.blockchain.target_block_time = 0  # 测试网络：难度只降不升
+        self.node.instrumentation = network.instrumentation
+        self.mempool = TransactionPool(confirmed_txids=self.node.tx_index)
+        self.peers: dict["SimNode", Link] = {}
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.seen_blocks: set[str] = set()
+        self.seen_txids: set[bytes] = set()
+        self.known_blocks: dict[str, Block] = {}  # 收到的完整区块，用来响应 getblocktxn
+        self.pending_compact: dict[str, tuple[CompactBlock, list]] = {}  # 等待缺少交易的紧凑区块
+        self.payment_nonces = itertools.count()  # 自己发出的交易依次编号
+
+    def send(self, peer: "SimNode", kind: str, payload, size: int) -> None:
+        network = self.network
+        link = self.peers[peer]
+        network.messages_sent += 1
+        network.bytes_sent += size
+        if network.rng.random() < link.loss:
+            network.messages_lost += 1
+            return
+        loop = asyncio.get_running_loop()
+        loop.call_at(link.arrival_time(loop.time(), size), peer.inbox.put_nowait, (kind, payload, self))
+
+    def broadcast_block(self, block: Block, exclude: "SimNode | None" = None) -> None:
+        size = len(block.to_bytes())
+        kind, payload = "block", block
+        if self.network.compact_relay and not isinstance(block.data, str):
+            compact = CompactBlock(block)
+            stats = self.network.compact_stats
+            full_size = size
+            # 空区块或交易很少时紧凑编码(多了Merkle根)比完整区块还大，直接发送完整区块
+            if compact.size < full_size:
+                kind, payload, size = "cmpctblock", compact, compact.size
+            for peer in self.peers:
+                if peer is not exclude:
+                    stats.full_bytes += full_size
+                    stats.relay_bytes += size
+                    stats.full_relays += kind == "block"
+        for peer in self.peers:
+            if peer is not exclude:
+                self.send(peer, kind, payload, size)
+
+    def broadcast_tx(self, tx: Transaction, exclude: "SimNode | None" = None) -> None:
+        size = len(tx.to_bytes())
+        for peer in self.peers:
+            if peer is not exclude:
+                self.send(peer, "tx", tx, size)
+
+    def accept_block(self, block: Block, sender: "SimNode | None") -> None:
+        if block.hash in self.seen_blocks:
+            return
+        self.seen_blocks.add(block.hash)
+        self.known_blocks[block.hash] = block
+        self.pending_compact.pop(block.hash, None)
+        self.network.record_arrival(block, self)
+        node = self.node
+        node.process_new_block(block)
+        if block.hash in node.fork_tips:
+            node.select_best_chain()  # 分叉累计工作量超过主链时重组
+        if block.hash in node.block_index:
+            if not isinstance(block.data, str):
+                self.mempool.remove_transactions(block.data)
+            self.broadcast_block(block, exclude=sender)
+        elif block.hash in node.orphan_blocks:
+            self.broadcast_block(block, exclude=sender)
+            if sender is not None:
+                # 父区块可能在路上丢了，直接向发送方要
+                self.send(sender, "getblock", block.previous_hash, 32)
+
+    def accept_compact(self, compact: CompactBlock, sender: "SimNode") -> None:
+        if compact.hash in self.seen_blocks:
+            return
+        stats = self.network.compact_stats
+        pending = self.pending_compact.get(compact.hash)
+        if pending is None:
+            stats.blocks += 1
+            slots = compact.match(self.mempool)
+            missing = [i for i, tx in enumerate(slots) if tx is None]
+            if not missing:
+                self.finish_compact(compact, slots, sender, after_request=False)
+                return
+            stats.missing_txs += len(missing)
+            self.pending_compact[compact.hash] = (compact, slots)
+        else:
+            # 之前的请求可能丢了，向新的发送方再要一次
+            slots = pending[1]
+            missing = [i for i, tx in enumerate(slots) if tx is None]
+        size = 32 + 2 * len(missing)
+        stats.relay_bytes += size
+        self.send(sender, "getblocktxn", (compact.hash, missing), size)
+
+    def accept_block_txns(self, block_hash: str, txs: list[Transaction], sender: "SimNode") -> None:
+        pending = self.pending_compact.pop(block_hash, None)
+        if pending is None:
+            return
+        compact, slots = pending
+        missing = iter(txs)
+        slots = [tx if tx is not None else next(missing) for tx in slots]
+        self.finish_compact(compact, slots, sender, after_request=True)
+
+    def finish_compact(self, compact: CompactBlock, slots: list, sender: "SimNode", after_request: bool) -> None:
+        stats = self.network.compact_stats
+        block = compact.reconstruct(slots)
+        if block is None:
+            # 短ID碰撞拼错了交易，退回到请求完整区块
+            stats.failed += 1
+            self.send(sender, "getblock", compact.hash, 32)
+            return
+        if after_request:
+            stats.after_request += 1
+        else:
+            stats.immediate += 1
+        self.accept_block(block, sender)
+
+    def accept_tx(self, tx: Transaction, sender: "SimNode | None") -> None:
+        if tx.txid in self.seen_txids:
+            return
+        self.seen_txids.add(tx.txid)
+        if self.mempool.add_transaction(tx):
+            self.broadcast_tx(tx, exclude=sender)
+
+    async def run(self) -> None:
+        while True:
+            kind, payload, sender = await self.inbox.get()
+            if kind == "block":
+                self.accept_block(payload, sender)
+            elif kind == "cmpctblock":
+                self.accept_compact(payload, sender)
+            elif kind == "tx":
+                self.accept_tx(payload, sender)
+            elif kind == "getblock":
+                block = self.known_blocks.get(payload)
+                if block is not None:
+                    self.send(sender, "block", block, len(block.to_bytes()))
+            elif kind == "getblocktxn":
+                block_hash, indices = payload
+                block = self.known_blocks.get(block_hash)
+                if block is not None:
+                    txs = [block.data[i] for i in indices]
+                    size = 32 + sum(len(tx.to_bytes()) for tx in txs)
+                    self.network.compact_stats.relay_bytes += size
+                    self.send(sender, "blocktxn", (block_hash, txs), size)
+            elif kind == "blocktxn":
+                self.accept_block_txns(*payload, sender)
+
+    async def mine(self, mean_interval: float) -> None:
+        """mean_interval 是这个矿工自己的平均出块间隔(全网间隔 × 矿工数)"""
+        network = self.network
+        loop = asyncio.get_running_loop()
+        while True:
+            # 出块过程无记忆：等待期间收到新区块时矿工早已切换到新末端，醒来时总是在当前末端上出块
+            await asyncio.sleep(network.rng.expovariate(1 / mean_interval))
+            tip = self.node.blockchain.chain[-1]
+            transactions = self.mempool.get_transactions(self.node.spendable_balances(), network.txs_per_block)
+            block = Block(transactions, tip.hash)
+            block.miner_address = self.address
+            target = self.node.calculate_expected_target(block)
+            await loop.run_in_executor(None, seal, block, target)
+            network.record_mined(block, self)
+            self.accept_block(block, None)
+
+    async def make_payments(self, rate: float) -> None:
+        """以平均 rate 笔/秒的速度从自己的已确认余额里付款给随机节点"""
+        network = self.network
+        while True:
+            await asyncio.sleep(network.rng.expovariate(rate))
+            balance = self.node.spendable_balances().get(self.address, 0)
+            if balance < 1:
+                continue
+            receiver = network.rng.choice(network.nodes).address
+            amount = round(network.rng.uniform(0.01, min(balance / 10, 5)), 2)
+            tx = Transaction(self.address, receiver, amount, round(network.rng.uniform(0.001, 0.05), 3), next(self.payment_nonces))
+            self.accept_tx(tx, None)
+
+
+class Network:
+    """对等图 + 运行统计"""
+
+    def __init__(
+        self,
+        num_nodes: int,
+        num_miners: int | None = None,
+        degree: int = 8,
+        latency: tuple[float, float] = (0.02, 0.2),
+        bandwidth: float = 1_000_000,
+        loss: float = 0.01,
+        txs_per_block: int = 50,
+        seed: int = 0,
+        compact_relay: bool = True,
+    ):
+        self.rng = random.Random(seed)
+        self.instrumentation = Instrumentation(level=OFF)
+        self.txs_per_block = txs_per_block
+        self.compact_relay = compact_relay
+        self.compact_stats = CompactRelayStats()
+        num_miners = num_miners or max(1, num_nodes // 5)
+        self.nodes = [SimNode(self, i, i < num_miners) for i in range(num_nodes)]
+        # 先连成环保证连通，再随机补边到平均度数
+        for i, node in enumerate(self.nodes):
+            self.connect(node, self.nodes[(i + 1) % num_nodes], latency, bandwidth, loss)
+        target_edges = num_nodes * degree // 2
+        edges = num_nodes if num_nodes > 2 else num_nodes - 1
+        while edges < target_edges:
+            a, b = self.rng.sample(self.nodes, 2)
+            if b not in a.peers:
+                self.connect(a, b, latency, bandwidth, loss)
+                edges += 1
+
+        self.messages_sent = 0
+        self.messages_lost = 0
+        self.bytes_sent = 0
+        self.mined: dict[str, float] = {}  # 区块hash -> 挖出时间
+        self.arrivals: dict[str, list[float]] = {}  # 区块hash -> 各节点收到的时间
+
+    def connect(self, a: SimNode, b: SimNode, latency: tuple[float, float], bandwidth: float, loss: float) -> None:
+        if a is b:
+            return
+        delay = self.rng.uniform(*latency)
+        a.peers[b] = Link(delay, bandwidth, loss)
+        b.peers[a] = Link(delay, bandwidth, loss)
+
+    def record_mined(self, block: Block, node: SimNode) -> None:
+        self.mined[block.hash] = time.monotonic()
+
+    def record_arrival(self, block: Block, node: SimNode) -> None:
+        if block.hash in self.mined:
+            self.arrivals.setdefault(block.hash, []).append(time.monotonic() - self.mined[block.hash])
+
+    async def run(self, duration: float, block_interval: float, tx_rate: float, drain: float = 2.0) -> dict:
+        miners = [node for node in self.nodes if node.is_miner]
+        tasks = [asyncio.create_task(node.run()) for node in self.nodes]
+        tasks += [asyncio.create_task(node.mine(block_interval * len(miners))) for node in miners]
+        tasks += [asyncio.create_task(node.make_payments(tx_rate / len(miners))) for node in miners]
+        begin = time.monotonic()
+        await asyncio.sleep(duration)
+        for task in tasks[len(self.nodes):]:
+            task.cancel()  # 停止出块和发交易，再等在途消息送达
+        await asyncio.sleep(drain)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.report(time.monotonic() - begin - drain)
+
+    def report(self, elapsed: float) -> dict:
+        # 以多数节点所在的链为准(工作量相同的分叉各节点保留先收到的，末端可能不一致)
+        tips = Counter(node.node.blockchain.chain[-1].hash for node in self.nodes)
+        tip, agreeing = tips.most_common(1)[0]
+        reference = next(node.node for node in self.nodes if node.node.blockchain.chain[-1].hash == tip)
+        main_chain = reference.blockchain.chain
+        main_hashes = {block.hash for block in main_chain}
+        mined = len(self.mined)
+        stale = sum(1 for block_hash in self.mined if block_hash not in main_hashes)
+        delays = sorted(delay for block_hash, arrivals in self.arrivals.items() for delay in arrivals)
+        # 每个区块到达90%节点所需的时间
+        reach = sorted(
+            sorted(arrivals)[max(0, int(len(self.nodes) * 0.9) - 1)]
+            for arrivals in self.arrivals.values() if len(arrivals) >= int(len(self.nodes) * 0.9)
+        )
+        confirmed_txs = sum(len(block.data) for block in main_chain[1:])
+        return {
+            "nodes": len(self.nodes),
+            "miners": sum(1 for node in self.nodes if node.is_miner),
+            "elapsed_seconds": elapsed,
+            "blocks_mined": mined,
+            "main_chain_height": len(main_chain) - 1,
+            "stale_rate": stale / mined if mined else 0.0,
+            "orphans_stored": sum(node.node.orphan_blocks.stored_count for node in self.nodes),
+            "reorgs": self.instrumentation.counters.get("reorgs", 0),
+            "propagation_p50": percentile(delays, 50),
+            "propagation_p90": percentile(delays, 90),
+            "propagation_p99": percentile(delays, 99),
+            "reach_90pct_p50": percentile(reach, 50),
+            "blocks_per_second": (len(main_chain) - 1) / elapsed,
+            "tx_per_second": confirmed_txs / elapsed,
+            "tip_agreement": agreeing / len(self.nodes),
+            "messages_sent": self.messages_sent,
+            "messages_lost": self.messages_lost,
+            "megabytes_sent": self.bytes_sent / 1e6,
+            "compact_success_rate": self.compact_stats.success_rate,
+            "compact_round_trips": self.compact_stats.after_request,
+            "compact_failures": self.compact_stats.failed,
+            "compact_full_relays": self.compact_stats.full_relays,
+            "compact_megabytes_saved": self.compact_stats.bytes_saved / 1e6,
+        }
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def simulate(num_nodes: int, block_interval: float, duration: float = 20.0, tx_rate: float = 20.0, **network_options) -> dict:
+    """运行一次模拟并返回统计；节点的逐条输出被丢弃"""
+    network = Network(num_nodes, **network_options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(network.run(duration, block_interval, tx_rate))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a gossiping PoW network")
+    parser.add_argument("--nodes", default="10,50,100", help="comma separated node counts")
+    parser.add_argument("--intervals", default="1,2", help="comma separated mean block intervals (seconds)")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--degree", type=int, default=8)
+    parser.add_argument("--loss", type=float, default=0.01)
+    parser.add_argument("--bandwidth", type=float, default=1_000_000, help="bytes per second per link")
+    parser.add_argument("--tx-rate", type=float, default=20.0, help="transactions per second, network wide")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--full-blocks", action="store_true", help="relay full blocks instead of compact blocks")
+    args = parser.parse_args()
+
+    columns = ["nodes", "blocks_mined", "stale_rate", "orphans_stored", "propagation_p50", "propagation_p90",
+               "propagation_p99", "reach_90pct_p50", "blocks_per_second", "tx_per_second", "tip_agreement", "megabytes_sent"]
+    if not args.full_blocks:
+        columns += ["compact_success_rate", "compact_megabytes_saved"]
+    print("interval " + " ".join(f"{column:>22}" for column in columns))
+    for interval in (float(value) for value in args.intervals.split(",")):
+        for num_nodes in (int(value) for value in args.nodes.split(",")):
+            result = simulate(num_nodes, interval, args.duration, args.tx_rate, degree=args.degree, loss=args.loss,
+                              bandwidth=args.bandwidth, seed=args.seed, compact_relay=not args.full_blocks)
+            print(f"{interval:>8} " + " ".join(f"{result[column]:>22.4g}" for column in columns))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""基准测试套件
+
+哈希内核对比，每秒能尝试多少个nonce：
+1. legacy   : 改造前的做法，每个nonce都把 data/previous_hash/timestamp 重新字符串化、拼接、哈希并转成hex比较前缀
+2. header   : 定长二进制区块头(Merkle根只算一次)，但每个nonce仍调用一次 Block.calculate_hash() 重新打包和哈希
+3. midstate : 区块头前缀只哈希一次，缓存SHA-256中间状态，每个nonce copy()后追加8字节，直接比较原始digest
+4. backend_* : mining_backend.py 中当前机器可用的挖矿后端
+
+节点场景：
+- mine      : mine_block 在不同难度下的哈希速率
+- verify    : 链长 1k/10k/100k 时 verify_block 的吞吐量；1万笔交易的区块按顺序/按地址分组并行检查的耗时
+- mempool   : 1万-10万笔待确认交易时 get_transactions 的延迟
+- balance   : get_balance 的延迟
+- sync      : sync_with_network 按顺序/乱序输入的吞吐量
+- memory    : 从存储格式还原的主链区块、交易常驻内存的字节数(单独运行，默认100万个区块)
+
+结果写成JSON(默认 pow_bench_results.json，不提交)；指定基线文件时，比基线差超过阈值的指标会被标记为回归，退出码为1。
+提交的基线是 basics/pow_bench_baseline.json(完整套件)。基线与机器有关，和它比较时应在同一类机器上运行；
+性能有意变化后重新记录：
+  python basics/pow_bench.py suite --output basics/pow_bench_baseline.json
+
+用法:
+  python basics/pow_bench.py kernels [nonce数量]
+  python basics/pow_bench.py suite [--quick] [--output results.json] [--baseline basics/pow_bench_baseline.json] [--threshold 0.2]
+  python basics/pow_bench.py memory [--blocks 1000000] [--txs-per-block 2]
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import hashlib
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from chain_gen import ChainGenerator
+from header_store import HeaderStore
+from instrumentation import OFF, instrumentation
+from mining_backend import MiningBackend, available_backends, search_nonce
+from pow_demo import Block, Transaction, TransactionPool, ValidatorNode, block_work, genesis_block, target_from_prefix, target_to_bytes
+
+# 不可能满足的难度，保证每个内核都完整跑完 count 次
+UNREACHABLE_PREFIX = "0" * 64
+UNREACHABLE_TARGET = 1  # 同上，整数目标值版本
+
+
+def legacy_kernel(block: Block, count: int) -> None:
+    target_prefix = UNREACHABLE_PREFIX
+    for nonce in range(count):
+        sha = hashlib.sha256()
+        sha.update(str(block.data).encode() + str(block.previous_hash).encode() + str(block.timestamp).encode() + str(nonce).encode())
+        if sha.hexdigest()[:len(target_prefix)] == target_prefix:
+            break
+
+
+def header_kernel(block: Block, count: int) -> None:
+    target = target_to_bytes(UNREACHABLE_TARGET)
+    root = block.merkle_root()
+    for nonce in range(count):
+        block.nonce = nonce
+        if bytes.fromhex(block.calculate_hash(root)) <= target:
+            break
+
+
+def midstate_kernel(block: Block, count: int) -> None:
+    midstate = hashlib.sha256(block.header_prefix())
+    search_nonce(midstate, target_to_bytes(UNREACHABLE_TARGET), 0, count=count)
+
+
+def backend_kernel(backend: MiningBackend):
+    def kernel(block: Block, count: int) -> None:
+        backend.search(block.header_prefix(), target_to_bytes(UNREACHABLE_TARGET), 0, count=count)
+    return kernel
+
+
+KERNELS = [("legacy", legacy_kernel), ("header", header_kernel), ("midstate", midstate_kernel)]
+KERNELS += [(f"backend_{backend.name}", backend_kernel(backend)) for backend in available_backends()]  # MinerNode 可选的挖矿后端
+
+
+def make_block(num_transactions: int = 3) -> Block:
+    txs = [Transaction(f"sender{i}", f"receiver{i}", 1.0 + i, 0.1) for i in range(num_transactions)]
+    block = Block(txs, genesis_block.hash)
+    block.miner_address = genesis_block.miner_address
+    return block
+
+
+def bench_hash_kernels(count: int = 200_000, num_transactions: int = 3) -> dict[str, float]:
+    """返回每个内核的哈希速率(hashes/s)"""
+    block = make_block(num_transactions)
+    rates = {}
+    for name, kernel in KERNELS:
+        begin = time.perf_counter()
+        kernel(block, count)
+        rates[name] = count / (time.perf_counter() - begin)
+    return rates
+
+
+class Metric:
+    """一个基准测试结果；higher_is_better 决定和基线比较时哪个方向算变差"""
+
+    def __init__(self, value: float, unit: str, higher_is_better: bool):
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def to_dict(self) -> dict:
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+
+@contextlib.contextmanager
+def silenced():
+    """基准测试期间关闭节点的事件输出和print，避免控制台I/O计入耗时"""
+    level = instrumentation.level
+    instrumentation.set_level(OFF)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        instrumentation.set_level(level)
+
+
+def next_block(node, txs: list[Transaction]) -> Block:
+    """接在主链末端、可以通过验证但不加入链的候选区块"""
+    tip = node.blockchain.chain[-1]
+    block = Block(txs, tip.hash)
+    block.timestamp = tip.timestamp + datetime.timedelta(seconds=10)
+    block.miner_address = "bench-miner"
+    block.mine_block(node.calculate_expected_target(block))
+    return block
+
+
+def timed(fn, repeat: int) -> float:
+    """fn 重复 repeat 次的平均耗时(秒)"""
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - begin) / repeat
+
+
+def bench_mine(difficulties: tuple[int, ...], blocks_per_difficulty: int) -> dict[str, Metric]:
+    metrics = {}
+    for difficulty in difficulties:
+        hashes = 0
+        elapsed = 0.0
+        for i in range(blocks_per_difficulty):
+            block = make_block()
+            block.timestamp += datetime.timedelta(microseconds=i)
+            before = instrumentation.counters.get("hashes_tried", 0)
+            begin = time.perf_counter()
+            block.mine_block(target_from_prefix("0" * difficulty))
+            elapsed += time.perf_counter() - begin
+            hashes += instrumentation.counters["hashes_tried"] - before
+        metrics[f"mine.difficulty_{difficulty}.hashrate"] = Metric(hashes / elapsed, "H/s", True)
+    return metrics
+
+
+def bench_verify(chain_lengths: tuple[int, ...], repeat: int) -> dict[str, Metric]:
+    metrics = {}
+    generator = ChainGenerator(seed=0, txs_per_block=2)
+    node = generator.node
+    for length in chain_lengths:
+        generator.extend_to(length)
+        balances = node.spendable_balances()
+        rich = max(balances, key=balances.get)
+        block = next_block(node, [Transaction(rich, "bench-receiver", 1.0, 0.01, nonce) for nonce in range(3)])
+        seconds = timed(lambda: node.verify_block(block), repeat)
+        metrics[f"verify.chain_{length}.blocks_per_second"] = Metric(1 / seconds, "blocks/s", True)
+    return metrics
+
+
+def bench_verify_large_block(num_transactions: int, workers: int, repeat: int) -> dict[str, Metric]:
+    """大区块的交易检查耗时：顺序路径和按地址分组的并行路径(交易分散在约1000个发送方上)"""
+    generator = ChainGenerator(seed=0, txs_per_block=2, num_addresses=1000)
+    generator.extend_to(2000)
+    node = generator.node
+    balances = node.spendable_balances()
+    senders = [address for address in balances if balances[address] > 1]
+    txs = [Transaction(senders[i % len(senders)], f"bench-receiver{i}", 0.001, 0.0001) for i in range(num_transactions)]
+    block = next_block(node, txs)
+    metrics = {}
+    node.parallel_tx_min = 0
+    for path, path_workers in (("sequential", 1), ("parallel", workers)):
+        node.tx_validation_workers = path_workers
+        node.verify_block(block, check_pow=False)  # 预热：节点的进程池在第一次并行检查时创建，之后复用
+        seconds = timed(lambda: node.verify_block(block, check_pow=False), repeat)
+        metrics[f"verify.block_{num_transactions}_txs.{path}_ms"] = Metric(seconds * 1000, "ms", False)
+    node.close()
+    return metrics
+
+
+def bench_mempool(pool_sizes: tuple[int, ...], repeat: int) -> dict[str, Metric]:
+    metrics = {}
+    rng = random.Random(1)
+    for size in pool_sizes:
+        pool = TransactionPool()
+        senders = [f"sender{i}" for i in range(size // 10)]
+        for i in range(size):
+            pool.add_transaction(Transaction(rng.choice(senders), f"receiver{i % 100}", 1.0, rng.uniform(0.001, 1.0), i))
+        balances = {sender: 1e9 for sender in senders}
+        seconds = timed(lambda: pool.get_transactions(balances, max_count=100), repeat)
+        metrics[f"mempool.pending_{size}.get_transactions_ms"] = Metric(seconds * 1000, "ms", False)
+    return metrics
+
+
+def bench_balance(chain_length: int, repeat: int) -> dict[str, Metric]:
+    generator = ChainGenerator(seed=0, txs_per_block=2)
+    generator.extend_to(chain_length)
+    node = generator.node
+    addresses = sorted(node.address_index.tx_balances)
+    seconds = timed(lambda: [node.get_balance(address) for address in addresses], repeat) / len(addresses)
+    return {f"balance.chain_{chain_length}.get_balance_us": Metric(seconds * 1e6, "us", False)}
+
+
+def bench_sync(chain_length: int) -> dict[str, Metric]:
+    generator = ChainGenerator(seed=0, txs_per_block=2)
+    blocks = generator.extend_to(chain_length + 1)
+    shuffled = generator.delivery_order(blocks)
+    metrics = {}
+    for name, peer_blocks in (("in_order", blocks), ("shuffled", shuffled)):
+        node = ValidatorNode()
+        begin = time.perf_counter()
+        node.sync_with_network(peer_blocks)
+        elapsed = time.perf_counter() - begin
+        if node.blockchain.chain[-1].hash != blocks[-1].hash:
+            raise RuntimeError(f"sync ({name}) did not reach the source tip")
+        metrics[f"sync.{name}_{chain_length}.blocks_per_second"] = Metric(chain_length / elapsed, "blocks/s", True)
+    return metrics
+
+
+def bench_memory(num_blocks: int, txs_per_block: int) -> dict[str, Metric]:
+    """主链区块和交易的常驻内存(tracemalloc)：区块从存储格式还原，与从磁盘或网络加载时相同
+    每个区块的字节数在去掉交易之后测量，每笔交易的字节数是两次测量之差；
+    最后把同样的区块头写进列式的 HeaderStore(含哈希查找表)，对比每个高度的字节数
+    """
+    generator = ChainGenerator(seed=0, txs_per_block=txs_per_block, num_addresses=1000)
+    generator.node.prune_depth = 100  # 生成器自己的节点不需要保留整条链
+    payloads = []
+    while len(payloads) < num_blocks:
+        blocks = generator.extend_to(min(len(payloads) + 10_000, num_blocks) + 1)
+        payloads.extend(block.to_bytes() for block in blocks)
+        generator.main_blocks.clear()
+    del blocks
+
+    gc.collect()
+    tracemalloc.start()
+    blocks = [Block.from_bytes(payload) for payload in payloads]
+    with_transactions = tracemalloc.get_traced_memory()[0]
+    num_transactions = 0
+    for block in blocks:
+        num_transactions += len(block.data)
+        block.data = []
+    gc.collect()
+    headers_only = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    headers = HeaderStore()
+    chain_work = 0
+    for block in blocks:
+        chain_work += block_work(block)
+        headers.append(block._hash, block.merkle_root(), block.timestamp_us, block.nonce, block.target,
+                       block.block_reward, block.miner_address, chain_work)
+    columnar = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    metrics = {
+        "memory.bytes_per_block": Metric(headers_only / num_blocks, "B", False),
+        "memory.bytes_per_transaction": Metric((with_transactions - headers_only) / max(1, num_transactions), "B", False),
+        "memory.header_store_bytes_per_block": Metric(columnar / num_blocks, "B", False),
+    }
+    return metrics
+
+
+def run_suite(quick: bool = False) -> dict[str, Metric]:
+    """运行所有场景；quick 时缩小规模，用于冒烟测试"""
+    metrics = {}
+    with silenced():
+        rates = bench_hash_kernels(20_000 if quick else 200_000)
+        metrics.update({f"kernel.{name}.hashrate": Metric(rate, "H/s", True) for name, rate in rates.items()})
+        metrics.update(bench_mine((1, 2, 3) if quick else (1, 2, 3, 4), 3 if quick else 10))
+        metrics.update(bench_verify((1_000,) if quick else (1_000, 10_000, 100_000), 200 if quick else 2000))
+        metrics.update(bench_verify_large_block(2_000 if quick else 10_000, 4, 5 if quick else 20))
+        metrics.update(bench_mempool((10_000,) if quick else (10_000, 100_000), 20 if quick else 100))
+        metrics.update(bench_balance(1_000 if quick else 10_000, 20 if quick else 100))
+        metrics.update(bench_sync(500 if quick else 5_000))
+    return metrics
+
+
+def compare_to_baseline(metrics: dict[str, Metric], baseline: dict, threshold: float) -> list[str]:
+    """返回比基线差超过 threshold(比例)的指标说明"""
+    regressions = []
+    for name, metric in metrics.items():
+        reference = baseline.get("metrics", {}).get(name)
+        if reference is None or not reference["value"]:
+            continue
+        change = (metric.value - reference["value"]) / reference["value"]
+        worse = -change if metric.higher_is_better else change
+        if worse > threshold:
+            regressions.append(f"{name}: {reference['value']:.4g} -> {metric.value:.4g} {metric.unit} ({change:+.1%})")
+    return regressions
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for pow_demo")
+    subparsers = parser.add_subparsers(dest="command")
+    kernels = subparsers.add_parser("kernels", help="compare hashing kernels")
+    kernels.add_argument("count", type=int, nargs="?", default=200_000)
+    suite = subparsers.add_parser("suite", help="run all scenarios and write JSON results")
+    suite.add_argument("--quick", action="store_true", help="smaller sizes for a smoke run")
+    suite.add_argument("--output", default="pow_bench_results.json")
+    suite.add_argument("--baseline", help="previous results to compare against, e.g. basics/pow_bench_baseline.json")
+    suite.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression")
+    memory = subparsers.add_parser("memory", help="measure resident bytes per block and per transaction")
+    memory.add_argument("--blocks", type=int, default=1_000_000)
+    memory.add_argument("--txs-per-block", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.command == "memory":
+        with silenced():
+            metrics = bench_memory(args.blocks, args.txs_per_block)
+        for name, metric in metrics.items():
+            print(f"{name:<50} {metric.value:>14,.1f} {metric.unit}")
+        return 0
+
+    if args.command == "suite":
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if baseline.get("quick") != args.quick:
+                # --quick 用的数据规模不同，两种结果之间的比较没有意义
+                parser.error(f"{args.baseline} was recorded with quick={baseline.get('quick')}, run the suite the same way")
+        metrics = run_suite(args.quick)
+        for name, metric in metrics.items():
+            print(f"{name:<50} {metric.value:>14,.2f} {metric.unit}")
+        results = {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "quick": args.quick,
+            "metrics": {name: metric.to_dict() for name, metric in metrics.items()},
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+        if baseline is not None:
+            regressions = compare_to_baseline(metrics, baseline, args.threshold)
+            for line in regressions:
+                print(f"REGRESSION {line}")
+            if regressions:
+                return 1
+            print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%})")
+        return 0
+
+    count = args.count if args.command == "kernels" else 200_000
+    for num_transactions in (3, 100):
+        print(f"=== {count} nonces, block with {num_transactions} transactions ===")
+        rates = bench_hash_kernels(count, num_transactions)
+        for name, rate in rates.items():
+            print(f"{name:>16}: {rate:>12,.0f} H/s  ({rate / rates['legacy']:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
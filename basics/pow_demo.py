@@ -1,9 +1,123 @@
 #!/usr/bin/env python3
 # ref https://www.geeksforgeeks.org/implementing-the-proof-of-work-algorithm-in-python-for-blockchain-mining/
 
+import bisect
 import hashlib
 import datetime
+import functools
+import heapq
+from collections import ChainMap, OrderedDict, deque
+from collections.abc import Callable, Container, Mapping, MutableMapping, Sequence
+import itertools
+import json
+import multiprocessing
+import os
 import random
+import statistics
+import struct
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+
+from block_store import BlockStore
+from header_store import HeaderStore
+from instrumentation import DEBUG, INFO, instrumentation
+from mining_backend import NONCE_STRUCT, MidstateBackend, MiningBackend, get_backend, select_backend
+
+
+# 区块头的固定宽度二进制布局(大端)：
+#   previous_hash(32B) | merkle_root(32B) | miner(20B) | timestamp(8B, 微秒) | target(32B, 难度目标值)
+# 挖矿时在其后追加 nonce(8B)。交易只通过Merkle根进入区块头，区块头长度与交易数无关；区块头前缀在挖矿过程中保持不变，
+# 所以可以先把它喂给SHA-256，缓存中间状态(midstate)，每个nonce只需 copy() 后再哈希8个字节
+HEADER_STRUCT = struct.Struct(">32s32s20sq32s")  # 之后是 NONCE_STRUCT(见 mining_backend.py)
+_EPOCH = datetime.datetime(1970, 1, 1)
+PARALLEL_TX_MIN = 10_000  # 见 Node.parallel_tx_min
+BALANCE_EPSILON = 1e-9  # 账本按区块顺序累加浮点数，与交易检查的计算顺序不同，允许的舍入误差
+
+# 区块在存储中的序列化格式(大端)：
+#   hash(32B) | previous_hash(32B) | timestamp(8B) | nonce(8B) | block_reward(8B) | target(32B) | miner | data
+# 字符串 = 长度(2B) + UTF-8；data = 类型标记(1B)，0: 字符串，1: 交易数(4B) + 每笔交易的规范编码(见 Transaction.to_bytes)
+BLOCK_STRUCT = struct.Struct(">32s32sqQq32s")
+TX_FIELDS_STRUCT = struct.Struct(">ddQ")  # amount, fee, nonce
+TEXT_LENGTH_STRUCT = struct.Struct(">H")
+COUNT_STRUCT = struct.Struct(">I")
+
+# 难度用256位整数目标值表示：区块哈希(按大端整数)不大于目标值即有效，目标值越小越难
+MAX_TARGET = (1 << 256) - 1  # 最容易的目标，任何哈希都满足
+GENESIS_TARGET = (1 << 240) - 1  # 创世难度，相当于哈希以 "0000" 开头
+
+
+def _pack_text(text: str) -> bytes:
+    encoded = text.encode()
+    return TEXT_LENGTH_STRUCT.pack(len(encoded)) + encoded
+
+
+def _unpack_text(payload: bytes, offset: int) -> tuple[str, int]:
+    (length,) = TEXT_LENGTH_STRUCT.unpack_from(payload, offset)
+    offset += TEXT_LENGTH_STRUCT.size
+    return payload[offset:offset + length].decode(), offset + length
+
+
+def _unpack_address(payload: bytes, offset: int) -> tuple[str, int]:
+    # 地址在链上反复出现，驻留(intern)后所有区块和交易共享同一个字符串对象
+    address, offset = _unpack_text(payload, offset)
+    return sys.intern(address), offset
+
+
+def sha256d(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def merkle_root(hashes: list[bytes]) -> bytes:
+    """比特币式Merkle树：相邻两个哈希拼接后做双SHA-256，某一层为奇数个时复制最后一个；没有交易时为全零"""
+    if not hashes:
+        return bytes(32)
+    level = hashes
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        level = [sha256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+NO_PARENT = bytes(32)  # 创世区块的 previous_hash，对外仍表示为 "0"
+
+
+def hash_to_bytes(block_hash: str) -> bytes:
+    """十六进制哈希 -> 32字节；创世区块的 previous_hash "0" 视为全零"""
+    return bytes.fromhex(block_hash.rjust(64, "0"))
+
+
+def address_to_bytes(address: str | None) -> bytes:
+    """地址 -> 20字节定长标识(类似比特币的hash160)"""
+    if address is None:
+        return bytes(20)
+    return hashlib.sha256(address.encode()).digest()[:20]
+
+
+def target_from_prefix(target_prefix: str) -> int:
+    """把 "0000" 形式的十六进制前零换算成整数目标值：hexdigest 以 target_prefix 开头  等价于  哈希 <= 目标值"""
+    if target_prefix.strip("0"):
+        raise ValueError(f"Difficulty prefix must consist of zeros: {target_prefix!r}")
+    return (1 << (256 - 4 * len(target_prefix))) - 1
+
+
+@functools.lru_cache(maxsize=1024)
+def target_to_bytes(target: int) -> bytes:
+    """整数目标值 -> 32字节(大端)
+    digest(大端) <= 目标值的字节  等价于  int(digest) <= 目标值，挖矿时直接比较原始字节，不用每次转换成整数
+    """
+    if not 0 < target <= MAX_TARGET:
+        raise ValueError(f"Target out of range: {target:#x}")
+    return target.to_bytes(32, "big")
+
+
+def target_difficulty(target: int) -> float:
+    """目标值对应的难度：找到有效哈希的期望尝试次数"""
+    return (1 << 256) / (target + 1)
 
 
 class Block:
@@ -11,8 +125,13 @@ class Block:
     在分布式系统中：
     - 矿工负责创建新区块并填充交易数据
     - 所有节点都会验证区块的有效性
+
+    内存布局：__slots__(保留 __weakref__，StoredChain 用弱引用缓存区块)，哈希以32字节二进制、时间戳以整数微秒保存；
+    hash/previous_hash(十六进制字符串)和 timestamp(datetime)是按需换算的属性，原有的读写方式不变
     """
 
+    __slots__ = ("data", "_hash", "_previous_hash", "timestamp_us", "nonce", "target", "block_reward", "miner_address", "_merkle_root", "__weakref__")
+
     def __init__(self, data, previous_hash):
         # 由矿工节点执行：
         # - 收集一段时间内(约10分钟)的交易
@@ -21,39 +140,361 @@ class Block:
         self.previous_hash = previous_hash
         self.timestamp = datetime.datetime.now()
         self.nonce = 0
-        self.difficulty = "0000"  # 每个区块都存储当时的难度值
+        self.target = GENESIS_TARGET  # 每个区块都存储当时的难度目标值
         self.block_reward = 50  # 比特币最初的区块奖励是50 BTC
         self.miner_address = None  # 记录获得奖励的矿工地址
+        self._merkle_root = None  # 只有交易体被裁剪的区块头副本才使用
         self.hash = self.calculate_hash()
 
-    def calculate_hash(self):
+    @property
+    def hash(self) -> str:
+        return self._hash.hex()
+
+    @hash.setter
+    def hash(self, value: str) -> None:
+        self._hash = hash_to_bytes(value)
+
+    @property
+    def previous_hash(self) -> str:
+        return "0" if self._previous_hash == NO_PARENT else self._previous_hash.hex()
+
+    @previous_hash.setter
+    def previous_hash(self, value: str) -> None:
+        self._previous_hash = hash_to_bytes(value)
+
+    @property
+    def timestamp(self) -> datetime.datetime:
+        return _EPOCH + datetime.timedelta(microseconds=self.timestamp_us)
+
+    @timestamp.setter
+    def timestamp(self, value: datetime.datetime) -> None:
+        self.timestamp_us = (value - _EPOCH) // datetime.timedelta(microseconds=1)
+
+    def merkle_root(self) -> bytes:
+        # 交易的Merkle根，作为区块头的一部分；txid缓存在交易上，每个区块模板/每次验证只需计算一次树
+        if self.data is None:
+            return self._merkle_root  # 交易体已被裁剪，见 header_copy
+        if isinstance(self.data, str):
+            return hashlib.sha256(self.data.encode()).digest()  # 创世区块的数据是一段文字
+        return merkle_root([tx.txid for tx in self.data])
+
+    def header_copy(self) -> "Block":
+        """只保留区块头的副本：data 为 None，Merkle根单独保存，哈希重算、难度和工作量计算不受影响
+        原区块对象可能还被其他地方引用(比如模拟网络中的其他节点)，所以复制而不是原地清空
+        """
+        header = Block.__new__(Block)
+        header._hash = self._hash
+        header._previous_hash = self._previous_hash
+        header.timestamp_us = self.timestamp_us
+        header.nonce = self.nonce
+        header.target = self.target
+        header.block_reward = self.block_reward
+        header.miner_address = self.miner_address
+        header._merkle_root = self.merkle_root()
+        header.data = None
+        return header
+
+    def header_prefix(self, merkle_root: bytes | None = None) -> bytes:
+        # 区块头中除nonce以外的部分，挖矿过程中保持不变；已经算好的Merkle根可以直接传入
+        return HEADER_STRUCT.pack(
+            self._previous_hash,
+            self.merkle_root() if merkle_root is None else merkle_root,
+            address_to_bytes(self.miner_address),
+            self.timestamp_us,
+            target_to_bytes(self.target),
+        )
+
+    def calculate_hash(self, merkle_root: bytes | None = None):
         # 由所有节点执行：
         # 1. 矿工在挖矿过程中反复计算哈希
-        # 2. 其他节点在验证区块时计算一次
-        sha = hashlib.sha256()
-        sha.update(
-            str(self.data).encode()
-            + str(self.previous_hash).encode()
-            + str(self.timestamp).encode()
-            + str(self.nonce).encode()
-        )
+        # 2. 其他节点在验证区块时计算一次(重新计算Merkle根，确认交易没有被篡改)
+        sha = hashlib.sha256(self.header_prefix(merkle_root))
+        sha.update(NONCE_STRUCT.pack(self.nonce))
         return sha.hexdigest()
 
-    def mine_block(self, target_prefix: str):
+    @property
+    def difficulty(self) -> float:
+        """难度：在这个区块的目标值下找到有效哈希的期望尝试次数"""
+        return target_difficulty(self.target)
+
+    def meets_target(self) -> bool:
+        """区块哈希(按大端整数)是否不大于自身声明的目标值"""
+        try:
+            return 0 < self.target <= MAX_TARGET and int.from_bytes(self._hash, "big") <= self.target
+        except TypeError:
+            return False
+
+    def mine_block(self, target: int, backend: MiningBackend | None = None):
         # 仅由矿工节点执行：
         # - 这是最耗费算力的PoW过程
         # - 全网矿工竞争，谁先找到有效nonce谁就获得记账权
-        # - 目标前缀越长，难度越大
-        self.difficulty = target_prefix  # 保存挖矿时的难度值
-        while self.hash[:len(target_prefix)] != target_prefix:
+        # - 目标值越小，难度越大
+        # nonce搜索由挖矿后端完成(见 mining_backend.py)，默认用midstate内核
+        self.target = target  # 保存挖矿时的目标值
+        backend = backend or MidstateBackend()
+        self.nonce, digest, tried = backend.search(self.header_prefix(), target_to_bytes(target), self.nonce)
+        self.hash = digest.hex()
+        instrumentation.count("hashes_tried", tried)
+        if instrumentation.debug:
+            instrumentation.event(DEBUG, f"Block mined with difficulty {self.difficulty:.0f}: {self.hash}")
+
+    def mine_block_simple(self, target: int):
+        # 逐个nonce重新计算完整哈希并按整数和目标值比较，作为 mine_block 的参考实现
+        self.target = target
+        root = self.merkle_root()  # 每个nonce只重新哈希定长的区块头
+        self.hash = self.calculate_hash(root)
+        tried = 1
+        while int(self.hash, 16) > target:
             self.nonce += 1
-            self.hash = self.calculate_hash()
-        print(f"Block mined with difficulty {len(target_prefix)}: {self.hash}")
+            self.hash = self.calculate_hash(root)
+            tried += 1
+        instrumentation.count("hashes_tried", tried)
+        if instrumentation.debug:
+            instrumentation.event(DEBUG, f"Block mined with difficulty {self.difficulty:.0f}: {self.hash}")
+
+    def mine_block_parallel(self, target: int, workers: int | None = None, backend: MiningBackend | None = None,
+                            cancel: Callable[[], bool] | None = None) -> "MiningResult":
+        """多进程并行挖矿
+        - nonce空间按步长交错切分：第k个worker尝试 k, k+workers, k+2*workers, ...
+        - 所有worker共享一个停止信号(multiprocessing.Event)，每批nonce之间检查；任一worker找到有效nonce后设置它，其余worker随即退出
+        - 等待期间主进程每 CANCEL_POLL_SECONDS 秒调用一次 cancel，返回True时设置停止信号(比如收到了同高度的区块)，
+          这时没有找到nonce，区块不变，返回的 MiningResult.cancelled 为True
+        - 每个worker在子进程里按名称创建同一种挖矿后端，默认用midstate内核
+        - mine_block 保留为单线程参考实现
+        """
+        workers = workers or os.cpu_count() or 1
+        self.target = target
+        # 区块头前缀只在主进程计算一次，子进程各自据此建立midstate
+        header_prefix = self.header_prefix()
+        target_bytes = target_to_bytes(target)
+        backend_name = backend.name if backend is not None else MidstateBackend.name
+
+        stop_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_mining_worker,
+                args=(worker_id, header_prefix, target_bytes, worker_id, workers, stop_event, results, backend_name),
+                daemon=True,
+            )
+            for worker_id in range(workers)
+        ]
+        for p in processes:
+            p.start()
+
+        # 先取完所有worker的结果再join，避免子进程阻塞在队列写入上
+        winner = None
+        total_hashes = 0
+        hashrates = [0.0] * workers
+        pending = workers
+        while pending:
+            try:
+                worker_id, found, hashes, elapsed = results.get(timeout=None if cancel is None else CANCEL_POLL_SECONDS)
+            except Empty:
+                if not stop_event.is_set() and cancel():
+                    stop_event.set()
+                continue
+            pending -= 1
+            hashrates[worker_id] = hashes / elapsed if elapsed > 0 else 0.0
+            total_hashes += hashes
+            instrumentation.count("hashes_tried", hashes)
+            if found is not None and winner is None:
+                winner = found
+        for p in processes:
+            p.join()
+
+        if winner is None:
+            return MiningResult(None, None, hashrates, total_hashes)
+        self.nonce, self.hash = winner
+        if instrumentation.debug:
+            instrumentation.event(DEBUG, f"Block mined with difficulty {self.difficulty:.0f} by {workers} workers: {self.hash}")
+        return MiningResult(self.nonce, self.hash, hashrates, total_hashes)
+
+    def to_bytes(self) -> bytes:
+        """序列化为存储格式，见 BLOCK_STRUCT"""
+        parts = [
+            BLOCK_STRUCT.pack(
+                self._hash,
+                self._previous_hash,
+                self.timestamp_us,
+                self.nonce,
+                self.block_reward,
+                target_to_bytes(self.target),
+            ),
+            _pack_text(self.miner_address or ""),
+        ]
+        if isinstance(self.data, str):
+            parts.append(b"\x00" + _pack_text(self.data))
+        else:
+            parts.append(b"\x01" + COUNT_STRUCT.pack(len(self.data)))
+            parts.extend(tx.to_bytes() for tx in self.data)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "Block":
+        """从存储格式还原区块，不重新挖矿也不重新计算哈希"""
+        block_hash, previous_hash, timestamp, nonce, block_reward, target = BLOCK_STRUCT.unpack_from(payload, 0)
+        block = cls.__new__(cls)
+        block._hash = block_hash
+        block._previous_hash = previous_hash
+        block.timestamp_us = timestamp
+        block.nonce = nonce
+        block.target = int.from_bytes(target, "big")
+        block.block_reward = block_reward
+        block._merkle_root = None
+        miner_address, offset = _unpack_address(payload, BLOCK_STRUCT.size)
+        block.miner_address = miner_address or None
+
+        tag = payload[offset]
+        offset += 1
+        if tag == 0:
+            block.data, offset = _unpack_text(payload, offset)
+            return block
+        (count,) = COUNT_STRUCT.unpack_from(payload, offset)
+        offset += COUNT_STRUCT.size
+        block.data = []
+        for _ in range(count):
+            tx, offset = Transaction.from_bytes(payload, offset)
+            block.data.append(tx)
+        return block
+
+
+class MiningResult:
+    """并行挖矿结果：获胜的nonce/哈希(被取消时为None)，所有worker尝试的哈希总数，以及每个worker的算力(hashes/s)"""
+
+    def __init__(self, nonce: int | None, hash: str | None, worker_hashrates: list[float], hashes: int = 0):
+        self.nonce = nonce
+        self.hash = hash
+        self.worker_hashrates = worker_hashrates
+        self.hashes = hashes
+
+    @property
+    def cancelled(self) -> bool:
+        return self.nonce is None
+
+    @property
+    def total_hashrate(self) -> float:
+        return sum(self.worker_hashrates)
+
+
+# 每尝试这么多个nonce检查一次停止信号，兼顾响应速度和同步开销
+STOP_CHECK_INTERVAL = 4096
+# 多进程挖矿时主进程每隔这么多秒调用一次 cancel，检查是否要让worker停止
+CANCEL_POLL_SECONDS = 0.01
+
+
+class MiningStats:
+    """矿工的过时工作统计：模板在找到nonce之前被新区块淘汰时，已经算过的哈希全部作废"""
+
+    def __init__(self):
+        self.templates = 0  # 开始挖矿的区块模板数
+        self.stale_templates = 0  # 因为链末端变化而放弃的模板数
+        self.hashes = 0
+        self.stale_hashes = 0  # 花在被放弃模板上的哈希次数
+
+    @property
+    def stale_share(self) -> float:
+        """作废的哈希占全部哈希的比例"""
+        return self.stale_hashes / self.hashes if self.hashes else 0.0
+
+    def summary(self) -> str:
+        return (f"templates={self.templates}, stale_templates={self.stale_templates}, "
+                f"hashes={self.hashes}, stale_hashes={self.stale_hashes} ({self.stale_share:.1%})")
+
+
+def _mining_worker(worker_id, header_prefix, target, start_nonce, step, stop_event, results, backend_name=MidstateBackend.name):
+    """挖矿子进程：在分配到的nonce子空间中搜索，直到找到有效哈希或收到停止信号"""
+    found = None
+    hashes = 0
+    nonce = start_nonce
+    backend = get_backend(backend_name)  # 后端对象(比如hashlib中间状态)不一定能pickle，在子进程里按名称创建
+    begin = time.perf_counter()
+    while found is None and not stop_event.is_set():
+        found_nonce, digest, tried = backend.search(header_prefix, target, nonce, step, STOP_CHECK_INTERVAL)
+        hashes += tried
+        if found_nonce is not None:
+            found = (found_nonce, digest.hex())
+            stop_event.set()  # 通知其他worker停止
+        nonce += step * tried
+    results.put((worker_id, found, hashes, time.perf_counter() - begin))
+
+
+def _check_pow(item: tuple[bytes, int, str, int]) -> bool:
+    """无状态的PoW检查(可在子进程中执行)：重新计算哈希并与区块声明的哈希、难度目标比较"""
+    header_prefix, nonce, claimed_hash, target = item
+    sha = hashlib.sha256(header_prefix)
+    sha.update(NONCE_STRUCT.pack(nonce))
+    digest = sha.digest()
+    return digest.hex() == claimed_hash and 0 < target <= MAX_TARGET and int.from_bytes(digest, "big") <= target
+
+
+def group_transactions(txs: list["Transaction"], miner_address: str | None) -> list[list[int]]:
+    """按地址依赖图给区块内的交易分组，返回各组交易在 txs 中的下标
+    - 共享发送方或接收方的交易(传递地)在同一组，组内保持区块顺序，组按第一笔交易的位置排序
+    - 一笔交易只读取发送方的余额，不同组之间互不影响，可以各自独立检查
+    - 矿工地址收到每笔交易的手续费：它作为发送方出现时，余额依赖前面所有交易，只能整体作为一组
+    """
+    if any(tx.sender == miner_address for tx in txs):
+        return [list(range(len(txs)))] if txs else []
+    parent: dict[str, str] = {}
+
+    def find(address: str) -> str:
+        root = address
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while address != root:
+            parent[address], address = root, parent[address]  # 路径压缩
+        return root
+
+    for tx in txs:
+        sender, receiver = find(tx.sender), find(tx.receiver)
+        if sender != receiver:
+            parent[receiver] = sender
+    groups: dict[str, list[int]] = {}
+    for i, tx in enumerate(txs):
+        groups.setdefault(find(tx.sender), []).append(i)
+    return list(groups.values())
+
+
+def _check_tx_groups(groups: list[list[int]], txs: Mapping[int, "Transaction"], balances: Mapping[str, float],
+                     tx_index: Mapping[bytes, tuple[int, int]], parent_position: int,
+                     miner_address: str | None) -> tuple[int, float | None] | None:
+    """按区块顺序检查每组交易，规则与 Node._check_transactions_sequential 相同
+    在子进程中执行时 txs/balances/tx_index 只包含这些组用到的交易、地址余额和txid位置
+    返回这些组里第一笔不通过的交易 (下标, 发送方余额)，重放的交易余额为None；全部通过时返回None
+    """
+    first_failure = None
+    for group in groups:
+        temp_outputs: dict[str | None, float] = {}  # 本组地址的临时余额，组之间不共享
+        seen_txids = set()
+        for i in group:
+            tx = txs[i]
+            location = tx_index.get(tx.txid)
+            if tx.txid in seen_txids or (location is not None and location[0] <= parent_position):
+                failure = (i, None)
+                break
+            seen_txids.add(tx.txid)
+            sender_balance = temp_outputs[tx.sender] if tx.sender in temp_outputs else balances.get(tx.sender, 0)
+            if sender_balance < (tx.amount + tx.fee):
+                failure = (i, sender_balance)
+                break
+            temp_outputs[tx.sender] = sender_balance - (tx.amount + tx.fee)
+            receiver_balance = temp_outputs[tx.receiver] if tx.receiver in temp_outputs else balances.get(tx.receiver, 0)
+            temp_outputs[tx.receiver] = receiver_balance + tx.amount
+            miner_balance = temp_outputs[miner_address] if miner_address in temp_outputs else balances.get(miner_address, 0)
+            temp_outputs[miner_address] = miner_balance + tx.fee
+        else:
+            continue
+        if first_failure is None or failure[0] < first_failure[0]:
+            first_failure = failure
+    return first_failure
 
 
 # 创世区块应该是硬编码的，而非每个node自己创建(timestamp不一致会有问题)
 genesis_block = Block("Genesis Block", "0")
+genesis_block.timestamp = datetime.datetime(2009, 1, 3, 18, 15, 5)  # 固定时间戳，每次运行得到同一个创世区块
 genesis_block.miner_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"  # 设置创世区块矿工地址
+genesis_block.hash = genesis_block.calculate_hash()  # 矿工地址属于区块头，设置后重新计算哈希
 
 
 class Blockchain:
@@ -65,21 +506,1072 @@ class Blockchain:
 
     def __init__(self):
         self.chain = [genesis_block]  # 所有节点从相同的创世区块开始
-        self.difficulty = "0000"  # 当前网络难度
+        self.target = GENESIS_TARGET  # 当前网络难度目标值
         self.target_block_time = 1  # 目标出块时间(秒)
         self.difficulty_adjustment_interval = 4  # 每4个区块调整一次难度
+        self.max_adjustment_factor = 4  # 每次调整目标值最多放大或缩小到4倍(同比特币)，防止时间戳异常时难度剧烈波动
+        self.required_confirmations = 2  # 区块中的奖励和交易需要的确认数(比特币是100/6，演示中用2)
+        self.stale_fork_depth = 100  # 末端落后主链超过这么多个区块的分叉会被裁剪
+
+
+def block_work(block: Block) -> int:
+    # 找到不大于目标值的哈希的期望尝试次数(同比特币的 GetBlockProof)
+    return (1 << 256) // (block.target + 1)
+
+
+class BlockIndexEntry:
+    """区块树中的一个节点
+    所有分叉共享同一棵父指针树：主链和各分叉只是树上的不同末端，分叉不复制公共前缀
+    - parent: 父节点(创世区块为None)，沿着parent可以一路回溯到创世区块
+    - height: 区块高度，创世区块为0，等于区块在所在链中的下标
+    - chain_work: 从创世区块到本区块的累计工作量，分叉选择依据
+    - child_count: 已索引的子区块数，裁剪分叉时用来判断公共祖先
+    """
+
+    def __init__(self, block: Block, parent: "BlockIndexEntry | None"):
+        self.block = block
+        self.parent = parent
+        self.height = 0 if parent is None else parent.height + 1
+        self.chain_work = block_work(block) + (0 if parent is None else parent.chain_work)
+        self.child_count = 0
+
+
+class StoredIndexEntry(BlockIndexEntry):
+    """从存储按需构造的主链区块树节点
+    父节点通过索引按哈希查找，不在内存里保存整条父指针链；
+    链重组前 detach 会把父节点固定下来，之后存储截断也不影响它
+    """
+
+    def __init__(self, index: "StoredBlockIndex", block: Block, height: int, chain_work: int):
+        self._index = index
+        self._parent: BlockIndexEntry | None = None
+        self.block = block
+        self.height = height
+        self.chain_work = chain_work
+        self.child_count = 0  # 只统计内存中的子节点，主链上的下一个区块在 detach 时补上
+
+    @property
+    def parent(self) -> BlockIndexEntry | None:
+        if self._parent is not None or self.height == 0:
+            return self._parent
+        return self._index[self.block.previous_hash]
+
+    def detach(self) -> None:
+        self._parent = self.parent
+
+
+class StoredChain(Sequence):
+    """由 BlockStore 支撑的主链，用法与 list 相同
+    - 区块按需从存储反序列化，弱引用缓存：同一高度得到同一个对象，is 比较仍然成立
+    - 只有仍被引用的区块留在内存里，重启时不需要加载整条链
+    """
+
+    def __init__(self, store: BlockStore, genesis: Block):
+        self.store = store
+        self.genesis = genesis
+        self._loaded: weakref.WeakValueDictionary[int, Block] = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        length = len(self.store)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("chain index out of range")
+        if index == 0:
+            return self.genesis  # 创世区块是硬编码的，不从存储还原
+        block = self._loaded.get(index)
+        if block is None:
+            block = Block.from_bytes(self.store.read(index))
+            self._loaded[index] = block
+        return block
+
+    def append(self, block: Block) -> None:
+        chain_work = self.store.chain_work(len(self.store) - 1) + block_work(block)
+        self._loaded[self.store.append(block.hash, block.to_bytes(), chain_work)] = block
+
+    def extend(self, blocks) -> None:
+        for block in blocks:
+            self.append(block)
+
+    def __delitem__(self, index) -> None:
+        # 只支持链重组时截掉末尾：del chain[k:]
+        if not isinstance(index, slice) or index.stop is not None or index.step is not None:
+            raise TypeError("StoredChain only supports deleting a tail slice")
+        start = index.indices(len(self))[0]
+        for height in range(start, len(self)):
+            self._loaded.pop(height, None)
+        self.store.truncate(start)
+
+
+class HeaderChain(Sequence):
+    """由列式 HeaderStore 支撑的内存主链，用法与 list 相同
+    - 追加的区块先整体保留；drop_bodies 之后这些高度只剩 HeaderStore 里的一行，不再各占一个 Block 对象
+    - 访问已丢弃区块体的高度时按需构造只有区块头的 Block(data 为 None)，弱引用缓存，同一高度得到同一个对象
+    """
+
+    def __init__(self, headers: HeaderStore, genesis: Block):
+        self.headers = headers
+        self.genesis = genesis
+        self._bodies: dict[int, Block] = {}  # 还保留完整区块的高度
+        self._loaded: weakref.WeakValueDictionary[int, Block] = weakref.WeakValueDictionary()
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        length = len(self.headers)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("chain index out of range")
+        if index == 0:
+            return self.genesis
+        block = self._bodies.get(index) or self._loaded.get(index)
+        if block is None:
+            block = Block.__new__(Block)
+            (block._hash, block._previous_hash, block._merkle_root, block.timestamp_us,
+             block.nonce, block.target, block.block_reward, block.miner_address) = self.headers.fields(index)
+            block.data = None
+            self._loaded[index] = block
+        return block
+
+    def append(self, block: Block) -> None:
+        previous_work = self.headers.chain_work(len(self.headers) - 1) if len(self.headers) else 0
+        height = self.headers.append(
+            block._hash, block.merkle_root(), block.timestamp_us, block.nonce, block.target,
+            block.block_reward, block.miner_address, previous_work + block_work(block),
+        )
+        self._bodies[height] = block
+
+    def extend(self, blocks) -> None:
+        for block in blocks:
+            self.append(block)
+
+    def __delitem__(self, index) -> None:
+        # 只支持链重组时截掉末尾：del chain[k:]
+        if not isinstance(index, slice) or index.stop is not None or index.step is not None:
+            raise TypeError("HeaderChain only supports deleting a tail slice")
+        start = index.indices(len(self))[0]
+        for height in range(start, len(self)):
+            self._bodies.pop(height, None)
+            self._loaded.pop(height, None)
+        self.headers.truncate(start)
+
+    def drop_bodies(self, height: int) -> None:
+        """不再保留高度 <= height 的完整区块"""
+        for h in [h for h in self._bodies if h <= height]:
+            del self._bodies[h]
+
+
+class StoredBlockIndex:
+    """由 BlockStore 支撑的区块索引，用法与 dict[str, BlockIndexEntry] 相同
+    - 主链区块的树节点按需构造：哈希 -> 高度 查 hashes.dat，累计工作量读 index.dat，用弱引用缓存
+    - 分叉区块以及重组中离开主链的区块只保存在内存里
+    """
+
+    def __init__(self, store: BlockStore, chain: StoredChain):
+        self.store = store
+        self.chain = chain
+        self._entries: dict[str, BlockIndexEntry] = {}
+        self._loaded: weakref.WeakValueDictionary[str, BlockIndexEntry] = weakref.WeakValueDictionary()
+
+    def get(self, block_hash: str, default=None):
+        entry = self._entries.get(block_hash) or self._loaded.get(block_hash)
+        if entry is not None:
+            return entry
+        height = self.store.height_of(block_hash)
+        if height is None:
+            return default
+        entry = StoredIndexEntry(self, self.chain[height], height, self.store.chain_work(height))
+        self._loaded[block_hash] = entry
+        return entry
+
+    def __getitem__(self, block_hash: str) -> BlockIndexEntry:
+        entry = self.get(block_hash)
+        if entry is None:
+            raise KeyError(block_hash)
+        return entry
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._entries or block_hash in self._loaded or self.store.height_of(block_hash) is not None
+
+    def __setitem__(self, block_hash: str, entry: BlockIndexEntry) -> None:
+        if self.store.height_of(block_hash) is not None:
+            self._loaded[block_hash] = entry  # 已经在存储里的主链区块随时可以重新构造，不必常驻内存
+        else:
+            self._entries[block_hash] = entry
+
+    def __delitem__(self, block_hash: str) -> None:
+        self._entries.pop(block_hash, None)
+        self._loaded.pop(block_hash, None)
+
+    def detach_main_suffix(self, start_height: int) -> None:
+        """链重组截断存储之前调用：高度 >= start_height 的主链节点转为常驻内存"""
+        entries = [self[self.store.block_hash(height)] for height in range(start_height, len(self.store))]
+        if not entries:
+            return
+        for entry in entries:
+            if isinstance(entry, StoredIndexEntry):
+                entry.detach()
+            self._entries[entry.block.hash] = entry
+        # 从存储构造的节点不知道自己的子节点数，按内存中的分叉和主链上的下一个区块重新统计
+        fork_children: dict[str, int] = {}
+        for entry in self._entries.values():
+            fork_children[entry.block.previous_hash] = fork_children.get(entry.block.previous_hash, 0) + 1
+        for entry in entries:
+            entry.child_count = fork_children.get(entry.block.hash, 0)
+
+
+class StoredTxIndex(MutableMapping):
+    """由 BlockStore 的 txids.dat 支撑的交易索引，用法与 dict[bytes, (主链高度, 区块内位置)] 相同
+    查找和更新都直接读写 mmap 里的哈希表，检查点不再需要保存所有txid
+    """
+
+    def __init__(self, store: BlockStore):
+        self.store = store
+
+    @property
+    def indexed_blocks(self) -> int:
+        """高度低于这个值的主链区块的交易都已经索引"""
+        return self.store.txids_indexed
+
+    @indexed_blocks.setter
+    def indexed_blocks(self, count: int) -> None:
+        self.store.txids_indexed = count
+
+    def __getitem__(self, txid: bytes) -> tuple[int, int]:
+        location = self.store.txid_location(txid)
+        if location is None:
+            raise KeyError(txid)
+        return location
+
+    def __contains__(self, txid) -> bool:
+        return self.store.txid_location(txid) is not None
+
+    def __setitem__(self, txid: bytes, location: tuple[int, int]) -> None:
+        self.store.put_txid(txid, *location)
+
+    def __delitem__(self, txid: bytes) -> None:
+        if self.store.remove_txid(txid) is None:
+            raise KeyError(txid)
+
+    def __iter__(self):
+        return (txid for txid, _ in self.store.txid_items())
+
+    def items(self):
+        return self.store.txid_items()
+
+    def __len__(self) -> int:
+        return self.store.txid_count
+
+
+class SnapshotChain(Sequence):
+    """从状态快照启动的节点的主链，用法与 list 相同
+    只保存快照附带的最近几个区块和之后的区块；快照之前的区块(除创世区块外)不在本地，访问时抛出 ValueError
+    """
+
+    def __init__(self, genesis: Block, base_height: int, blocks: list[Block]):
+        self.genesis = genesis
+        self.base_height = base_height  # blocks[0] 的高度
+        self._blocks = list(blocks)
+
+    def __len__(self) -> int:
+        return self.base_height + len(self._blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chain index out of range")
+        if index >= self.base_height:
+            return self._blocks[index - self.base_height]
+        if index == 0:
+            return self.genesis
+        raise ValueError(f"Block at height {index} predates the snapshot at height {self.base_height}")
+
+    def __setitem__(self, index: int, block: Block) -> None:
+        if index < self.base_height:
+            raise ValueError(f"Block at height {index} predates the snapshot at height {self.base_height}")
+        self._blocks[index - self.base_height] = block
+
+    def append(self, block: Block) -> None:
+        self._blocks.append(block)
+
+    def extend(self, blocks) -> None:
+        self._blocks.extend(blocks)
+
+    def __delitem__(self, index) -> None:
+        # 只支持链重组时截掉末尾：del chain[k:]，且不能早于快照
+        if not isinstance(index, slice) or index.stop is not None or index.step is not None:
+            raise TypeError("SnapshotChain only supports deleting a tail slice")
+        start = index.indices(len(self))[0]
+        if start < self.base_height:
+            raise ValueError(f"Cannot truncate below the snapshot at height {self.base_height}")
+        del self._blocks[start - self.base_height:]
+
+
+class BalanceLedger:
+    """已确认余额账本
+    - balances 是应用了高度 1..height 所有区块之后的余额(创世区块奖励直接可用)
+    - 每应用一个区块记录一条undo日志(被修改地址的旧余额，None表示原来不存在)
+    - 链重组时只需回滚分叉点之后的区块，再重放新链上的区块
+    """
+
+    def __init__(self, genesis: Block):
+        self.balances: dict[str, float] = {genesis.miner_address: genesis.block_reward}
+        self.undo_logs: list[dict[str, float | None]] = []  # undo_logs[h - base_height - 1] 对应高度h的区块
+        self.base_height = 0  # 从检查点恢复时只保留最近的undo日志，更早的区块无法回滚
+
+    @property
+    def height(self) -> int:
+        return self.base_height + len(self.undo_logs)
+
+    def apply_block(self, block: Block) -> None:
+        """应用一个区块；有交易让发送方余额变成负数时不做任何修改，抛出 ValueError"""
+        balances = self.balances
+        undo = {}
+
+        def credit(address: str, amount: float) -> None:
+            if address not in undo:
+                undo[address] = balances.get(address)
+            balances[address] = balances.get(address, 0) + amount
+
+        # 先加入区块奖励，再处理交易(矿工只加手续费)
+        credit(block.miner_address, block.block_reward)
+        for tx in block.data:
+            if isinstance(tx, Transaction):
+                balance = balances.get(tx.sender, 0)
+                if balance - (tx.amount + tx.fee) < -BALANCE_EPSILON:
+                    self._restore(undo)
+                    raise ValueError(f"Block {block.hash[:10]}... overdraws {tx.sender}: balance {balance}, spending {tx.amount + tx.fee}")
+                credit(tx.sender, -(tx.amount + tx.fee))
+                credit(tx.receiver, tx.amount)
+                credit(block.miner_address, tx.fee)
+        self.undo_logs.append(undo)
+
+    def _restore(self, undo: dict[str, float | None]) -> None:
+        for address, old_balance in undo.items():
+            if old_balance is None:
+                del self.balances[address]
+            else:
+                self.balances[address] = old_balance
+
+    def rollback_block(self) -> None:
+        if not self.undo_logs:
+            raise ValueError(f"Cannot roll back below height {self.base_height}: undo history not retained")
+        self._restore(self.undo_logs.pop())
+
+    def discard_undo(self, height: int) -> None:
+        """丢弃高度 <= height 的区块的undo日志，之后不能再回滚到 height 以下"""
+        count = min(max(0, height - self.base_height), len(self.undo_logs))
+        del self.undo_logs[:count]
+        self.base_height += count
+
+    def view_at(self, height: int) -> ChainMap:
+        """高度height时的余额视图，不修改账本本身
+        把更高区块的undo日志叠加在当前余额之上，代价只与回退的区块数有关
+        """
+        if height < self.base_height:
+            raise ValueError(f"Cannot view balances below height {self.base_height}: undo history not retained")
+        overlay = {}
+        # 从高往低覆盖，最后写入的是紧邻height之上那个区块的undo，即高度height时的值
+        for undo in reversed(self.undo_logs[height - self.base_height:]):
+            for address, old_balance in undo.items():
+                overlay[address] = 0 if old_balance is None else old_balance
+        return ChainMap(overlay, self.balances)
+
+    def to_state(self, keep: int) -> dict:
+        """检查点：当前余额和最近 keep 个区块的undo日志"""
+        kept = self.undo_logs[max(0, len(self.undo_logs) - keep):]
+        return {"balances": self.balances, "base_height": self.height - len(kept), "undo_logs": kept}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "BalanceLedger":
+        ledger = cls.__new__(cls)
+        ledger.balances = state["balances"]
+        ledger.undo_logs = state["undo_logs"]
+        ledger.base_height = state["base_height"]
+        return ledger
+
+
+class AddressIndex:
+    """地址索引：随主链增量维护每个地址的累计余额和影响它的区块高度
+    - tx_balances: 交易(转入/转出/手续费)的累计净额，交易一上链就计入
+    - reward_totals: 区块奖励累计，查询余额时再扣除尚未成熟的奖励
+    - history: address -> [(高度, 交易净额, 区块奖励)]，按高度递增，可二分查找任意高度区间
+    """
+
+    def __init__(self):
+        self.tx_balances: dict[str, float] = {}
+        self.reward_totals: dict[str, float] = {}
+        # 从检查点恢复时为None，第一次查询历史时再从存储重建
+        self.history: dict[str, list[tuple[int, float, float]]] | None = {}
+        self.undo_logs: list[dict[str, tuple[float, float]]] = []  # undo_logs[h - base_height - 1] 对应高度h的区块
+        self.base_height = -1  # 还没有应用任何区块(包括创世区块)
+
+    @property
+    def height(self) -> int:
+        return self.base_height + len(self.undo_logs)
+
+    @staticmethod
+    def _block_deltas(block: Block) -> dict[str, list[float]]:
+        # 先汇总本区块对每个地址的影响，每个地址每个高度只记一条历史
+        deltas: dict[str, list[float]] = {}
+
+        def add(address: str, tx_delta: float = 0, reward: float = 0) -> None:
+            delta = deltas.setdefault(address, [0, 0])
+            delta[0] += tx_delta
+            delta[1] += reward
+
+        for tx in block.data:
+            if isinstance(tx, Transaction):
+                add(tx.sender, -(tx.amount + tx.fee))
+                add(tx.receiver, tx.amount)
+                add(block.miner_address, tx.fee)
+        add(block.miner_address, reward=block.block_reward)
+        return deltas
+
+    def apply_block(self, block: Block) -> None:
+        height = self.height + 1
+        undo = {}
+        for address, (tx_delta, reward) in self._block_deltas(block).items():
+            undo[address] = (self.tx_balances.get(address, 0), self.reward_totals.get(address, 0))
+            self.tx_balances[address] = undo[address][0] + tx_delta
+            self.reward_totals[address] = undo[address][1] + reward
+            if self.history is not None:
+                self.history.setdefault(address, []).append((height, tx_delta, reward))
+        self.undo_logs.append(undo)
+
+    def rollback_block(self) -> None:
+        if not self.undo_logs:
+            raise ValueError(f"Cannot roll back below height {self.base_height}: undo history not retained")
+        # 恢复旧值而不是做减法，避免浮点误差在多次重组后累积
+        for address, (tx_balance, reward_total) in self.undo_logs.pop().items():
+            self.tx_balances[address] = tx_balance
+            self.reward_totals[address] = reward_total
+            if self.history is not None:
+                self.history[address].pop()
+
+    def rebuild_history(self, chain: Sequence[Block]) -> None:
+        """按主链重新生成地址历史(检查点里不保存历史)"""
+        self.history = {}
+        for height in range(self.height + 1):
+            for address, (tx_delta, reward) in self._block_deltas(chain[height]).items():
+                self.history.setdefault(address, []).append((height, tx_delta, reward))
+
+    def discard_undo(self, height: int) -> None:
+        """丢弃高度 <= height 的区块的undo日志，之后不能再回滚到 height 以下"""
+        count = min(max(0, height - self.base_height), len(self.undo_logs))
+        del self.undo_logs[:count]
+        self.base_height += count
+
+    def view_at(self, height: int) -> tuple[dict[str, float], dict[str, float]]:
+        """高度height时的 (tx_balances, reward_totals)，不修改索引本身"""
+        if height < self.base_height:
+            raise ValueError(f"Cannot view the index below height {self.base_height}: undo history not retained")
+        tx_balances = dict(self.tx_balances)
+        reward_totals = dict(self.reward_totals)
+        for undo in reversed(self.undo_logs[height - self.base_height:]):
+            for address, (tx_balance, reward_total) in undo.items():
+                tx_balances[address] = tx_balance
+                reward_totals[address] = reward_total
+        return tx_balances, reward_totals
+
+    def to_state(self, keep: int) -> dict:
+        """检查点：累计余额和最近 keep 个区块的undo日志"""
+        kept = self.undo_logs[max(0, len(self.undo_logs) - keep):]
+        return {
+            "tx_balances": self.tx_balances,
+            "reward_totals": self.reward_totals,
+            "base_height": self.height - len(kept),
+            "undo_logs": kept,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "AddressIndex":
+        index = cls.__new__(cls)
+        index.tx_balances = state["tx_balances"]
+        index.reward_totals = state["reward_totals"]
+        index.history = None
+        index.undo_logs = [{address: tuple(old) for address, old in undo.items()} for undo in state["undo_logs"]]
+        index.base_height = state["base_height"]
+        return index
+
+    def get_history(self, address: str, from_height: int = 0, to_height: int | None = None) -> list[tuple[int, float, float]]:
+        """地址在 [from_height, to_height] 区间内的余额变动"""
+        entries = self.history.get(address, [])
+        lo = bisect.bisect_left(entries, from_height, key=lambda entry: entry[0])
+        hi = len(entries) if to_height is None else bisect.bisect_right(entries, to_height, key=lambda entry: entry[0])
+        return entries[lo:hi]
+
+
+class StateSnapshot:
+    """主链某个高度的状态快照：新节点从快照开始验证之后的区块，不必重放之前的整条链
+    - blocks: 快照高度及之前最近的几个完整区块，足够计算后续区块的期望难度、扣除未成熟的区块奖励
+    - chain_work: blocks[0] 处的累计工作量，用于之后的分叉选择
+    - ledger/address_index/tx_index: 快照高度时的已确认余额、地址累计余额、已上链的txid(拒绝重放)
+    - commitment: 以上内容规范编码的SHA-256；加载时重新计算，并与可信来源发布的值比较
+    """
+
+    def __init__(
+        self,
+        height: int,
+        blocks: list[Block],
+        chain_work: int,
+        ledger_height: int,
+        balances: dict[str, float],
+        tx_balances: dict[str, float],
+        reward_totals: dict[str, float],
+        tx_index: dict[bytes, tuple[int, int]],
+    ):
+        self.height = height
+        self.blocks = blocks
+        self.chain_work = chain_work
+        self.ledger_height = ledger_height
+        # 余额为0和地址不存在等价，去掉后同一高度的快照与节点经历过的重组无关
+        self.balances = {address: value for address, value in balances.items() if value}
+        self.tx_balances = {address: value for address, value in tx_balances.items() if value}
+        self.reward_totals = {address: value for address, value in reward_totals.items() if value}
+        self.tx_index = tx_index
+        self.commitment = self.compute_commitment()
+
+    @property
+    def block_hash(self) -> str:
+        return self.blocks[-1].hash
+
+    def compute_commitment(self) -> str:
+        # 区块体已经通过区块哈希(Merkle根)和哈希链与 block_hash 绑定，这里只需承诺区块哈希
+        canonical = json.dumps(
+            {
+                "height": self.height,
+                "blocks": [block.hash for block in self.blocks],
+                "chain_work": self.chain_work,
+                "ledger_height": self.ledger_height,
+                "balances": self.balances,
+                "tx_balances": self.tx_balances,
+                "reward_totals": self.reward_totals,
+                "tx_index": sorted([txid.hex(), *location] for txid, location in self.tx_index.items()),
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "height": self.height,
+            "blocks": [block.to_bytes().hex() for block in self.blocks],
+            "chain_work": self.chain_work,
+            "ledger_height": self.ledger_height,
+            "balances": self.balances,
+            "tx_balances": self.tx_balances,
+            "reward_totals": self.reward_totals,
+            "tx_index": {txid.hex(): location for txid, location in self.tx_index.items()},
+            "commitment": self.commitment,
+        })
+
+    @classmethod
+    def from_json(cls, text: str) -> "StateSnapshot":
+        state = json.loads(text)
+        blocks = [Block.from_bytes(bytes.fromhex(payload)) for payload in state["blocks"]]
+        if blocks and blocks[0].hash == genesis_block.hash:
+            blocks[0] = genesis_block  # 创世区块的数据是字符串，还原出来的对象与硬编码的相同
+        snapshot = cls(
+            state["height"], blocks, state["chain_work"], state["ledger_height"], state["balances"],
+            state["tx_balances"], state["reward_totals"],
+            {bytes.fromhex(txid): tuple(location) for txid, location in state["tx_index"].items()},
+        )
+        snapshot.commitment = state["commitment"]  # 保留声明的承诺值，加载时与重新计算的值比较
+        return snapshot
+
+
+class OrphanPool:
+    """孤块池
+    - 按 previous_hash 建索引，父区块到达时直接取出它的子区块，代价O(子区块数)
+    - 容量有限：超过 max_size 时按到达先后驱逐最老的孤块
+    - 到达超过 max_age 秒仍未连接的孤块过期丢弃
+    """
+
+    def __init__(self, max_size: int = 1000, max_age: float | None = 600):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._blocks: OrderedDict[str, tuple[Block, float]] = OrderedDict()  # hash -> (区块, 到达时间)，按到达顺序
+        self._by_parent: dict[str, dict[str, None]] = {}  # previous_hash -> 子区块hash(有序集合)
+        # 统计计数
+        self.stored_count = 0
+        self.connected_count = 0
+        self.evicted_count = 0
+        self.expired_count = 0
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._blocks
+
+    def values(self) -> list[Block]:
+        return [block for block, _ in self._blocks.values()]
+
+    def add(self, block: Block, now: float | None = None) -> bool:
+        """存入孤块，已存在时返回False"""
+        if block.hash in self._blocks:
+            return False
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        while len(self._blocks) >= self.max_size:
+            self.remove(next(iter(self._blocks)))
+            self.evicted_count += 1
+        self._blocks[block.hash] = (block, now)
+        self._by_parent.setdefault(block.previous_hash, {})[block.hash] = None
+        self.stored_count += 1
+        return True
+
+    def remove(self, block_hash: str) -> Block | None:
+        item = self._blocks.pop(block_hash, None)
+        if item is None:
+            return None
+        block = item[0]
+        siblings = self._by_parent[block.previous_hash]
+        del siblings[block_hash]
+        if not siblings:
+            del self._by_parent[block.previous_hash]
+        return block
+
+    def pop_children(self, parent_hash: str) -> list[Block]:
+        """取出(并移除)所有以 parent_hash 为父区块的孤块，按到达顺序"""
+        children = self._by_parent.pop(parent_hash, {})
+        return [self._blocks.pop(block_hash)[0] for block_hash in children]
+
+    def expire(self, now: float | None = None) -> None:
+        if self.max_age is None:
+            return
+        now = time.monotonic() if now is None else now
+        # 按到达顺序存储，过期的一定在最前面
+        while self._blocks:
+            block_hash, (_, arrived_at) = next(iter(self._blocks.items()))
+            if now - arrived_at <= self.max_age:
+                break
+            self.remove(block_hash)
+            self.expired_count += 1
+
+
+class BatchVerifyResult:
+    """批量验证结果：接受/拒绝的区块数，以及各阶段耗时(秒)
+    - accepted: 已接到区块树上(主链或分叉)
+    - orphaned: 父区块未知，仍在孤块池里等待
+    - rejected: 验证失败，或者是本批中验证失败的区块的后代
+    """
+
+    def __init__(self):
+        self.accepted = 0
+        self.orphaned = 0
+        self.rejected = 0
+        self.stage_seconds: dict[str, float] = {}
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self.stage_seconds.items())
+        return f"accepted={self.accepted}, orphaned={self.orphaned}, rejected={self.rejected}, {stages}"
 
 
 class Node:
     """模拟网络节点的基类"""
 
-    def __init__(self):
+    def __init__(self, data_dir: str | None = None):
         self.blockchain = Blockchain()
-        self.orphan_blocks: dict[str, Block] = {}  # hash -> block
-        self.fork_chains: list[list[Block]] = []
+        self.orphan_blocks = OrphanPool()
+        # 区块索引：hash -> 区块树节点，父区块查找、重复检测、高度查询都是O(1)
+        genesis = self.blockchain.chain[0]
+        self.block_index: dict[str, BlockIndexEntry] = {genesis.hash: BlockIndexEntry(genesis, None)}
+        # 分叉只记录末端：hash -> 区块树节点，每条分叉只多占O(1)内存
+        self.fork_tips: dict[str, BlockIndexEntry] = {}
+        # 已确认余额账本，随主链增量更新
+        self.ledger = BalanceLedger(genesis)
+        # 地址索引，get_balance 和地址历史查询不再遍历整条链
+        self.address_index = AddressIndex()
+        self.address_index.apply_block(genesis)
+        # 交易索引：txid -> (主链高度, 区块内位置)，用于拒绝重放和查询交易所在区块
+        self.tx_index: dict[bytes, tuple[int, int]] = {}
+        # 分级事件输出和运行指标(验证耗时、孤块池大小、重组深度等)
+        self.instrumentation = instrumentation
+        # 指定 data_dir 时主链保存在磁盘上，重启后从存储和余额检查点恢复，不必重新同步
+        self.store: BlockStore | None = None
+        self.checkpoint_interval = 1000  # 每追加这么多个主链区块写一次检查点
+        # 裁剪模式：比链末端深 prune_depth 以上、且已计入账本的区块只保留区块头，undo日志和地址历史也不再保留；
+        # 只能在这个深度内重组。None表示保留所有区块
+        self.prune_depth: int | None = None
+        self._pruned_height = 0  # 已经裁剪到的高度
+        # 交易数不少于 parallel_tx_min 的区块按地址分组，由 tx_validation_workers 个进程并行检查交易；
+        # 1 表示总是按顺序检查(顺序路径保留，用于对比两种路径的结果)
+        # 阈值来自 pow_bench 的 verify.block_*_txs：进程池复用后每个区块仍要把交易和余额传给子进程，开销与交易数成正比；
+        # 单核机器上 500~10000 笔时并行路径都比顺序路径慢约2.5倍(2000笔: 12ms / 5ms)，多核时也要到上万笔才可能划算
+        self.tx_validation_workers = 1
+        self.parallel_tx_min = PARALLEL_TX_MIN
+        self._tx_pool: ProcessPoolExecutor | None = None  # 第一次走并行路径时创建，之后复用，close() 时关闭
+        self._tx_pool_workers = 0
+        if data_dir is not None:
+            self._open_store(data_dir)
+
+    def _open_store(self, data_dir: str) -> None:
+        genesis = self.blockchain.chain[0]
+        store = BlockStore(data_dir)
+        if len(store) == 0:
+            store.append(genesis.hash, genesis.to_bytes(), block_work(genesis))
+        elif store.block_hash(0) != genesis.hash:
+            store.close()
+            raise ValueError(f"Block store {data_dir} was created with a different genesis block")
+        self.store = store
+        self.blockchain.chain = StoredChain(store, genesis)
+        self.block_index = StoredBlockIndex(store, self.blockchain.chain)
+        self.tx_index = StoredTxIndex(store)
+        self._restore_state()
+
+    def use_header_store(self) -> None:
+        """主链改由列式的 HeaderStore 保存(只能在新建的内存节点上调用)
+        与 prune_depth 一起使用时，被裁剪的高度只占 HeaderStore 里的一行，不再各保留一个区块头对象
+        """
+        if self.store is not None or len(self.blockchain.chain) > 1:
+            raise ValueError("The header store can only be enabled on a fresh in-memory node")
+        genesis = self.blockchain.chain[0]
+        chain = HeaderChain(HeaderStore(), genesis)
+        chain.append(genesis)
+        self.blockchain.chain = chain
+        self.block_index = StoredBlockIndex(chain.headers, chain)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.store.directory, "state.json")
+
+    def _restore_state(self) -> None:
+        """从检查点恢复账本和地址索引，再重放检查点之后的区块
+        检查点缺失或与存储中的链不一致(比如检查点之后发生过更深的重组)时从创世区块重放
+        交易索引在存储的 txids.dat 里，只补上还没有索引的区块
+        """
+        events = self.instrumentation
+        chain = self.blockchain.chain
+        try:
+            with open(self._state_path()) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = None
+        if state is not None and state["height"] < len(chain) and self.store.block_hash(state["height"]) == state["hash"]:
+            self.ledger = BalanceLedger.from_state(state["ledger"])
+            self.address_index = AddressIndex.from_state(state["address_index"])
+        elif events.info:
+            events.event(INFO, f"No usable checkpoint, rebuilding balances from {len(chain)} stored blocks")
+        for height in range(self.address_index.height + 1, len(chain)):
+            self.address_index.apply_block(chain[height])
+        for height in range(self.tx_index.indexed_blocks, len(chain)):
+            self._index_transactions(chain[height], height)
+        self._update_ledger()
+        if events.info:
+            events.event(INFO, f"Restored chain from {self.store.directory}: height {len(chain) - 1}, tip {chain[-1].hash[:10]}...")
+
+    def checkpoint(self) -> None:
+        """把区块和交易索引刷到磁盘后写余额检查点；保留 stale_fork_depth 个区块的undo日志，重启后仍能处理这个深度内的重组
+        检查点只有链末端、账本和地址索引，大小随地址数增长，不随交易数增长
+        """
+        if self.store is None:
+            return
+        self.store.flush()
+        chain = self.blockchain.chain
+        keep = self.blockchain.stale_fork_depth
+        state = {
+            "height": len(chain) - 1,
+            "hash": chain[-1].hash,
+            "ledger": self.ledger.to_state(keep),
+            "address_index": self.address_index.to_state(keep),
+        }
+        # 先写临时文件再原子替换，崩溃时不会留下写了一半的检查点
+        path = self._state_path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self) -> None:
+        if self._tx_pool is not None:
+            self._tx_pool.shutdown()
+            self._tx_pool = None
+        if self.store is not None:
+            self.checkpoint()
+            self.store.close()
+            self.store = None
+
+    def export_snapshot(self, height: int | None = None) -> StateSnapshot:
+        """导出主链高度 height(默认链末端)的状态快照，height 需要在保留的undo日志范围内"""
+        chain = self.blockchain.chain
+        height = len(chain) - 1 if height is None else height
+        if not 0 <= height < len(chain):
+            raise ValueError(f"Height {height} is not on the main chain")
+        # 与链末端为 height 的节点一致：账本只应用到已获得足够确认的高度
+        ledger_height = max(0, height + 1 - self.blockchain.required_confirmations)
+        balances = dict(self.ledger.view_at(ledger_height))
+        tx_balances, reward_totals = self.address_index.view_at(height)
+        tx_index = {txid: location for txid, location in self.tx_index.items() if location[0] <= height}
+        # 附带的区块要覆盖一个难度调整周期(计算期望难度时沿父指针回溯)和未成熟奖励的区块
+        window = max(self.blockchain.difficulty_adjustment_interval + 1, self.blockchain.required_confirmations)
+        blocks = chain[max(0, height - window + 1):height + 1]
+        chain_work = self.block_index[blocks[0].hash].chain_work
+        return StateSnapshot(height, blocks, chain_work, ledger_height, balances, tx_balances, reward_totals, tx_index)
+
+    def load_snapshot(self, snapshot: StateSnapshot, trusted_commitment: str | None = None) -> None:
+        """从状态快照启动：检查承诺值和附带区块的哈希链，不重放快照之前的区块
+        之后用 sync_with_network 等正常流程接收快照之后的区块头和区块；早于快照高度的重组会被拒绝
+        """
+        events = self.instrumentation
+        if self.store is not None or len(self.blockchain.chain) > 1:
+            raise ValueError("A snapshot can only be loaded into a fresh in-memory node")
+        commitment = snapshot.compute_commitment()
+        if commitment != snapshot.commitment:
+            raise ValueError(f"Snapshot commitment mismatch: computed {commitment}, snapshot claims {snapshot.commitment}")
+        if trusted_commitment is not None and commitment != trusted_commitment:
+            raise ValueError(f"Snapshot commitment {commitment} does not match the trusted commitment {trusted_commitment}")
+
+        genesis = self.blockchain.chain[0]
+        blocks = snapshot.blocks
+        base_height = snapshot.height - len(blocks) + 1
+        if base_height < 0 or (base_height == 0 and blocks[0].hash != genesis.hash):
+            raise ValueError("Snapshot blocks do not start from the genesis block")
+        for i, block in enumerate(blocks):
+            if i and block.previous_hash != blocks[i - 1].hash:
+                raise ValueError(f"Snapshot block {block.hash[:10]}... does not extend the previous snapshot block")
+            if block is not genesis and (block.calculate_hash() != block.hash or not block.meets_target()):
+                raise ValueError(f"Snapshot block {block.hash[:10]}... has an invalid proof of work")
+
+        self.blockchain.chain = SnapshotChain(genesis, base_height, blocks)
+        self._pruned_height = base_height  # 快照之前的区块本来就不在本地
+        if base_height == 0:
+            for block in blocks[1:]:
+                self._index_block(block)
+        else:
+            # 快照之前的区块不在本地，最早的快照区块作为区块树的根，高度和累计工作量取自快照
+            root = BlockIndexEntry(blocks[0], None)
+            root.height = base_height
+            root.chain_work = snapshot.chain_work
+            self.block_index = {blocks[0].hash: root}
+            for block in blocks[1:]:
+                self._index_block(block)
+        self.ledger = BalanceLedger.from_state({"balances": dict(snapshot.balances), "base_height": snapshot.ledger_height, "undo_logs": []})
+        self.address_index = AddressIndex.from_state({
+            "tx_balances": dict(snapshot.tx_balances),
+            "reward_totals": dict(snapshot.reward_totals),
+            "base_height": snapshot.height,
+            "undo_logs": [],
+        })
+        self.tx_index = dict(snapshot.tx_index)
+        self._update_ledger()
+        if events.info:
+            events.event(INFO, f"Loaded snapshot at height {snapshot.height}, tip {snapshot.block_hash[:10]}..., commitment {commitment[:10]}...")
+
+    def is_on_main_chain(self, entry: BlockIndexEntry) -> bool:
+        # 主链的下标就是高度，比较同一高度上的区块即可
+        chain = self.blockchain.chain
+        return entry.height < len(chain) and chain[entry.height] is entry.block
+
+    def _index_block(self, block: Block) -> BlockIndexEntry:
+        parent = self.block_index[block.previous_hash]
+        entry = BlockIndexEntry(block, parent)
+        parent.child_count += 1
+        self.block_index[block.hash] = entry
+        return entry
+
+    def _index_transactions(self, block: Block, height: int) -> None:
+        if not isinstance(block.data, str):
+            for position, tx in enumerate(block.data):
+                self.tx_index[tx.txid] = (height, position)
+        if isinstance(self.tx_index, StoredTxIndex):
+            self.tx_index.indexed_blocks = height + 1
+
+    def _unindex_transactions(self, block: Block) -> None:
+        if isinstance(block.data, str):
+            return
+        for tx in block.data:
+            self.tx_index.pop(tx.txid, None)
+
+    def append_to_main_chain(self, block: Block) -> None:
+        # 所有主链追加都经过这里，保证索引同步更新
+        self.blockchain.chain.append(block)
+        self._index_block(block)
+        self.address_index.apply_block(block)
+        self._index_transactions(block, len(self.blockchain.chain) - 1)
+        self._update_ledger()
+        self.prune_stale_forks()
+        if self.prune_depth is not None:
+            self.prune_block_bodies()
+        if self.store is not None and len(self.blockchain.chain) % self.checkpoint_interval == 0:
+            self.checkpoint()
+
+    def prune_block_bodies(self) -> None:
+        """裁剪模式：把深度超过 prune_depth 且已计入账本的主链区块换成只有区块头的副本
+        同时丢弃这些高度的undo日志，内存占用不再随链上的交易增长(区块头和交易索引除外)
+        """
+        chain = self.blockchain.chain
+        # 至少保留一个难度调整周期和未确认的区块，计算期望难度、未成熟奖励和导出快照都只用到这些区块
+        depth = max(self.prune_depth, self.blockchain.difficulty_adjustment_interval + 1, self.blockchain.required_confirmations)
+        height = min(len(chain) - 1 - depth, self.ledger.height)
+        if height <= self._pruned_height:
+            return
+        self.ledger.discard_undo(height)
+        self.address_index.discard_undo(height)
+        self.address_index.history = None  # 地址历史需要区块体，裁剪模式不维护
+        if isinstance(chain, HeaderChain):
+            chain.drop_bodies(height)
+        elif self.store is None:  # 有存储时区块体只在磁盘上，不占内存
+            for h in range(self._pruned_height + 1, height + 1):
+                entry = self.block_index[chain[h].hash]
+                entry.block = chain[h] = chain[h].header_copy()
+        self._pruned_height = height
+
+    def _update_ledger(self) -> None:
+        # 每个区块在获得足够确认时应用到账本，且只应用一次
+        chain = self.blockchain.chain
+        confirmed_height = max(0, len(chain) - self.blockchain.required_confirmations)
+        while self.ledger.height < confirmed_height:
+            self.ledger.apply_block(chain[self.ledger.height + 1])
+
+    def _attach_block(self, block: Block) -> bool:
+        """把父区块已知的区块接到区块树上；父区块未知时返回False"""
+        events = self.instrumentation
+        parent = self.block_index.get(block.previous_hash)
+        if parent is None:
+            return False
+
+        if self.blockchain.chain[-1] is parent.block:
+            # 父区块是主链最后一个，直接添加到主链
+            self.append_to_main_chain(block)
+            if events.debug:
+                events.event(DEBUG, f"Block added to main chain: {block.hash[:10]}...")
+        elif self.fork_tips.pop(parent.block.hash, None) is not None:
+            # 父区块是某条分叉的末端，延长这条分叉
+            self.fork_tips[block.hash] = self._index_block(block)
+            if events.debug:
+                events.event(DEBUG, f"Block added to fork chain: {block.hash[:10]}...")
+        else:
+            # 父区块在某条链的中间，从父区块处分出新的分叉，只需记录新末端
+            self.fork_tips[block.hash] = self._index_block(block)
+            if events.info:
+                events.event(INFO, f"New fork chain created at height {parent.height}")
+        if self.orphan_blocks.remove(block.hash) is not None:
+            self.orphan_blocks.connected_count += 1
+        return True
+
+    def select_best_chain(self) -> None:
+        """分叉选择：累计工作量最大的链成为主链(工作量相同时保留先收到的)"""
+        events = self.instrumentation
+        main_tip = self.block_index[self.blockchain.chain[-1].hash]
+        while True:
+            best = max(self.fork_tips.values(), key=lambda entry: entry.chain_work, default=None)
+            if best is None or best.chain_work <= main_tip.chain_work:
+                return
+            if self.switch_main_chain(best):
+                if events.info:
+                    events.event(INFO, f"Switched to chain with more work: height {best.height}, work {best.chain_work}")
+                return
+            if best.block.hash in self.fork_tips:
+                return  # 无法回滚到分叉点，分叉保留；含无效区块的分叉已经丢弃，继续看下一条
+
+    def switch_main_chain(self, new_tip: BlockIndexEntry) -> bool:
+        """切换到以 new_tip 为末端的链(重组)，只处理分叉点之后的区块
+        分叉区块到达时父区块不在主链上，交易还没有检查过：回滚到分叉点后逐个检查、再应用到账本和索引；
+        有区块不通过时丢弃它及之后的分叉区块，恢复原来的主链，返回False
+        分叉点早于保留的undo日志(从检查点恢复后)时无法回滚，返回False
+        """
+        events = self.instrumentation
+        # 沿父指针回溯到主链，找到分叉点
+        path = []
+        entry = new_tip
+        while not self.is_on_main_chain(entry):
+            path.append(entry.block)
+            entry = entry.parent
+        path.reverse()
+        fork_height = entry.height
+        if fork_height < max(self.ledger.base_height, self.address_index.base_height):
+            if events.info:
+                events.event(INFO, f"Reorg at height {fork_height} rejected: undo history not retained")
+            return False
+
+        chain = self.blockchain.chain
+        if isinstance(self.block_index, StoredBlockIndex):
+            self.block_index.detach_main_suffix(fork_height + 1)  # 截断存储之前把这些节点留在内存里
+        old_tip = self.block_index[chain[-1].hash]
+        old_blocks = chain[fork_height + 1:]
+        self._truncate_main_chain(fork_height)
+        for i, block in enumerate(path):
+            # 父区块已经在主链上，按接在主链末端的区块完整检查(难度目标、重放、余额)
+            if not self._verify_block(block, check_pow=False):
+                if events.info:
+                    events.event(INFO, f"Reorg aborted: fork block {block.hash[:10]}... at height {fork_height + 1 + i} is invalid")
+                self._truncate_main_chain(fork_height)
+                self._extend_main_chain(old_blocks)
+                self._discard_fork(new_tip, block)
+                return False
+            self._extend_main_chain([block])
+
+        # 旧主链在分叉点之后的部分成为一条分叉，只需记录它的末端
+        events.count("reorgs")
+        events.observe("reorg_depth", len(old_blocks))
+        if old_tip.height > fork_height:
+            self.fork_tips[old_tip.block.hash] = old_tip
+        self.fork_tips.pop(new_tip.block.hash, None)
+        self.prune_stale_forks()
+        return True
 
-    def process_new_block(self, block: Block) -> None:
+    def _truncate_main_chain(self, height: int) -> None:
+        """截掉高度 height 之后的主链区块，账本、地址索引和交易索引回滚到 height"""
+        chain = self.blockchain.chain
+        for block in chain[height + 1:]:
+            self._unindex_transactions(block)
+        del chain[height + 1:]
+        while self.ledger.height > height:
+            self.ledger.rollback_block()
+        while self.address_index.height > height:
+            self.address_index.rollback_block()
+
+    def _extend_main_chain(self, blocks: list[Block]) -> None:
+        """把已经在区块树上的区块依次接到主链末端，更新账本、地址索引和交易索引"""
+        chain = self.blockchain.chain
+        for block in blocks:
+            chain.append(block)
+            self._index_transactions(block, len(chain) - 1)
+            self.address_index.apply_block(block)
+            self._update_ledger()
+
+    def _discard_fork(self, tip: BlockIndexEntry, invalid: Block) -> None:
+        """从区块树中删除无效区块 invalid 和分叉上它之后的区块，它之前的有效部分仍作为分叉保留"""
+        self.fork_tips.pop(tip.block.hash, None)
+        stop = self.block_index[invalid.hash].parent
+        entry = tip
+        while entry is not stop and entry.child_count == 0:
+            del self.block_index[entry.block.hash]
+            entry.parent.child_count -= 1
+            entry = entry.parent
+        if entry.child_count == 0 and not self.is_on_main_chain(entry):
+            self.fork_tips[entry.block.hash] = entry
+
+    def prune_stale_forks(self) -> None:
+        """裁剪末端落后主链超过 stale_fork_depth 的分叉，从末端一直删到与其他链共享的祖先"""
+        events = self.instrumentation
+        min_height = len(self.blockchain.chain) - 1 - self.blockchain.stale_fork_depth
+        stale = [entry for entry in self.fork_tips.values() if entry.height < min_height]
+        for entry in stale:
+            del self.fork_tips[entry.block.hash]
+            while entry.child_count == 0 and not self.is_on_main_chain(entry):
+                del self.block_index[entry.block.hash]
+                entry.parent.child_count -= 1
+                entry = entry.parent
+            if events.info:
+                events.event(INFO, f"Pruned stale fork at height {entry.height}")
+
+    def process_new_block(self, block: Block, pow_checked: bool = False) -> None:
         """处理新区块，包括分叉处理
+        pow_checked: 调用方已经完成哈希重算和难度目标检查(见 verify_blocks_batch)
 
         分叉场景示例:
         时间轴:
@@ -124,283 +1616,468 @@ class Node:
            - 6个确认使得攻击者重组链的概率极低
         2. 去中心化(算力分散)对网络安全至关重要
         """
+        events = self.instrumentation
         # 1. 先验证区块本身是否有效
-        if not self.verify_block(block):
-            print(f"Invalid block rejected: {block.hash[:10]}...")
+        if not self.verify_block(block, check_pow=not pow_checked):
+            if events.info:
+                events.event(INFO, f"Invalid block rejected: {block.hash[:10]}...")
             return
 
-        # 2. 检查主链上是否已经有这个区块
-        if block.hash in [b.hash for b in self.blockchain.chain]:
-            print(f"Duplicate block ignored: {block.hash[:10]}...")
+        # 2. 检查是否已经有这个区块(主链或分叉链)
+        if block.hash in self.block_index:
+            if events.debug:
+                events.event(DEBUG, f"Duplicate block ignored: {block.hash[:10]}...")
             return
 
-        # 3. 检查在主链上是否有父区块
-        for i, b in enumerate(self.blockchain.chain):
-            if b.hash == block.previous_hash:
-                if i == len(self.blockchain.chain) - 1:
-                    # 父区块是主链最后一个，直接添加到主链
-                    self.blockchain.chain.append(block)
-                    print(f"Block added to main chain: {block.hash[:10]}...")
-                else:
-                    # 创建新的分叉链
-                    new_fork = self.blockchain.chain[:i + 1] + [block]
-                    self.fork_chains.append(new_fork)
-                    print(f"New fork chain created at height {i}")
-                self.try_connect_orphans(block.hash)
-                return
-
-        # 4. 如果主链上没找到，检查所有分叉链
-        for fork_chain in self.fork_chains:
-            if block.previous_hash == fork_chain[-1].hash:
-                fork_chain.append(block)
-                print(f"Block added to fork chain: {block.hash[:10]}...")
-                self.try_connect_orphans(block.hash)
-                return
+        # 3. 通过索引找到父区块，接到主链或分叉链上
+        if self._attach_block(block):
+            self.try_connect_orphans(block.hash)
+            return
 
-        # 5. 如果还是找不到父区块，才放入孤块池
-        if block.hash not in self.orphan_blocks:  # 避免重复添加
-            self.orphan_blocks[block.hash] = block
-            print(f"Orphan block stored: {block.hash[:10]}...")
+        # 4. 如果找不到父区块，才放入孤块池
+        if self.orphan_blocks.add(block):  # 避免重复添加
+            if events.debug:
+                events.event(DEBUG, f"Orphan block stored: {block.hash[:10]}...")
+            events.gauge("orphan_pool_size", len(self.orphan_blocks))
 
     def try_connect_orphans(self, parent_hash: str) -> None:
         # 尝试连接依赖这个区块的孤块
-        connected = []
-        to_delete = []  # 记录需要删除的恶意/无效区块
-
-        for orphan_hash, orphan_block in list(self.orphan_blocks.items()):
-            if orphan_block.previous_hash == parent_hash:
-                if self.verify_block(orphan_block):
-                    self.blockchain.chain.append(orphan_block)
-                    print(f"Previous-Orphan Block added to some chain: {orphan_block.hash[:10]}...")
-                    connected.append(orphan_hash)
-                    # 递归处理
-                    self.try_connect_orphans(orphan_block.hash)
+        # 用显式的工作队列代替递归：一长串乱序到达的区块也不会超出递归深度
+        events = self.instrumentation
+        worklist = deque([parent_hash])
+        while worklist:
+            for orphan_block in self.orphan_blocks.pop_children(worklist.popleft()):
+                if self.verify_block(orphan_block) and self._attach_block(orphan_block):
+                    if events.info:
+                        events.event(INFO, f"Previous-Orphan Block added to some chain: {orphan_block.hash[:10]}...")
+                    self.orphan_blocks.connected_count += 1
+                    events.count("orphans_connected")
+                    worklist.append(orphan_block.hash)
                 else:
-                    print(f"Malicious/invalid orphan block detected and removed: {orphan_hash[:10]}...")
-                    to_delete.append(orphan_hash)
-
-        # 移除已连接的有效区块和无效区块
-        for hash in connected + to_delete:
-            del self.orphan_blocks[hash]
-
-    def sync_with_network(self, peer_blocks: list[Block]) -> None:
-        print("\nNode: Starting blockchain sync...")
-
-        # 先处理所有区块，可能都会进入孤块池
+                    # 恶意/无效区块已经从孤块池中移除
+                    if events.info:
+                        events.event(INFO, f"Malicious/invalid orphan block detected and removed: {orphan_block.hash[:10]}...")
+                    events.count("orphans_rejected")
+        events.gauge("orphan_pool_size", len(self.orphan_blocks))
+
+    def sync_with_network(self, peer_blocks: list[Block], headers_first: bool = True) -> None:
+        events = self.instrumentation
+        if events.info:
+            events.event(INFO, "\nNode: Starting blockchain sync...")
+
+        if headers_first:
+            self._sync_headers_first(peer_blocks)
+        else:
+            # 逐个处理到达的区块，乱序时可能先进入孤块池
+            for block in peer_blocks:
+                self.process_new_block(block)
+
+            # 父区块到达时孤块已经被连接；这里再对各链末端补一次，覆盖直接追加到链上的区块
+            chain_tips = [self.blockchain.chain[-1].hash] + list(self.fork_tips)
+            for tip_hash in chain_tips:
+                self.try_connect_orphans(tip_hash)
+            self.orphan_blocks.expire()
+
+        # 同步完成后，选择累计工作量最大的有效链
+        self.select_best_chain()
+
+        if events.info:
+            events.event(INFO, f"Sync finished. Chain length: {len(self.blockchain.chain)}, Remaining orphans: {len(self.orphan_blocks)}")
+
+    def _sync_headers_first(self, peer_blocks: list[Block]) -> None:
+        """先同步区块头，再只沿最优区块头链下载和验证区块体
+        1. 按 previous_hash 对区块头做拓扑排序，与到达顺序无关
+        2. 只用区块头检查PoW和期望难度，在临时的区块头树上累计工作量
+        3. 只沿累计工作量最大的区块头链处理区块体，注定落败的区块不会进入孤块池或分叉链
+        """
+        events = self.instrumentation
+        # 1. 拓扑排序：从本地已知的区块出发做BFS
+        children: dict[str, list[Block]] = {}
         for block in peer_blocks:
+            if block.hash not in self.block_index:
+                children.setdefault(block.previous_hash, []).append(block)
+        ordered = []
+        queue = deque(parent_hash for parent_hash in children if parent_hash in self.block_index)
+        while queue:
+            for block in children.pop(queue.popleft(), []):
+                ordered.append(block)
+                queue.append(block.hash)
+        unconnected = sum(len(blocks) for blocks in children.values())
+        if unconnected and events.info:
+            events.event(INFO, f"Headers: ignored {unconnected} headers that do not connect to known blocks")
+
+        # 2. 区块头检查：父区块头无效时，子区块头也一并丢弃
+        headers: dict[str, BlockIndexEntry] = {}
+        for block in ordered:
+            parent = headers.get(block.previous_hash) or self.block_index.get(block.previous_hash)
+            if parent is None:
+                continue
+            if self.below_snapshot_base(parent):
+                if events.info:
+                    events.event(INFO, f"Header rejected: {block.hash[:10]}... forks below the snapshot base")
+                continue
+            if not block.meets_target() or block.target != self.expected_target_after(parent, block):
+                if events.info:
+                    events.event(INFO, f"Invalid header rejected: {block.hash[:10]}...")
+                continue
+            headers[block.hash] = BlockIndexEntry(block, parent)
+        if events.info:
+            events.event(INFO, f"Headers: {len(headers)} valid headers out of {len(peer_blocks)}")
+
+        # 3. 选出累计工作量最大的区块头链，只有超过当前主链才需要下载区块体
+        best = max(headers.values(), key=lambda entry: entry.chain_work, default=None)
+        main_tip = self.block_index[self.blockchain.chain[-1].hash]
+        if best is None or best.chain_work <= main_tip.chain_work:
+            return
+        path = []
+        entry = best
+        while entry.block.hash in headers:
+            path.append(entry.block)
+            entry = entry.parent
+        for block in reversed(path):
             self.process_new_block(block)
-
-        # 循环尝试连接孤块，直到没有新增连接
-        while True:
-            initial_orphan_count = len(self.orphan_blocks)
-
-            chain_tips = [self.blockchain.chain[-1].hash] + [fork[-1].hash for fork in self.fork_chains]
-
-            # 尝试连接孤块到链末端
-            for orphan in list(self.orphan_blocks.values()):
-                if orphan.previous_hash in chain_tips:
-                    self.process_new_block(orphan)
-
-            # 如果这轮没有新的连接，就退出
-            if len(self.orphan_blocks) == initial_orphan_count:
+            if block.hash not in self.block_index:
+                if events.info:
+                    events.event(INFO, f"Block body failed verification, stopping sync at {block.hash[:10]}...")
                 break
 
-        # 同步完成后，选择最长的有效链
-        if self.fork_chains:
-            longest_chain = max(self.fork_chains, key=len)
-            if len(longest_chain) > len(self.blockchain.chain):
-                self.blockchain.chain = longest_chain
-                print(f"Switched to longer chain with length {len(longest_chain)}")
+    def verify_blocks_batch(self, blocks: list[Block], workers: int | None = None, chunk_size: int = 256) -> BatchVerifyResult:
+        """批量验证并接收区块
+        1. header: 主线程打包区块头，每个区块的Merkle根只计算一次
+        2. pow: 与账本无关的哈希重算和难度目标检查，分块交给进程池并行执行
+        3. stateful: 主线程按顺序做期望难度、余额检查并接到链上
+        """
+        events = self.instrumentation
+        result = BatchVerifyResult()
+        workers = workers or os.cpu_count() or 1
+
+        begin = time.perf_counter()
+        items = [(block.header_prefix(), block.nonce, block.hash, block.target) for block in blocks]
+        result.stage_seconds["header"] = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        if workers > 1 and len(items) > chunk_size:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pow_ok = list(pool.map(_check_pow, items, chunksize=chunk_size))
+        else:
+            pow_ok = [_check_pow(item) for item in items]  # 数据量小时进程池的开销不划算
+        result.stage_seconds["pow"] = time.perf_counter() - begin
+
+        begin = time.perf_counter()
+        failed: set[str] = set()  # 本批中验证失败的区块，它们的后代直接拒绝，不存进孤块池
+        for block, ok in zip(blocks, pow_ok):
+            if not ok:
+                if events.info:
+                    events.event(INFO, f"Invalid proof of work rejected: {block.hash[:10]}...")
+                failed.add(block.hash)
+                continue
+            if block.previous_hash in failed:
+                if events.info:
+                    events.event(INFO, f"Descendant of an invalid block rejected: {block.hash[:10]}...")
+                failed.add(block.hash)
+                continue
+            self.process_new_block(block, pow_checked=True)
+            if block.hash not in self.block_index and block.hash not in self.orphan_blocks:
+                failed.add(block.hash)
+        # 先于父区块到达、已经存进孤块池的后代也一并丢弃
+        pending = list(failed)
+        while pending:
+            for child in self.orphan_blocks.pop_children(pending.pop()):
+                if events.info:
+                    events.event(INFO, f"Descendant of an invalid block rejected: {child.hash[:10]}...")
+                failed.add(child.hash)
+                pending.append(child.hash)
+        for block in blocks:
+            if block.hash in self.block_index:
+                result.accepted += 1
+            elif block.hash in self.orphan_blocks:
+                result.orphaned += 1
+            else:
+                result.rejected += 1
+        result.stage_seconds["stateful"] = time.perf_counter() - begin
 
-        print(f"Sync finished. Chain length: {len(self.blockchain.chain)}, Remaining orphans: {len(self.orphan_blocks)}")
+        if events.info:
+            events.event(INFO, f"Batch verification finished: {result.summary()}")
+        return result
 
-    def verify_block(self, block: Block) -> bool:
+    def verify_block(self, block: Block, check_pow: bool = True) -> bool:
         """验证区块
         1. 验证难度值是否符合网络规则
         2. 验证区块哈希是否满足难度要求
         3. 验证哈希计算结果是否正确
         4. 验证交易是否有双重支付
+        check_pow=False 时跳过第2、3步(已在批量验证中完成)
         """
-        # 验证难度值
-        expected_difficulty = self.calculate_expected_difficulty(block)
-        if block.difficulty != expected_difficulty:
-            print(f"Invalid difficulty: expected {expected_difficulty}, got {block.difficulty}")
+        events = self.instrumentation
+        begin = time.perf_counter()
+        valid = self._verify_block(block, check_pow)
+        events.observe("verify_seconds", time.perf_counter() - begin)
+        events.count("blocks_verified" if valid else "blocks_rejected")
+        events.maybe_report()
+        return valid
+
+    def _verify_block(self, block: Block, check_pow: bool) -> bool:
+        # 调试事件只在对应级别打开时才格式化，关闭时每处只多一次属性读取
+        events = self.instrumentation
+        parent = self.block_index.get(block.previous_hash)
+        if parent is not None and self.below_snapshot_base(parent):
+            if events.info:
+                events.event(INFO, f"Block {block.hash[:10]}... rejected: parent at height {parent.height} is below the snapshot base")
             return False
-        # 验证哈希是否满足难度要求
-        if not block.hash.startswith(block.difficulty):
-            return False
-        # 验证哈希计算结果
-        calculated_hash = block.calculate_hash()
-        if calculated_hash != block.hash:
-            print(f"Invalid hash: calculated {calculated_hash}, got {block.hash}")
+        # 验证难度目标值
+        expected_target = self.calculate_expected_target(block)
+        if block.target != expected_target:
+            if events.info:
+                events.event(INFO, f"Invalid target: expected {expected_target:064x}, got {block.target:064x}")
             return False
+        if check_pow:
+            # 验证哈希是否满足难度要求
+            if not block.meets_target():
+                return False
+            # 验证哈希计算结果
+            calculated_hash = block.calculate_hash()
+            if calculated_hash != block.hash:
+                if events.info:
+                    events.event(INFO, f"Invalid hash: calculated {calculated_hash}, got {block.hash}")
+                return False
 
         # 找到此区块将要插入的位置
-        parent_position = -1
-        current_position = len(self.blockchain.chain)  # 当前区块将在链上的位置
-        for i, b in enumerate(self.blockchain.chain):
-            if b.hash == block.previous_hash:
-                parent_position = i
-                current_position = i + 1
-                break
-
-        if parent_position == -1:
-            print(f"Debug: Block {block.hash[:8]} is orphan, parent not found")
+        if parent is None or not self.is_on_main_chain(parent):
+            if events.debug:
+                events.event(DEBUG, f"Debug: Block {block.hash[:8]} is orphan, parent not found")
             return True
+        parent_position = parent.height
+        current_position = parent.height + 1  # 当前区块将在链上的位置
+
+        if events.debug:
+            events.event(DEBUG, f"\nDebug: Verifying block at position {current_position}")
+            events.event(DEBUG, f"Debug: Parent block is at position {parent_position}")
+
+        # 可用余额：已确认的余额减去之后还没有确认的区块里的支出
+        confirmed_height = max(0, current_position - self.blockchain.required_confirmations)
+        spent_outputs = self.spendable_balances(current_position)
+        if spent_outputs is None:
+            if events.info:
+                events.event(INFO, f"Fork block rejected: balances at height {confirmed_height} are no longer retained")
+            return False
+        if events.debug:
+            events.event(DEBUG, f"Debug: Using confirmed balances up to block {confirmed_height}")
+            events.event(DEBUG, "\nDebug: Verifying transactions in current block:")
+
+        # 逐笔输出调试信息时走顺序路径，输出顺序与区块内的交易顺序一致
+        if self.tx_validation_workers > 1 and len(block.data) >= self.parallel_tx_min and not events.debug:
+            return self._check_transactions_parallel(block, parent_position, spent_outputs)
+        return self._check_transactions_sequential(block, parent_position, spent_outputs)
+
+    def spendable_balances(self, position: int | None = None) -> ChainMap | None:
+        """接在主链高度 position-1 之后(默认接在链末端)的区块可以花费的余额
+        收入要等区块获得足够确认才能花，支出立即生效：已确认余额再减去之后还没有确认的区块里的支出，
+        同一笔余额不能在连续的几个区块里重复花费，账本应用区块时不会出现负余额
+        余额所在高度的undo日志已经丢弃时返回None
+        """
+        chain = self.blockchain.chain
+        position = len(chain) if position is None else position
+        confirmed_height = max(0, position - self.blockchain.required_confirmations)
+        if confirmed_height < self.ledger.base_height:
+            return None
+        if confirmed_height == self.ledger.height:
+            balances = ChainMap(self.ledger.balances)  # 新区块接在主链末端，直接使用账本
+        else:
+            balances = self.ledger.view_at(confirmed_height)  # 临时回退到更早的高度
+        pending = {}
+        for height in range(confirmed_height + 1, position):
+            block = chain[height]
+            if isinstance(block.data, str):
+                continue
+            for tx in block.data:
+                pending[tx.sender] = pending.get(tx.sender, balances.get(tx.sender, 0)) - (tx.amount + tx.fee)
+        return balances.new_child(pending)
 
-        print(f"\nDebug: Verifying block at position {current_position}")
-        print(f"Debug: Parent block is at position {parent_position}")
-
-        # 计算可用余额
-        spent_outputs = {}
-        # 创世区块奖励直接可用
-        genesis = self.blockchain.chain[0]
-        spent_outputs[genesis.miner_address] = genesis.block_reward
-        print(f"Debug: Initial balance from genesis: {genesis.miner_address[:8]} = {genesis.block_reward}")
-
-        # 遍历到父区块位置的所有交易
-        for i in range(1, current_position):
-            b = self.blockchain.chain[i]
-            print(f"\nDebug: Checking block {i} (confirmations: {current_position - i})")
-
-            # 只统计已确认的区块
-            if current_position - i >= 2:
-                print(f"Debug: Block {i} is confirmed")
-                # 先加入区块奖励
-                spent_outputs[b.miner_address] = spent_outputs.get(b.miner_address, 0) + b.block_reward
-                print(f"Debug: Added block reward: {b.miner_address[:8]} += {b.block_reward}")
-                
-                # 处理交易
-                for tx in b.data:
-                    if isinstance(tx, Transaction):
-                        print(f"Debug: Processing tx: {tx.sender[:8]} -> {tx.receiver[:8]} = {tx.amount} (fee: {tx.fee})")
-                        if tx.sender in spent_outputs:
-                            spent_outputs[tx.sender] -= (tx.amount + tx.fee)
-                        if tx.receiver in spent_outputs:
-                            spent_outputs[tx.receiver] = spent_outputs.get(tx.receiver, 0) + tx.amount
-                        else:
-                            spent_outputs[tx.receiver] = tx.amount
-                        spent_outputs[b.miner_address] += tx.fee  # 只加手续费
-                print(f"Debug: After block {i}, balances: {[(k[:8], v) for k, v in spent_outputs.items()]}")
-            else:
-                print(f"Debug: Block {i} not confirmed yet")
-
-        print("\nDebug: Verifying transactions in current block:")
+    def _check_transactions_sequential(self, block: Block, parent_position: int, spent_outputs: ChainMap) -> bool:
+        """按区块顺序逐笔检查重放和余额(参考实现)"""
+        events = self.instrumentation
         # 验证当前区块的交易，同时更新临时余额状态
-        temp_outputs = spent_outputs.copy()  # 创建临时余额状态
+        temp_outputs = spent_outputs.new_child()  # 临时余额状态，写入不影响账本
+        seen_txids = set()
         for tx in block.data:
             if isinstance(tx, Transaction):
+                # 重放检查：同一笔交易不能在区块内重复，也不能已经在父区块及其祖先中上链
+                location = self.tx_index.get(tx.txid)
+                if tx.txid in seen_txids or (location is not None and location[0] <= parent_position):
+                    if events.info:
+                        events.event(INFO, f"Replayed transaction rejected: {tx.txid.hex()[:10]}...")
+                    return False
+                seen_txids.add(tx.txid)
                 sender_balance = temp_outputs.get(tx.sender, 0)  # 使用临时状态
-                print(f"Debug: Checking tx: {tx.sender[:8]} -> {tx.receiver[:8]} = {tx.amount} (fee: {tx.fee})")
-                print(f"Debug: Sender {tx.sender[:8]} balance: {sender_balance}")
+                if events.debug:
+                    events.event(DEBUG, f"Debug: Checking tx: {tx.sender[:8]} -> {tx.receiver[:8]} = {tx.amount} (fee: {tx.fee})")
+                    events.event(DEBUG, f"Debug: Sender {tx.sender[:8]} balance: {sender_balance}")
                 if sender_balance < (tx.amount + tx.fee):
-                    print(f"Double spend detected: {tx.sender} tried to spend more than their balance")
-                    print(f"Balance: {sender_balance}, Trying to spend: {tx.amount + tx.fee}")
+                    if events.info:
+                        events.event(INFO, f"Double spend detected: {tx.sender} tried to spend more than their balance")
+                        events.event(INFO, f"Balance: {sender_balance}, Trying to spend: {tx.amount + tx.fee}")
                     return False
-                    
+
                 # 更新临时余额状态
                 temp_outputs[tx.sender] = sender_balance - (tx.amount + tx.fee)
                 temp_outputs[tx.receiver] = temp_outputs.get(tx.receiver, 0) + tx.amount
                 temp_outputs[block.miner_address] = temp_outputs.get(block.miner_address, 0) + tx.fee
-                print(f"Debug: After tx, temp balances: {[(k[:8], v) for k, v in temp_outputs.items()]}")
+                if events.debug:
+                    events.event(DEBUG, f"Debug: After tx, temp balances: {[(k[:8], v) for k, v in temp_outputs.maps[0].items()]}")
 
         return True
 
-    def calculate_expected_difficulty(self, block: Block) -> str:
-        """根据区块高度和时间戳计算期望的难度值"""
+    def _check_transactions_parallel(self, block: Block, parent_position: int, spent_outputs: ChainMap) -> bool:
+        """按地址分组，分给多个进程并行检查交易，结果与 _check_transactions_sequential 相同
+        每组只依赖组内排在前面的交易；区块顺序中第一笔不通过的交易之前的交易在两种路径下看到的余额一样，
+        所以取各组第一笔不通过的交易中位置最靠前的一笔，就是顺序检查会拒绝的那一笔
+        每个进程只收到自己那几组的交易、涉及地址的余额和txid位置(与 verify_blocks_batch 相同，进程之间不共享状态)
+        """
+        events = self.instrumentation
+        txs = [tx for tx in block.data if isinstance(tx, Transaction)]
+        groups = group_transactions(txs, block.miner_address)
+        events.observe("tx_groups", len(groups))
+        workers = min(self.tx_validation_workers, len(groups))
+        if workers > 1:
+            chunks = [self._tx_group_slice(groups[k::workers], txs, spent_outputs) for k in range(workers)]
+            results = self._tx_validation_pool().map(_check_tx_groups, *zip(*chunks), [parent_position] * workers, [block.miner_address] * workers)
+            failures = [failure for failure in results if failure is not None]
+        else:
+            failure = _check_tx_groups(groups, txs, spent_outputs, self.tx_index, parent_position, block.miner_address)
+            failures = [] if failure is None else [failure]
+        if not failures:
+            return True
+
+        position, sender_balance = min(failures)
+        tx = txs[position]
+        if events.info:
+            if sender_balance is None:
+                events.event(INFO, f"Replayed transaction rejected: {tx.txid.hex()[:10]}...")
+            else:
+                events.event(INFO, f"Double spend detected: {tx.sender} tried to spend more than their balance")
+                events.event(INFO, f"Balance: {sender_balance}, Trying to spend: {tx.amount + tx.fee}")
+        return False
+
+    def _tx_validation_pool(self) -> ProcessPoolExecutor:
+        """节点共用的交易检查进程池；tx_validation_workers 改变后重新创建"""
+        if self._tx_pool is not None and self._tx_pool_workers != self.tx_validation_workers:
+            self._tx_pool.shutdown()
+            self._tx_pool = None
+        if self._tx_pool is None:
+            self._tx_pool = ProcessPoolExecutor(max_workers=self.tx_validation_workers)
+            self._tx_pool_workers = self.tx_validation_workers
+        return self._tx_pool
+
+    def _tx_group_slice(self, groups: list[list[int]], txs: list["Transaction"], spent_outputs: ChainMap):
+        """(groups, 这些组的交易, 涉及地址的余额, 已上链txid的位置)，作为 _check_tx_groups 在子进程中的参数"""
+        chunk_txs = {i: txs[i] for group in groups for i in group}
+        balances = {}
+        locations = {}
+        for tx in chunk_txs.values():
+            for address in (tx.sender, tx.receiver):
+                if address in spent_outputs:
+                    balances[address] = spent_outputs[address]
+            location = self.tx_index.get(tx.txid)
+            if location is not None:
+                locations[tx.txid] = location
+        return groups, chunk_txs, balances, locations
+
+    def calculate_expected_target(self, block: Block) -> int:
+        """根据区块高度和时间戳计算期望的难度目标值"""
         # 创世区块特殊处理
         if block.previous_hash == "0":
-            return block.difficulty  # 使用区块自带的难度值，而不是链上的当前难度
-
-        # 1. 找到区块所在的链和父区块
-        chain = self.blockchain.chain
-        parent_found = False
+            return block.target  # 使用区块自带的目标值，而不是链上的当前难度
 
-        # 在主链上找
-        for b in self.blockchain.chain:
-            if b.hash == block.previous_hash:
-                parent_found = True
-                break
+        # 1. 通过索引找到父区块(主链或分叉链上都可以)
+        parent = self.block_index.get(block.previous_hash)
 
-        # 如果主链上没找到，在分叉链上找
-        if not parent_found:
-            for fork in self.fork_chains:
-                if block.previous_hash in [b.hash for b in fork]:
-                    chain = fork
-                    parent_found = True
-                    break
+        # 如果找不到父区块，暂时信任区块自带的目标值
+        if parent is None:
+            return block.target
 
-        # 如果找不到父区块，暂时信任区块自带的难度值
-        if not parent_found:
-            return block.difficulty
+        return self.expected_target_after(parent, block)
 
+    def expected_target_after(self, parent: BlockIndexEntry, block: Block) -> int:
+        """已知父区块(正式索引或同步中的区块头树)时，计算下一个区块的期望目标值"""
         # 2. 获取上一个难度调整点的区块
-        adjustment_block = self.get_last_adjustment_block(chain)
-
-        # 3. 如果还没到调整点，使用之前的难度
-        if not self.is_adjustment_point(block, chain):
-            return adjustment_block.difficulty
-
-        # 4. 如果是调整点，计算新难度
-        return self.calculate_new_difficulty(adjustment_block, block, chain)
-
-    def get_last_adjustment_block(self, chain: list[Block]) -> Block:
-        """获取指定链上最近的难度调整点区块"""
-        # 从后往前找到最近的调整点
-        current_height = len(chain)
+        adjustment = self.get_last_adjustment_entry(parent)
+
+        # 3. 如果还没到调整点，使用之前的目标值
+        if not self.is_adjustment_point(parent):
+            return adjustment.block.target
+
+        # 4. 如果是调整点，计算新目标值
+        return self.calculate_new_target(adjustment, block, parent)
+
+    def get_last_adjustment_entry(self, parent: BlockIndexEntry) -> BlockIndexEntry:
+        """获取父区块所在链上最近的难度调整点区块"""
+        target_index = self._last_adjustment_index(parent)
+        if self.below_snapshot_base(parent):
+            raise ValueError(f"Adjustment block at height {target_index} predates the snapshot at height {self.blockchain.chain.base_height}")
+
+        # 沿父指针回溯，最多 difficulty_adjustment_interval 步
+        entry = parent
+        while entry.height > target_index:
+            entry = entry.parent
+        return entry
+
+    def _last_adjustment_index(self, parent: BlockIndexEntry) -> int:
+        # 链截止到父区块的长度
+        current_height = parent.height + 1
         # 找到最近的调整点高度
         last_adjustment_height = current_height - (current_height % self.blockchain.difficulty_adjustment_interval)
+        # 如果还没到第一个调整点，返回创世区块；-1因为height从1开始而索引从0开始
+        return 0 if last_adjustment_height == 0 else last_adjustment_height - 1
 
-        if last_adjustment_height == 0:
-            return chain[0]  # 如果还没到第一个调整点，返回创世区块
-
-        return chain[last_adjustment_height - 1]  # -1因为height从1开始而索引从0开始
-
-    def is_adjustment_point(self, block: Block, chain: list[Block]) -> bool:
-        """判断区块是否为难度调整点
-        需要考虑区块可能在主链或分叉链上的情况
+    def below_snapshot_base(self, parent: BlockIndexEntry) -> bool:
+        """从快照启动的节点没有快照之前的区块：父区块离快照基点太近时，难度调整点不在本地，无法计算期望难度
+        这样的区块只能来自早于快照的分叉，直接拒绝
         """
-        # 创世区块特殊处理
-        if block.previous_hash == "0":
-            return False
-
-        # 先在主链上查找父区块
-        block_height = 0
-        for b in chain:
-            if b.hash == block.previous_hash:
-                block_height = chain.index(b) + 2
-                print(f"Debug: block_height={block_height}, interval={self.blockchain.difficulty_adjustment_interval}")
-                break
-
-        # 如果不在主链上，检查分叉链
-        if block_height == 0:
-            for fork_chain in self.fork_chains:
-                for b in fork_chain:
-                    if b.hash == block.previous_hash:
-                        block_height = fork_chain.index(b) + 2  # +2因为是父区块的下一个高度
-                        break
-                if block_height > 0:
-                    break
+        chain = self.blockchain.chain
+        return isinstance(chain, SnapshotChain) and self._last_adjustment_index(parent) < chain.base_height
 
+    def is_adjustment_point(self, parent: BlockIndexEntry) -> bool:
+        """判断父区块的下一个区块是否为难度调整点
+        父区块可能在主链、分叉链或同步中的区块头树上，高度直接记录在树节点里
+        """
+        block_height = parent.height + 2  # +2因为height从1开始，且是父区块的下一个高度
+        events = self.instrumentation
+        if events.debug:
+            events.event(DEBUG, f"Debug: block_height={block_height}, interval={self.blockchain.difficulty_adjustment_interval}")
         return block_height % self.blockchain.difficulty_adjustment_interval == 0
 
-    def calculate_new_difficulty(self, adjustment_block: Block, block: Block, chain: list[Block]) -> str:
-        """计算新难度值"""
+    def calculate_new_target(self, adjustment: BlockIndexEntry, block: Block, parent: BlockIndexEntry) -> int:
+        """按 实际用时/期望用时 的比例计算新目标值
+        - 出块比目标慢k倍，目标值就放大k倍(变容易)，反之缩小；k 限制在 [1/max_adjustment_factor, max_adjustment_factor]
+        - 用整数微秒计算，所有节点得到完全相同的目标值
+        """
+        blockchain = self.blockchain
+        # 创世区块的时间戳是固定的(2009年)，不能作为计时起点：第一个周期从高度1开始计时
+        anchor = adjustment
+        if anchor.height == 0:
+            anchor = parent
+            while anchor.height > 1:
+                anchor = anchor.parent
+            if anchor.height == 0:
+                return adjustment.block.target  # 周期内还没有可以计时的区块，保持原目标值
         # 计算这条链上的出块时间差
-        time_diff = (block.timestamp - adjustment_block.timestamp).total_seconds()
-        blocks_since_adjustment = len(chain) - chain.index(adjustment_block)
-        avg_block_time = time_diff / blocks_since_adjustment
+        blocks_since_adjustment = parent.height + 1 - anchor.height
+        actual = block.timestamp_us - anchor.block.timestamp_us
+        expected = int(blockchain.target_block_time * 1_000_000) * blocks_since_adjustment
 
         # 添加调试信息
-        print(f"Debug: avg_block_time={avg_block_time}, target={self.blockchain.target_block_time}")
-        print(f"Debug: current difficulty={adjustment_block.difficulty}")
-
-        # 问题在这里：难度调整逻辑可能有问题
-        if avg_block_time < self.blockchain.target_block_time:
-            return "0" + adjustment_block.difficulty
-        elif avg_block_time > self.blockchain.target_block_time:
-            return adjustment_block.difficulty[1:]
-        return adjustment_block.difficulty
+        events = self.instrumentation
+        if events.debug:
+            events.event(DEBUG, f"Debug: avg_block_time={actual / blocks_since_adjustment / 1e6}, target={blockchain.target_block_time}")
+            events.event(DEBUG, f"Debug: current difficulty={adjustment.block.difficulty:.0f}")
+
+        factor = blockchain.max_adjustment_factor
+        if expected <= 0:
+            new_target = adjustment.block.target * factor  # 目标出块时间为0(测试网络)：每次按上限放宽
+        else:
+            actual = min(max(actual, expected // factor), expected * factor)
+            new_target = adjustment.block.target * actual // expected
+        return max(1, min(new_target, MAX_TARGET))
 
     def get_balance(self, address: str) -> float:
         """计算地址的当前余额
@@ -408,122 +2085,325 @@ class Node:
         1. 创世区块奖励可以直接使用
         2. 其他区块奖励需要等待确认
         """
-        balance = 0
-        current_height = len(self.blockchain.chain)
-
-        # 遍历主链上所有区块
-        for i, block in enumerate(self.blockchain.chain):
-            # 如果是创世区块，奖励直接可用
-            if i == 0 and block.miner_address == address:
-                balance += block.block_reward
-                continue
+        index = self.address_index
+        rewards = index.reward_totals.get(address, 0)
 
-            # 处理区块中的交易
-            for tx in block.data:
-                if isinstance(tx, Transaction):
-                    # 如果是发送方，减去金额和手续费
-                    if tx.sender == address:
-                        balance -= (tx.amount + tx.fee)
-                    # 如果是接收方，加上金额
-                    if tx.receiver == address:
-                        balance += tx.amount
-                    # 如果是矿工，加上手续费
-                    if block.miner_address == address:
-                        balance += tx.fee
-
-            # 区块奖励：创世区块之后的奖励需要等待确认
-            if block.miner_address == address and i > 0:
-                # 在演示中我们设置较小的确认数(比如2)，而不是比特币的100
-                if current_height - i >= 2:
-                    balance += block.block_reward
-
-        return balance
+        # 扣除尚未成熟的区块奖励：只需检查链末端 required_confirmations - 1 个区块
+        chain = self.blockchain.chain
+        for i in range(max(1, len(chain) - self.blockchain.required_confirmations + 1), len(chain)):
+            if chain[i].miner_address == address:
+                rewards -= chain[i].block_reward
+
+        return index.tx_balances.get(address, 0) + rewards
+
+    def find_transaction(self, txid: bytes | str) -> tuple[Block, int] | None:
+        """查询交易在主链上的位置：(所在区块, 区块内位置)，不在主链上时返回None"""
+        if isinstance(txid, str):
+            txid = bytes.fromhex(txid)
+        location = self.tx_index.get(txid)
+        if location is None:
+            return None
+        height, position = location
+        try:
+            return self.blockchain.chain[height], position
+        except ValueError:
+            return None  # 从快照启动的节点没有快照之前的区块
+
+    def get_address_history(self, address: str, from_height: int = 0, to_height: int | None = None) -> list[tuple[int, float, float]]:
+        """查询地址在主链某个高度区间内的余额变动 [(高度, 交易净额, 区块奖励)]"""
+        if self.address_index.history is None:
+            if self.prune_depth is not None:
+                raise ValueError("Address history is not available in pruned mode")
+            self.address_index.rebuild_history(self.blockchain.chain)
+        return self.address_index.get_history(address, from_height, to_height)
 
 
 class Transaction:
-    def __init__(self, sender: str, receiver: str, amount: float, fee: float):
+    """交易以txid标识：内容相同的两笔交易是同一笔交易，在交易池和链上都只能出现一次
+    nonce 是发送方给自己的交易编的序号，属于规范编码：同一发送方重复付同样的金额时用新的nonce，txid不同，两笔都有效；
+    重放已经上链的交易(nonce也相同)得到同一个txid，仍然按txid拒绝
+    """
+
+    __slots__ = ("sender", "receiver", "amount", "fee", "nonce", "_txid")
+
+    def __init__(self, sender: str, receiver: str, amount: float, fee: float, nonce: int = 0):
         self.sender = sender
         self.receiver = receiver
         self.amount = amount
         self.fee = fee
+        self.nonce = nonce
+        self._txid: bytes | None = None
 
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Transaction) and self.txid == other.txid
 
-class TransactionPool:
-    """模拟内存池，存储待确认的交易"""
+    def __hash__(self) -> int:
+        return hash(self.txid)
 
-    def __init__(self):
-        self.pending_transactions = []
+    def __repr__(self) -> str:
+        return f"Transaction({self.sender!r}, {self.receiver!r}, {float(self.amount)!r}, {float(self.fee)!r}, nonce={self.nonce})"
 
-    def add_transaction(self, tx: Transaction):
-        self.pending_transactions.append(tx)
+    def to_bytes(self) -> bytes:
+        """规范编码：sender | receiver | amount(8B) | fee(8B) | nonce(8B)，字符串 = 长度(2B) + UTF-8"""
+        return _pack_text(self.sender) + _pack_text(self.receiver) + TX_FIELDS_STRUCT.pack(self.amount, self.fee, self.nonce)
 
-    def get_transactions(self, chain: list[Block], max_count: int = 3) -> list[Transaction]:
-        """获取可以打包的交易，需要考虑确认数"""
-        valid_txs = []
-        current_height = len(chain)
+    @classmethod
+    def from_bytes(cls, payload: bytes, offset: int = 0) -> tuple["Transaction", int]:
+        """从 offset 处解码一笔交易，返回 (交易, 下一笔交易的偏移)"""
+        sender, offset = _unpack_address(payload, offset)
+        receiver, offset = _unpack_address(payload, offset)
+        amount, fee, nonce = TX_FIELDS_STRUCT.unpack_from(payload, offset)
+        return cls(sender, receiver, amount, fee, nonce), offset + TX_FIELDS_STRUCT.size
 
-        # 计算当前可用余额（考虑确认数）
-        balances = {}
-        # 创世区块奖励直接可用
-        genesis = chain[0]
-        balances[genesis.miner_address] = genesis.block_reward
-
-        # 遍历其他区块
-        for i, block in enumerate(chain[1:], 1):
-            # 只统计已确认的区块（至少2个确认）
-            if current_height - i >= 2:
-                if block.miner_address in balances:
-                    balances[block.miner_address] += block.block_reward
-                else:
-                    balances[block.miner_address] = block.block_reward
-
-                for tx in block.data:
-                    if isinstance(tx, Transaction):
-                        # 更新发送方余额
-                        if tx.sender in balances:
-                            balances[tx.sender] -= (tx.amount + tx.fee)
-                        # 更新接收方余额
-                        if tx.receiver in balances:
-                            balances[tx.receiver] += tx.amount
-                        else:
-                            balances[tx.receiver] = tx.amount
-                        # 更新矿工手续费
-                        balances[block.miner_address] += tx.fee
-
-        # 根据可用余额筛选交易
-        for tx in sorted(self.pending_transactions, key=lambda t: t.fee, reverse=True):
-            sender_balance = balances.get(tx.sender, 0)
-            if sender_balance >= (tx.amount + tx.fee):
-                valid_txs.append(tx)
-                # 更新余额状态
-                balances[tx.sender] -= (tx.amount + tx.fee)
-                balances[tx.receiver] = balances.get(tx.receiver, 0) + tx.amount
-                if len(valid_txs) >= max_count:
-                    break
+    @property
+    def txid(self) -> bytes:
+        # 规范编码的双SHA-256；交易创建后不再修改，第一次用到时计算并缓存
+        if self._txid is None:
+            self._txid = sha256d(self.to_bytes())
+        return self._txid
+
+
+class TransactionPool:
+    """模拟内存池，存储待确认的交易
+    - 按发送方分队列：同一发送方的交易按到达顺序打包，依赖前一笔的花费不会被提前
+    - 就绪堆里只放每个发送方的队首交易，按手续费率排序，生成区块模板是 O(k log n)
+    - 设置 max_size 后，池满时驱逐手续费率最低的交易
+    """
+
+    def __init__(self, max_size: int | None = None, confirmed_txids: Container[bytes] | None = None):
+        self.max_size = max_size
+        self.confirmed_txids = confirmed_txids  # 已上链的txid(通常是节点的 tx_index)，重放的交易直接拒绝
+        self.evicted_count = 0
+        self._seq = itertools.count()
+        self._entries: dict[Transaction, int] = {}  # 交易(按txid判等) -> 到达序号，dict保持到达顺序
+        self._sender_queues: dict[str, deque[Transaction]] = {}
+        self._ready: list[tuple[float, int, str]] = []  # (-手续费率, 序号, 发送方)，惰性删除
+        self._by_fee: list[tuple[float, int, Transaction]] = []  # (手续费率, 序号, 交易)，惰性删除
+
+    @property
+    def pending_transactions(self) -> list[Transaction]:
+        return list(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def fee_rate(tx: Transaction) -> float:
+        # 演示中的交易大小都一样，手续费率就是手续费
+        return tx.fee
+
+    def add_transaction(self, tx: Transaction) -> bool:
+        """加入交易池，返回是否被接受；池中已有或已经上链的交易不会重复加入"""
+        if tx in self._entries or (self.confirmed_txids is not None and tx.txid in self.confirmed_txids):
+            return False
+        if self.max_size is not None and len(self._entries) >= self.max_size:
+            # 池满：新交易的手续费率必须高于池中最低者，才能把它挤出去
+            lowest = self._peek_lowest_fee()
+            if lowest is None or self.fee_rate(tx) <= self.fee_rate(lowest):
+                return False
+            self._remove(lowest)
+            self.evicted_count += 1
+
+        seq = next(self._seq)
+        self._entries[tx] = seq
+        heapq.heappush(self._by_fee, (self.fee_rate(tx), seq, tx))
+        queue = self._sender_queues.setdefault(tx.sender, deque())
+        queue.append(tx)
+        if len(queue) == 1:
+            heapq.heappush(self._ready, (-self.fee_rate(tx), seq, tx.sender))
+        self._compact()
+        return True
+
+    def get_transactions(self, balances: Mapping[str, float], max_count: int = 3) -> list[Transaction]:
+        """获取可以打包的交易
+        balances 是可用余额(见 Node.spendable_balances)，基于节点随新区块增量更新的账本，不再从整条链重算
+        """
+        valid_txs = []
+        temp_balances = ChainMap({}, balances)  # 模板内的临时余额，不修改传入的余额
+        popped = []  # 从就绪堆弹出的队首条目，选完后放回
+        successors = []  # 已选交易在同一发送方队列中的下一笔：(-手续费率, 序号, 发送方, 队列位置)
+
+        while len(valid_txs) < max_count:
+            head = self._peek_ready()
+            if successors and (head is None or successors[0][:2] < head[:2]):
+                _, _, sender, position = heapq.heappop(successors)
+            elif head is not None:
+                popped.append(heapq.heappop(self._ready))
+                sender, position = head[2], 0
+            else:
+                break
 
+            queue = self._sender_queues[sender]
+            tx = queue[position]
+            sender_balance = temp_balances.get(sender, 0)
+            if sender_balance < (tx.amount + tx.fee):
+                continue  # 余额不足，该发送方后面的交易也要等这笔之后，本轮都不打包
+
+            valid_txs.append(tx)
+            # 更新余额状态
+            temp_balances[sender] = sender_balance - (tx.amount + tx.fee)
+            temp_balances[tx.receiver] = temp_balances.get(tx.receiver, 0) + tx.amount
+            if position + 1 < len(queue):
+                successor = queue[position + 1]
+                heapq.heappush(successors, (-self.fee_rate(successor), self._entries[successor], sender, position + 1))
+
+        for entry in popped:
+            heapq.heappush(self._ready, entry)
         return valid_txs
 
     def remove_transactions(self, txs: list[Transaction]):
         """从交易池中移除已打包的交易"""
         for tx in txs:
-            if tx in self.pending_transactions:
-                self.pending_transactions.remove(tx)
+            if tx in self._entries:
+                self._remove(tx)
+
+    def _remove(self, tx: Transaction) -> None:
+        del self._entries[tx]
+        queue = self._sender_queues[tx.sender]
+        was_head = queue[0] == tx  # 按txid比较，传入的可能是区块里内容相同的另一个对象
+        queue.remove(tx)  # 打包的交易通常就是队首，O(1)
+        if not queue:
+            del self._sender_queues[tx.sender]
+        elif was_head:
+            head = queue[0]
+            heapq.heappush(self._ready, (-self.fee_rate(head), self._entries[head], head.sender))
+
+    def _peek_ready(self) -> tuple[float, int, str] | None:
+        # 丢弃已失效的条目(对应交易已不是发送方队首)
+        while self._ready:
+            entry = self._ready[0]
+            queue = self._sender_queues.get(entry[2])
+            if queue and self._entries[queue[0]] == entry[1]:
+                return entry
+            heapq.heappop(self._ready)
+        return None
+
+    def _peek_lowest_fee(self) -> Transaction | None:
+        while self._by_fee:
+            _, seq, tx = self._by_fee[0]
+            if self._entries.get(tx) == seq:
+                return tx
+            heapq.heappop(self._by_fee)
+        return None
+
+    def _compact(self) -> None:
+        # 惰性删除留下的失效条目过多时重建堆，摊还代价O(1)
+        if len(self._by_fee) > 2 * len(self._entries) + 64:
+            self._by_fee = [(self.fee_rate(tx), seq, tx) for tx, seq in self._entries.items()]
+            heapq.heapify(self._by_fee)
+        if len(self._ready) > 2 * len(self._sender_queues) + 64:
+            self._ready = [(-self.fee_rate(queue[0]), self._entries[queue[0]], sender) for sender, queue in self._sender_queues.items()]
+            heapq.heapify(self._ready)
 
 
 class MinerNode(Node):
-    def __init__(self, address: str):
-        super().__init__()
+    def __init__(self, address: str, mining_workers: int = 1, data_dir: str | None = None, mining_backend: str | MiningBackend | None = None):
+        super().__init__(data_dir)
         self.address = address
         self.balance = 0
-        self.mempool = TransactionPool()
+        self.mempool = TransactionPool(confirmed_txids=self.tx_index)
+        self.mining_workers = mining_workers  # >1 时使用多进程并行挖矿
+        # 挖矿后端：mining_backend 指定后端实例或名称(其次是环境变量 POW_MINING_BACKEND)，
+        # 否则用本进程第一次创建矿工时的校准结果，选当前机器上最快的
+        self.mining_backend = select_backend(mining_backend)
+        # 可取消的挖矿：每 cancel_check_interval 个nonce处理一次收到的区块、检查停止信号
+        self.cancel_check_interval = STOP_CHECK_INTERVAL
+        self.incoming_blocks: deque[Block] = deque()  # 其他线程通过 receive_block 投递，挖矿线程在检查点处理
+        self.stop_mining = threading.Event()  # 设置后 start_mining 在下一个检查点返回
+        self.block_listeners: list = []  # 挖出区块后依次调用 listener(block)，比如转发给其他节点
+        self.mining_stats = MiningStats()
+
+    def receive_block(self, block: Block) -> None:
+        """线程安全：收到其他矿工的区块，挖矿线程在下一个检查点处理(不在挖矿时由挖矿线程自己调用 process_new_block)"""
+        self.incoming_blocks.append(block)
+
+    def _process_incoming(self) -> None:
+        received = False
+        while self.incoming_blocks:
+            block = self.incoming_blocks.popleft()
+            self.process_new_block(block)
+            if block.hash in self.fork_tips:
+                self.select_best_chain()  # 分叉累计工作量超过主链时重组
+            received = True
+        if received:
+            # 交易池里已经上链的交易不能再打包
+            confirmed = [tx for tx in self.mempool.pending_transactions if tx.txid in self.tx_index]
+            if confirmed:
+                self.mempool.remove_transactions(confirmed)
+
+    def _mine_template(self, block: Block, target: int) -> bool:
+        """在区块模板上挖矿，每 cancel_check_interval 个nonce检查一次
+        找到有效nonce返回True；链末端已经不是模板的父区块(收到同高度或更高的区块)或收到停止信号时返回False
+        """
+        events = self.instrumentation
+        stats = self.mining_stats
+        stats.templates += 1
+        block.target = target
+        header_prefix = block.header_prefix()
+        target_bytes = target_to_bytes(target)
+        hashes = 0
+        while True:
+            nonce, digest, tried = self.mining_backend.search(header_prefix, target_bytes, block.nonce, count=self.cancel_check_interval)
+            hashes += tried
+            if nonce is not None:
+                block.nonce, block.hash = nonce, digest.hex()
+                stats.hashes += hashes
+                instrumentation.count("hashes_tried", hashes)
+                if events.info:
+                    events.event(INFO, f"Block mined with difficulty {block.difficulty:.0f}: {block.hash}")
+                return True
+            block.nonce += tried
+            self._process_incoming()
+            if self.stop_mining.is_set() or self.blockchain.chain[-1].hash != block.previous_hash:
+                stats.hashes += hashes
+                instrumentation.count("hashes_tried", hashes)
+                if not self.stop_mining.is_set():
+                    stats.stale_templates += 1
+                    stats.stale_hashes += hashes
+                    instrumentation.count("stale_templates")
+                    instrumentation.count("stale_hashes", hashes)
+                    if events.info:
+                        events.event(INFO, f"Stale template dropped after {hashes} hashes, new tip {self.blockchain.chain[-1].hash[:10]}...")
+                return False
+
+    def _mine_template_parallel(self, block: Block, target: int) -> bool:
+        """多进程版本的 _mine_template：worker共享停止信号，主进程等待期间处理收到的区块，
+        链末端不再是模板的父区块或收到停止信号时让所有worker停下
+        """
+        events = self.instrumentation
+        stats = self.mining_stats
+        stats.templates += 1
+
+        def cancel() -> bool:
+            self._process_incoming()
+            return self.stop_mining.is_set() or self.blockchain.chain[-1].hash != block.previous_hash
+
+        result = block.mine_block_parallel(target, self.mining_workers, self.mining_backend, cancel)
+        stats.hashes += result.hashes
+        if events.info:
+            rates = ", ".join(f"{r:.0f}" for r in result.worker_hashrates)
+            events.event(INFO, f"Hashrate: {result.total_hashrate:.0f} H/s (per worker: {rates})")
+        # 找到nonce的同时可能收到了新区块，再确认一次父区块仍是链末端
+        if not result.cancelled and not cancel():
+            return True
+        if not self.stop_mining.is_set():
+            stats.stale_templates += 1
+            stats.stale_hashes += result.hashes
+            instrumentation.count("stale_templates")
+            instrumentation.count("stale_hashes", result.hashes)
+            if events.info:
+                events.event(INFO, f"Stale template dropped after {result.hashes} hashes, new tip {self.blockchain.chain[-1].hash[:10]}...")
+        return False
 
     def start_mining(self, num_blocks: int = 3) -> list[Block]:
+        events = self.instrumentation
         mined_blocks = []
         blocks_mined = 0
 
-        while blocks_mined < num_blocks:
-            # 从交易池获取待打包交易，传入当前链状态
-            transactions = self.mempool.get_transactions(self.blockchain.chain)
+        while blocks_mined < num_blocks and not self.stop_mining.is_set():
+            self._process_incoming()
+            # 从交易池获取待打包交易，传入当前链状态；模板过时后重新选择
+            transactions = self.mempool.get_transactions(self.spendable_balances())
 
             new_block = Block(transactions, self.blockchain.chain[-1].hash)
             new_block.miner_address = self.address
@@ -531,183 +2411,141 @@ class MinerNode(Node):
             tx_fees = sum(tx.fee for tx in transactions)
             total_reward = new_block.block_reward + tx_fees
 
-            current_difficulty = self.calculate_expected_difficulty(new_block)
-            new_block.mine_block(current_difficulty)
+            current_target = self.calculate_expected_target(new_block)
+            if self.mining_workers > 1:
+                if not self._mine_template_parallel(new_block, current_target):
+                    continue
+            elif not self._mine_template(new_block, current_target):
+                continue
 
             self.balance = self.get_balance(self.address)
-            if transactions:
-                print(f"Miner {self.address[:8]} earned {total_reward} coins! (Block reward: {new_block.block_reward}, Fees: {tx_fees})")
-            else:
-                print(f"Miner {self.address[:8]} earned {total_reward} coins! (Empty block, only reward)")
+            if events.info:
+                if transactions:
+                    events.event(INFO, f"Miner {self.address[:8]} earned {total_reward} coins! (Block reward: {new_block.block_reward}, Fees: {tx_fees})")
+                else:
+                    events.event(INFO, f"Miner {self.address[:8]} earned {total_reward} coins! (Empty block, only reward)")
 
             # 从交易池移除已打包的交易
             self.mempool.remove_transactions(transactions)
 
-            self.blockchain.chain.append(new_block)
+            self.append_to_main_chain(new_block)
             mined_blocks.append(new_block)
             blocks_mined += 1
+            for listener in self.block_listeners:
+                listener(new_block)
 
         return mined_blocks
 
 
 class ValidatorNode(Node):
     def start_validating(self, received_blocks: list[Block]) -> None:
-        print("\nValidator: Starting validation process")
+        events = self.instrumentation
+        if events.info:
+            events.event(INFO, "\nValidator: Starting validation process")
         self.sync_with_network(received_blocks)
-        print(f"Validator: Finished processing {len(received_blocks)} blocks")
+        if events.info:
+            events.event(INFO, f"Validator: Finished processing {len(received_blocks)} blocks")
 
 
 if __name__ == "__main__":
     print("=== Simulating Blockchain Network with Difficulty Sync ===")
 
-    # 1. 创建一些测试交易，但数量少于要挖的区块数
-    mempool = TransactionPool()
+    # 1. 矿工节点；交易直接提交到它的交易池，交易池据此拒绝已经上链的交易(重放保护)
+    miner = MinerNode("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa")
+
+    # 2. 创建一些测试交易，但数量少于要挖的区块数
     test_transactions = [
-        # 只创建3笔交易，但要挖5个区块
+        # 只创建3笔交易，但要挖16个区块
         Transaction(genesis_block.miner_address, "Alice", 10.0, 0.1),  # 使用创世区块矿工地址
         Transaction("Alice", "Bob", 5.0, 0.15),
         Transaction("Bob", "Charlie", 2.0, 0.05),
     ]
     for tx in test_transactions:
-        mempool.add_transaction(tx)
+        miner.mempool.add_transaction(tx)
 
-    # 2. 矿工开始挖矿
-    miner = MinerNode("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa")
-    miner.mempool = mempool  # 设置交易池
-    new_blocks = miner.start_mining(num_blocks=5)
+    # 3. 矿工开始挖矿
+    new_blocks = miner.start_mining(num_blocks=16)
     print(f"Miner's final balance: {miner.balance} coins")
 
-    # 3. 验证节点验证这些区块
+    # 出块时间：目标值按比例调整后逐步逼近目标出块时间，单个区块的用时仍然随机波动
+    print(f"\nBlock times (target {miner.blockchain.target_block_time}s, adjusted every {miner.blockchain.difficulty_adjustment_interval} blocks):")
+    block_times = []
+    for height, block in enumerate(new_blocks, start=1):
+        block_time = (block.timestamp - new_blocks[height - 2].timestamp).total_seconds() if height > 1 else None
+        if block_time is not None:
+            block_times.append(block_time)
+        shown = "-" if block_time is None else f"{block_time:.3f}s"
+        print(f"  #{height:<3} difficulty {block.difficulty:>9.0f}  block time {shown}")
+    print(f"Block time mean={statistics.mean(block_times):.3f}s, stdev={statistics.stdev(block_times):.3f}s")
+
+    # 4. 验证节点验证这些区块
     validator = ValidatorNode()
     random.shuffle(new_blocks)  # 模拟网络传输顺序随机
     validator.start_validating(new_blocks)
+    print(instrumentation.summary())
 
+# 一次运行的输出(哈希、出块时间和难度每次都不同)：
 """
 === Simulating Blockchain Network with Difficulty Sync ===
-Debug: block_height=2, interval=4
-Block mined with difficulty 4: 00006526ffc40641c711aa879dba670018141d9821a382dd73bce2888fec9e13
+Mining backend: pure (pure 1,333,071 H/s, midstate 1,177,036 H/s)
+Block mined with difficulty 65536: 0000807bffb02a6c78654bf4f7c7df0997ffd076783fbbbfd566e89abf5e338e
 Miner 1A1zP1eP earned 50.1 coins! (Block reward: 50, Fees: 0.1)
-Debug: block_height=3, interval=4
-Block mined with difficulty 4: 0000920db510b57262c67849e82461c75f1682627a8bef2da6d8812997f64320
+Block mined with difficulty 65536: 0000d835a7797b4182bf1b1af725271d1a3ea616a50629f1efc9828b191458e4
 Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
-Debug: block_height=4, interval=4
-Debug: avg_block_time=0.148396, target=1
-Debug: current difficulty=0000
-Block mined with difficulty 5: 00000d9d764ce0f4c981fd1478d6926cabfc1fe8f51480819398e60d6f8bf013
+Block mined with difficulty 262144: 000018b1373cb8c1ce38793bea93cd60d3dbbcfe43a72a01adc69e760e28411e
 Miner 1A1zP1eP earned 50.2 coins! (Block reward: 50, Fees: 0.2)
-Debug: block_height=5, interval=4
-Block mined with difficulty 5: 00000a4f6a7ef88e8da45ab1912d7139b0d573274fbf487f8bb7b4794cf8899d
+Block mined with difficulty 262144: 00001df8a680d94584778bf863965027493405e14394decdbfed4fe387a3246e
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 262144: 00001801966b4e2b37d3aadb9685c34c25be2e78483d27e8c00a7a3bfa42509b
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 262144: 00002e38774c589e27507d9533ea8eb30fd44991caaf466cb417e0652e6f9c4c
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 1048576: 000003faea943f543531af33a5cd6cdf2e3a8cd5c15f012a75597f3957bba965
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 1048576: 00000d21d53a28c47cfd899559066f9ff737af2a417f99f58a9d600d1072bd3b
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 1048576: 00000f1def6a9ff3af8a79380e69bccceb309a0145ab06a0830348e4d76847e6
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 1048576: 0000096c33f715ca8059a991979e18af404c67f41999962288db8f8464f62950
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 2662389: 000005dd8c462e5254973529742555d1ba2bb3d0bff9bbe098e697e967949154
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 2662389: 0000020c0262861e2b79ad53b7365233f31ad365d53045edc84ddc3a5892c455
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 2662389: 000003649754a05c876520f113825236499e28d1e67ac56cdc776fd390d60572
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 2662389: 000005d601e32976385cb52420be2abb59e576f52fc88ae71ecb44b9ffbd018b
+Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
+Block mined with difficulty 1228926: 00000759c395c93071390f41721d68506d4728eb3994676e91b30f3bcce4d3a4
 Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
-Debug: block_height=6, interval=4
-Block mined with difficulty 5: 00000cf2e877832e7bda7d3cf945e041005da13a2c4f1792ceb62449d258d5e7
+Block mined with difficulty 1228926: 000005eaec91ab7fb09f6afb1129dcccc08fd54979aa6ddb2f811b1f270550fa
 Miner 1A1zP1eP earned 50 coins! (Empty block, only reward)
-Miner's final balance: 190.20000000000002 coins
+Miner's final balance: 740.2 coins
+
+Block times (target 1s, adjusted every 4 blocks):
+  #1   difficulty     65536  block time -
+  #2   difficulty     65536  block time 0.004s
+  #3   difficulty    262144  block time 0.019s
+  #4   difficulty    262144  block time 0.105s
+  #5   difficulty    262144  block time 0.302s
+  #6   difficulty    262144  block time 0.182s
+  #7   difficulty   1048576  block time 0.178s
+  #8   difficulty   1048576  block time 0.309s
+  #9   difficulty   1048576  block time 0.792s
+  #10  difficulty   1048576  block time 0.162s
+  #11  difficulty   2662389  block time 0.313s
+  #12  difficulty   2662389  block time 1.158s
+  #13  difficulty   2662389  block time 5.506s
+  #14  difficulty   2662389  block time 0.654s
+  #15  difficulty   1228926  block time 1.347s
+  #16  difficulty   1228926  block time 0.748s
+Block time mean=0.785s, stdev=1.369s
 
 Validator: Starting validation process
 
 Node: Starting blockchain sync...
-Debug: block_height=2, interval=4
-
-Debug: Verifying block at position 1
-Debug: Parent block is at position 0
-Debug: Initial balance from genesis: 1A1zP1eP = 50
-
-Debug: Verifying transactions in current block:
-Debug: Checking tx: 1A1zP1eP -> Alice = 10.0 (fee: 0.1)
-Debug: Sender 1A1zP1eP balance: 50
-Debug: After tx, temp balances: [('1A1zP1eP', 40.0), ('Alice', 10.0)]
-Block added to main chain: 00006526ff...
-Debug: Block 00000a4f is orphan, parent not found
-Orphan block stored: 00000a4f6a...
-Debug: Block 00000cf2 is orphan, parent not found
-Orphan block stored: 00000cf2e8...
-Debug: block_height=3, interval=4
-
-Debug: Verifying block at position 2
-Debug: Parent block is at position 1
-Debug: Initial balance from genesis: 1A1zP1eP = 50
-
-Debug: Checking block 1 (confirmations: 1)
-Debug: Block 1 not confirmed yet
-
-Debug: Verifying transactions in current block:
-Block added to main chain: 0000920db5...
-Debug: block_height=4, interval=4
-Debug: avg_block_time=0.148396, target=1
-Debug: current difficulty=0000
-
-Debug: Verifying block at position 3
-Debug: Parent block is at position 2
-Debug: Initial balance from genesis: 1A1zP1eP = 50
-
-Debug: Checking block 1 (confirmations: 2)
-Debug: Block 1 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: Processing tx: 1A1zP1eP -> Alice = 10.0 (fee: 0.1)
-Debug: After block 1, balances: [('1A1zP1eP', 90.0), ('Alice', 10.0)]
-
-Debug: Checking block 2 (confirmations: 1)
-Debug: Block 2 not confirmed yet
-
-Debug: Verifying transactions in current block:
-Debug: Checking tx: Alice -> Bob = 5.0 (fee: 0.15)
-Debug: Sender Alice balance: 10.0
-Debug: After tx, temp balances: [('1A1zP1eP', 90.15), ('Alice', 4.85), ('Bob', 5.0)]
-Debug: Checking tx: Bob -> Charlie = 2.0 (fee: 0.05)
-Debug: Sender Bob balance: 5.0
-Debug: After tx, temp balances: [('1A1zP1eP', 90.2), ('Alice', 4.85), ('Bob', 2.95), ('Charlie', 2.0)]
-Block added to main chain: 00000d9d76...
-Debug: block_height=5, interval=4
-
-Debug: Verifying block at position 4
-Debug: Parent block is at position 3
-Debug: Initial balance from genesis: 1A1zP1eP = 50
-
-Debug: Checking block 1 (confirmations: 3)
-Debug: Block 1 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: Processing tx: 1A1zP1eP -> Alice = 10.0 (fee: 0.1)
-Debug: After block 1, balances: [('1A1zP1eP', 90.0), ('Alice', 10.0)]
-
-Debug: Checking block 2 (confirmations: 2)
-Debug: Block 2 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: After block 2, balances: [('1A1zP1eP', 140.0), ('Alice', 10.0)]
-
-Debug: Checking block 3 (confirmations: 1)
-Debug: Block 3 not confirmed yet
-
-Debug: Verifying transactions in current block:
-Previous-Orphan Block added to some chain: 00000a4f6a...
-Debug: block_height=6, interval=4
-
-Debug: Verifying block at position 5
-Debug: Parent block is at position 4
-Debug: Initial balance from genesis: 1A1zP1eP = 50
-
-Debug: Checking block 1 (confirmations: 4)
-Debug: Block 1 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: Processing tx: 1A1zP1eP -> Alice = 10.0 (fee: 0.1)
-Debug: After block 1, balances: [('1A1zP1eP', 90.0), ('Alice', 10.0)]
-
-Debug: Checking block 2 (confirmations: 3)
-Debug: Block 2 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: After block 2, balances: [('1A1zP1eP', 140.0), ('Alice', 10.0)]
-
-Debug: Checking block 3 (confirmations: 2)
-Debug: Block 3 is confirmed
-Debug: Added block reward: 1A1zP1eP += 50
-Debug: Processing tx: Alice -> Bob = 5.0 (fee: 0.15)
-Debug: Processing tx: Bob -> Charlie = 2.0 (fee: 0.05)
-Debug: After block 3, balances: [('1A1zP1eP', 190.20000000000002), ('Alice', 4.85), ('Bob', 2.95), ('Charlie', 2.0)]
-
-Debug: Checking block 4 (confirmations: 1)
-Debug: Block 4 not confirmed yet
-
-Debug: Verifying transactions in current block:
-Previous-Orphan Block added to some chain: 00000cf2e8...
-Sync finished. Chain length: 6, Remaining orphans: 0
-Validator: Finished processing 5 blocks
+Headers: 16 valid headers out of 16
+Sync finished. Chain length: 17, Remaining orphans: 0
+Validator: Finished processing 16 blocks
+Stats: blocks_verified=16, hashes_tried=15729746, orphan_pool_size=0, verify_seconds[n=16 mean=1.28e-05 p50=1.53e-05 p99=5.26e-05]
 """
@@ -0,0 +1,46 @@
+"""测试共用的链和区块构造工具
+
+pow_demo 及其兄弟模块按脚本目录互相导入(from pow_demo import ...)，这里把 basics 目录加入 sys.path
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from chain_gen import ChainGenerator, seal
+from pow_demo import Block, BlockIndexEntry, Node
+
+
+@pytest.fixture(scope="module")
+def generator() -> ChainGenerator:
+    """60个区块的确定性主链，每个区块5笔交易，每隔15个区块有一条短分叉"""
+    generator = ChainGenerator(seed=1, num_addresses=20, txs_per_block=5, fork_every=15)
+    generator.extend_to(60)
+    return generator
+
+
+def build_blocks(node: Node, parent_hash: str, count: int, generator: ChainGenerator, txs_fn=lambda i: [], miner: str = "fork-miner") -> list[Block]:
+    """在 node 已知的区块 parent_hash 之后构造 count 个有效区块(不加入 node)"""
+    parent = node.block_index[parent_hash]
+    blocks = []
+    for i in range(count):
+        block = Block(txs_fn(i), parent.block.hash)
+        block.timestamp = parent.block.timestamp + generator.block_spacing
+        block.miner_address = miner
+        seal(block, node.expected_target_after(parent, block))
+        blocks.append(block)
+        parent = BlockIndexEntry(block, parent)
+    return blocks
+
+
+def assert_same_state(node: Node, reference: Node) -> None:
+    """两个节点的主链、账本、地址余额和交易索引一致(余额为0与地址不存在等价)"""
+    assert [block.hash for block in node.blockchain.chain] == [block.hash for block in reference.blockchain.chain]
+    for mine, theirs in ((node.ledger.balances, reference.ledger.balances),
+                         (node.address_index.tx_balances, reference.address_index.tx_balances)):
+        for address in set(mine) | set(theirs):
+            assert mine.get(address, 0) == pytest.approx(theirs.get(address, 0), abs=1e-9), address
+    assert dict(node.tx_index.items()) == dict(reference.tx_index.items())
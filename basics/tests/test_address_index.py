@@ -0,0 +1,68 @@
+import pytest
+
+from conftest import build_blocks
+from pow_demo import Transaction, ValidatorNode
+
+
+def scanned_history(chain, address):
+    """逐个区块扫描主链得到的 [(高度, 交易净额, 区块奖励)]，作为索引的对照"""
+    history = []
+    for height, block in enumerate(chain):
+        tx_delta = reward = 0
+        for tx in block.data if not isinstance(block.data, str) else []:
+            if tx.sender == address:
+                tx_delta -= tx.amount + tx.fee
+            if tx.receiver == address:
+                tx_delta += tx.amount
+            if block.miner_address == address:
+                tx_delta += tx.fee
+        if block.miner_address == address:
+            reward += block.block_reward
+        if tx_delta or reward or any(address in (tx.sender, tx.receiver) for tx in block.data if isinstance(tx, Transaction)):
+            history.append((height, tx_delta, reward))
+    return history
+
+
+def assert_history(actual, expected):
+    assert [height for height, _, _ in actual] == [height for height, _, _ in expected]
+    for (_, tx_delta, reward), (_, want_delta, want_reward) in zip(actual, expected):
+        assert tx_delta == pytest.approx(want_delta, abs=1e-9)
+        assert reward == want_reward
+
+
+def test_address_history_matches_chain_scan(generator):
+    node = generator.node
+    chain = node.blockchain.chain
+    for address in generator.addresses[:5] + [chain[0].miner_address]:
+        expected = scanned_history(chain, address)
+        assert_history(node.get_address_history(address), expected)
+        assert_history(node.get_address_history(address, 20, 40), [entry for entry in expected if 20 <= entry[0] <= 40])
+    assert node.get_address_history("nobody") == []
+
+
+def test_history_rolls_back_with_reorg(generator):
+    main = generator.main_blocks
+    node = ValidatorNode()
+    node.sync_with_network(main)
+    miner = main[-1].miner_address
+    before = node.get_address_history(miner)
+    fork = build_blocks(node, main[-3].hash, 4, generator, miner="fork-miner")
+    node.sync_with_network(fork)
+    assert node.blockchain.chain[-1].hash == fork[-1].hash
+    for address in (miner, "fork-miner"):
+        assert_history(node.get_address_history(address), scanned_history(node.blockchain.chain, address))
+    fork_height = node.block_index[fork[0].hash].height
+    assert [height for height, _, _ in node.get_address_history("fork-miner")] == list(range(fork_height, fork_height + 4))
+    assert node.get_address_history(miner, 0, fork_height - 1) == [entry for entry in before if entry[0] < fork_height]
+
+
+def test_history_is_rebuilt_after_restart(generator, tmp_path):
+    node = ValidatorNode(str(tmp_path))
+    node.sync_with_network(generator.main_blocks)
+    address = generator.addresses[3]
+    history = node.get_address_history(address)
+    node.close()
+    restarted = ValidatorNode(str(tmp_path))
+    assert restarted.address_index.history is None  # 检查点不保存历史，第一次查询时重建
+    assert_history(restarted.get_address_history(address), history)
+    restarted.close()
@@ -0,0 +1,31 @@
+import pytest
+
+from pow_demo import Block, ValidatorNode
+
+
+def tampered(block: Block) -> Block:
+    """同一个区块换一个nonce，声明的哈希不变：PoW检查必须发现哈希对不上"""
+    copy = Block.from_bytes(block.to_bytes())
+    copy.nonce += 1
+    return copy
+
+
+@pytest.mark.parametrize("workers,chunk_size", [(1, 256), (2, 8)])
+def test_batch_rejects_tampered_header_and_its_descendants(generator, workers, chunk_size):
+    main = generator.main_blocks
+    index = 37
+    blocks = main[:index] + [tampered(main[index])] + main[index + 1:]
+    node = ValidatorNode()
+    result = node.verify_blocks_batch(blocks, workers=workers, chunk_size=chunk_size)
+    assert (result.accepted, result.rejected, result.orphaned) == (index, len(main) - index, 0)
+    assert node.blockchain.chain[-1].hash == main[index - 1].hash
+    assert main[index].hash not in node.block_index
+    assert len(node.orphan_blocks) == 0  # 后代直接拒绝，不进孤块池
+    assert set(result.stage_seconds) == {"header", "pow", "stateful"}
+
+
+def test_batch_accepts_untampered_chain(generator):
+    node = ValidatorNode()
+    result = node.verify_blocks_batch(generator.main_blocks, workers=2, chunk_size=8)
+    assert (result.accepted, result.rejected, result.orphaned) == (len(generator.main_blocks), 0, 0)
+    assert node.blockchain.chain[-1].hash == generator.main_blocks[-1].hash
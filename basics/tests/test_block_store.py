@@ -0,0 +1,91 @@
+import json
+import os
+
+from block_store import BlockStore
+from conftest import assert_same_state
+from pow_demo import ValidatorNode
+
+
+def reference(blocks):
+    node = ValidatorNode()
+    for block in blocks:
+        node.process_new_block(block)
+    return node
+
+
+def chop(path, size):
+    """模拟写到一半时崩溃：文件末尾少了 size 个字节"""
+    os.truncate(path, os.path.getsize(path) - size)
+
+
+def test_torn_tail_record_is_dropped(tmp_path):
+    store = BlockStore(str(tmp_path))
+    for height in range(3):
+        store.append(f"{height:064x}", bytes([height]) * (20 + height), height + 1)
+        store.put_txid(bytes([height]) * 32, height, 0)
+    store.txids_indexed = 3
+    store.close()
+    chop(tmp_path / "blocks.dat", 3)
+
+    store = BlockStore(str(tmp_path))
+    assert len(store) == 2
+    assert store.read(1) == bytes([1]) * 21
+    assert store.height_of(f"{2:064x}") is None
+    # 被丢弃的区块的txid也一并删除
+    assert store.txids_indexed == 2
+    assert store.txid_location(bytes([2]) * 32) is None
+    assert store.txid_location(bytes([1]) * 32) == (1, 0)
+
+    store.append(f"{7:064x}", b"replacement", 9)
+    store.close()
+    store = BlockStore(str(tmp_path))
+    assert len(store) == 3
+    assert store.read(2) == b"replacement"
+    assert store.height_of(f"{7:064x}") == 2
+    assert store.chain_work(2) == 9
+    store.close()
+
+
+def test_trailing_garbage_is_truncated(tmp_path):
+    store = BlockStore(str(tmp_path))
+    store.append(f"{1:064x}", b"block", 1)
+    store.close()
+    size = os.path.getsize(tmp_path / "blocks.dat")
+    with open(tmp_path / "blocks.dat", "ab") as f:
+        f.write(b"\x00\x00\x00\x10partial")  # 索引头还没记录的半条记录
+    store = BlockStore(str(tmp_path))
+    assert len(store) == 1
+    assert os.path.getsize(tmp_path / "blocks.dat") == size
+    store.close()
+
+
+def test_node_restarts_from_store_and_checkpoint(generator, tmp_path):
+    main = generator.main_blocks
+    node = ValidatorNode(str(tmp_path))
+    node.checkpoint_interval = 16
+    node.sync_with_network(main)
+    node.close()
+    with open(tmp_path / "state.json") as f:
+        assert "tx_index" not in json.load(f)  # 交易索引在 txids.dat 里
+
+    restarted = ValidatorNode(str(tmp_path))
+    assert_same_state(restarted, reference(main))
+    restarted.close()
+
+
+def test_node_recovers_from_crash_and_torn_tail(generator, tmp_path):
+    main = generator.main_blocks
+    node = ValidatorNode(str(tmp_path))
+    node.checkpoint_interval = 16
+    node.sync_with_network(main)
+    # 崩溃：最后的检查点之后的区块已经写入，但没有调用 close
+    node.store.flush()
+    node.store.close()
+    chop(tmp_path / "blocks.dat", 1)
+
+    restarted = ValidatorNode(str(tmp_path))
+    assert restarted.blockchain.chain[-1].hash == main[-2].hash
+    assert_same_state(restarted, reference(main[:-1]))
+    restarted.sync_with_network(main[-1:])
+    assert_same_state(restarted, reference(main))
+    restarted.close()
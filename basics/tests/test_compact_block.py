@@ -0,0 +1,59 @@
+import asyncio
+
+from chain_gen import seal
+from compact_block import CompactBlock
+from net_sim import Network
+from pow_demo import Block, Transaction, genesis_block
+
+
+def two_node_network() -> Network:
+    return Network(2, num_miners=1, degree=1, latency=(0.001, 0.001), loss=0.0)
+
+
+def block_on_genesis(network: Network, txs: list[Transaction]) -> Block:
+    block = Block(txs, genesis_block.hash)
+    block.miner_address = "miner"
+    seal(block, network.nodes[0].node.calculate_expected_target(block))
+    return block
+
+
+async def relay(network: Network, block: Block) -> None:
+    sender, receiver = network.nodes
+    tasks = [asyncio.create_task(node.run()) for node in network.nodes]
+    sender.known_blocks[block.hash] = block
+    sender.broadcast_block(block)
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if receiver.node.blockchain.chain[-1].hash == block.hash:
+            break
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_small_block_is_relayed_in_full():
+    network = two_node_network()
+    block = block_on_genesis(network, [])
+    assert CompactBlock(block).size >= len(block.to_bytes())
+    asyncio.run(relay(network, block))
+    stats = network.compact_stats
+    assert network.nodes[1].node.blockchain.chain[-1].hash == block.hash
+    assert stats.full_relays == 1 and stats.blocks == 0
+    assert stats.bytes_saved == 0
+
+
+def test_compact_block_fetches_missing_transaction():
+    network = two_node_network()
+    txs = [Transaction(genesis_block.miner_address, f"receiver{i}", 0.1, 0.01, nonce=i) for i in range(20)]
+    block = block_on_genesis(network, txs)
+    receiver = network.nodes[1]
+    for tx in txs[:-1]:
+        assert receiver.mempool.add_transaction(tx)  # 最后一笔交易没有传到接收方
+
+    asyncio.run(relay(network, block))
+    stats = network.compact_stats
+    assert receiver.node.blockchain.chain[-1].hash == block.hash
+    assert receiver.node.blockchain.chain[-1].data == txs
+    assert (stats.blocks, stats.immediate, stats.after_request, stats.missing_txs) == (1, 0, 1, 1)
+    assert stats.bytes_saved > 0
+    assert len(receiver.mempool) == 0
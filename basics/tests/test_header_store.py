@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import assert_same_state, build_blocks
+from header_store import HASH_SIZE, HeaderStore
+from pow_demo import ValidatorNode, block_work
+
+
+def test_fields_round_trip_main_chain_headers(generator):
+    chain = generator.node.blockchain.chain
+    store = HeaderStore()
+    work = 0
+    for block in chain:
+        work += block_work(block)
+        store.append(block._hash, block.merkle_root(), block.timestamp_us, block.nonce, block.target,
+                     block.block_reward, block.miner_address, work)
+    assert len(store) == len(chain)
+    for height, block in enumerate(chain):
+        fields = store.fields(height)
+        previous = bytes(HASH_SIZE) if height == 0 else chain[height - 1]._hash
+        assert fields == (block._hash, previous, block.merkle_root(), block.timestamp_us, block.nonce,
+                          block.target, block.block_reward, block.miner_address)
+        assert store.block_hash(height) == block.hash
+        assert store.height_of(block.hash) == height
+        assert store.chain_work(height) == generator.node.block_index[block.hash].chain_work
+    with pytest.raises(IndexError):
+        store.fields(len(chain))
+    # 地址表：同一个矿工只保存一次
+    assert len(store._miner_names) == len({block.miner_address for block in chain})
+
+
+def test_hash_prefix_collisions_and_truncate():
+    store = HeaderStore()
+    prefix = bytes(range(8))
+    hashes = [prefix + bytes([i]) * (HASH_SIZE - 8) for i in range(4)]  # 前8字节都相同
+    for height, block_hash in enumerate(hashes):
+        store.append(block_hash, bytes(HASH_SIZE), height, height, 1, 50, "miner", height + 1)
+    assert [store.height_of(block_hash.hex()) for block_hash in hashes] == [0, 1, 2, 3]
+    assert store.height_of((prefix + b"\xff" * (HASH_SIZE - 8)).hex()) is None
+
+    store.truncate(2)
+    assert len(store) == 2
+    assert [store.height_of(block_hash.hex()) for block_hash in hashes] == [0, 1, None, None]
+    assert store.nbytes == 2 * (4 * HASH_SIZE + 8 + 8 + 8 + 4)
+    store.truncate(5)  # 比现有长度长时不变
+    assert len(store) == 2
+
+
+def test_header_store_node_follows_reorgs_like_a_list_node(generator):
+    main = generator.main_blocks
+    node = ValidatorNode()
+    node.use_header_store()
+    node.sync_with_network(main)
+    reference = ValidatorNode()
+    reference.sync_with_network(main)
+    fork = build_blocks(reference, main[-4].hash, 5, generator)
+    for target in (node, reference):
+        target.sync_with_network(fork)
+    assert node.blockchain.chain[-1].hash == fork[-1].hash
+    assert_same_state(node, reference)
+    assert len(node.blockchain.chain.headers) == len(reference.blockchain.chain)
@@ -0,0 +1,65 @@
+import pytest
+
+from instrumentation import DEBUG, INFO, OFF, WARNING, Histogram, Instrumentation
+from pow_demo import ValidatorNode
+
+
+@pytest.mark.parametrize("level,emitted", [
+    (DEBUG, ["debug", "info", "warning"]),
+    (INFO, ["info", "warning"]),
+    (WARNING, ["warning"]),
+    (OFF, []),
+])
+def test_events_below_level_are_dropped(level, emitted):
+    lines = []
+    events = Instrumentation(level=level, sink=lines.append)
+    assert (events.debug, events.info) == (level <= DEBUG, level <= INFO)
+    for event_level, message in ((DEBUG, "debug"), (INFO, "info"), (WARNING, "warning")):
+        events.event(event_level, message)
+    assert lines == emitted
+
+
+def test_counters_gauges_and_histograms():
+    events = Instrumentation(level=OFF)
+    events.count("blocks")
+    events.count("blocks", 2)
+    events.gauge("pool_size", 7)
+    events.gauge("pool_size", 3)
+    for value in (1, 2, 3, 100):
+        events.observe("latency", value)
+    snapshot = events.snapshot()
+    assert snapshot["counters"] == {"blocks": 3}
+    assert snapshot["gauges"] == {"pool_size": 3}
+    latency = snapshot["histograms"]["latency"]
+    assert (latency["count"], latency["min"], latency["max"], latency["mean"]) == (4, 1, 100, 26.5)
+    assert latency["p50"] == 4 and latency["p99"] == 100  # 桶上界(2落在 [2, 4) 桶)，不超过最大值
+    assert events.summary() == "Stats: blocks=3, pool_size=3, latency[n=4 mean=26.5 p50=4 p99=100]"
+    events.reset()
+    assert events.snapshot() == {"counters": {}, "gauges": {}, "histograms": {}}
+    assert Histogram().snapshot()["p50"] == 0.0
+
+
+def test_summary_is_reported_at_interval():
+    lines = []
+    events = Instrumentation(level=OFF, sink=lines.append, summary_interval=0)
+    events.count("blocks")
+    events.maybe_report()
+    assert lines == ["Stats: blocks=1"]  # OFF 只关闭事件，汇总照常输出
+    Instrumentation(level=OFF, sink=lines.append).maybe_report()
+    assert len(lines) == 1
+
+
+def test_node_counts_verified_and_rejected_blocks(generator):
+    lines = []
+    node = ValidatorNode()
+    node.instrumentation = Instrumentation(level=INFO, sink=lines.append)
+    main = generator.main_blocks
+    node.sync_with_network(main[:10], headers_first=False)
+    bad = main[10].__class__.from_bytes(main[10].to_bytes())
+    bad.target = main[10].target >> 1  # 与期望难度不符
+    assert not node.verify_block(bad)
+    counters = node.instrumentation.counters
+    assert counters["blocks_verified"] == 10
+    assert counters["blocks_rejected"] == 1
+    assert node.instrumentation.histograms["verify_seconds"].count == 11
+    assert any(line.startswith("Invalid target") for line in lines)
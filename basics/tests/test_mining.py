@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+
+from pow_demo import MAX_TARGET, Block, MinerNode, _mining_worker, genesis_block, target_to_bytes
+
+
+def test_parallel_mining_finds_a_nonce_that_meets_the_target():
+    block = Block([], genesis_block.hash)
+    block.miner_address = "miner"
+    result = block.mine_block_parallel(MAX_TARGET >> 12, workers=2)
+    assert not result.cancelled
+    assert (block.nonce, block.hash) == (result.nonce, result.hash)
+    assert block.meets_target() and block.calculate_hash() == block.hash
+    assert result.hashes > 0 and len(result.worker_hashrates) == 2
+
+
+def test_parallel_mining_stops_when_cancelled():
+    block = Block([], genesis_block.hash)
+    block.miner_address = "miner"
+    polls = []
+    begin = time.perf_counter()
+    result = block.mine_block_parallel(1, workers=2, cancel=lambda: polls.append(1) or len(polls) >= 5)  # 目标值1不可能满足
+    assert result.cancelled
+    assert block.nonce == 0
+    assert time.perf_counter() - begin < 10
+
+
+def test_multi_worker_miner_switches_to_a_competing_block_mid_mining():
+    miner = MinerNode("miner", mining_workers=2, mining_backend="midstate")
+    rival = Block([], genesis_block.hash)
+    rival.miner_address = "rival"
+    rival.mine_block(miner.calculate_expected_target(rival))
+
+    # 第一个模板的目标值不可能满足，只有收到竞争区块后换新模板才能挖出区块
+    expected_target = miner.calculate_expected_target
+    miner.calculate_expected_target = lambda block: 1 if block.previous_hash == genesis_block.hash and block.miner_address == "miner" else expected_target(block)
+    # worker已经在挖第一个模板时，主进程的第5次检查收到竞争区块
+    process_incoming = miner._process_incoming
+    polls = []
+
+    def deliver_rival_mid_mining():
+        polls.append(1)
+        if len(polls) == 5:
+            miner.receive_block(rival)
+        process_incoming()
+
+    miner._process_incoming = deliver_rival_mid_mining
+    mined = miner.start_mining(1)
+    assert miner.blockchain.chain[1].hash == rival.hash
+    assert [block.previous_hash for block in mined] == [rival.hash]
+    assert miner.mining_stats.stale_templates == 1
+    assert miner.mining_stats.stale_hashes > 0
+
+
+def test_mining_worker_reports_a_nonce_in_its_subspace():
+    block = Block([], genesis_block.hash)
+    block.miner_address = "miner"
+    block.target = MAX_TARGET >> 8  # 目标值是区块头前缀的一部分
+    results = multiprocessing.Queue()
+    _mining_worker(1, block.header_prefix(), target_to_bytes(block.target), 1, 3, multiprocessing.Event(), results)
+    worker_id, (nonce, digest), hashes, elapsed = results.get()
+    assert worker_id == 1 and nonce % 3 == 1 and hashes >= 1
+    block.nonce, block.hash = nonce, digest
+    assert block.meets_target() and block.calculate_hash() == digest
@@ -0,0 +1,64 @@
+import datetime
+import hashlib
+
+import pytest
+
+import mining_backend
+from mining_backend import MidstateBackend, available_backends, search_nonce, select_backend
+from pow_demo import MAX_TARGET, Block, MinerNode, Transaction, target_to_bytes
+
+
+def fixed_block() -> Block:
+    block = Block([Transaction("alice", "bob", 1.5, 0.01)], "00" * 32)
+    block.timestamp = datetime.datetime(2024, 1, 1)
+    block.miner_address = "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+    return block
+
+
+@pytest.mark.parametrize("start_nonce,step", [(0, 1), (5, 3)])
+def test_all_backends_find_the_same_nonce(start_nonce, step):
+    header_prefix = fixed_block().header_prefix()
+    target = target_to_bytes(MAX_TARGET >> 10)
+    backends = available_backends()
+    assert {"pure", "midstate"} <= {backend.name for backend in backends}
+    expected = search_nonce(hashlib.sha256(header_prefix), target, start_nonce, step)  # 参考内核
+    assert expected[0] is not None and expected[1] <= target
+    for backend in backends:
+        assert backend.search(header_prefix, target, start_nonce, step) == expected, backend.name
+
+
+def test_mined_block_meets_target_with_every_backend():
+    nonces = set()
+    for backend in available_backends():
+        block = fixed_block()
+        block.mine_block(MAX_TARGET >> 10, backend)
+        assert block.meets_target() and block.calculate_hash() == block.hash
+        nonces.add(block.nonce)
+    assert len(nonces) == 1
+
+
+def test_explicit_backend_skips_calibration(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("calibrate should not run")
+
+    monkeypatch.setattr(mining_backend, "calibrate", fail)
+    monkeypatch.setattr(mining_backend, "_calibrated", None)
+    backend = MidstateBackend()
+    assert select_backend(backend) is backend
+    assert select_backend("pure").name == "pure"
+    assert MinerNode("miner", mining_backend="midstate").mining_backend.name == "midstate"
+
+
+def test_calibration_runs_once_and_prefers_default_within_margin(monkeypatch):
+    calls = []
+
+    def calibrate():
+        calls.append(1)
+        return {"pure": 1.05e6, "midstate": 1.0e6}  # 差距在测量误差范围内
+
+    monkeypatch.delenv(mining_backend.BACKEND_ENV_VAR, raising=False)
+    monkeypatch.setattr(mining_backend, "calibrate", calibrate)
+    monkeypatch.setattr(mining_backend, "_calibrated", None)
+    assert select_backend().name == "midstate"
+    assert select_backend().name == "midstate"
+    assert len(calls) == 1
@@ -0,0 +1,51 @@
+from chain_gen import seal
+from pow_demo import Block, OrphanPool, Transaction, ValidatorNode
+
+
+def test_reverse_delivery_drains_orphan_pool(generator):
+    # 倒序到达：除了第一个区块，其余都先进入孤块池，父区块到达后一次性接上
+    blocks = generator.main_blocks
+    node = ValidatorNode()
+    for block in reversed(blocks):
+        node.process_new_block(block)
+    assert len(node.orphan_blocks) == 0
+    assert node.orphan_blocks.stored_count == len(blocks) - 1
+    assert node.blockchain.chain[-1].hash == blocks[-1].hash
+    assert len(node.blockchain.chain) == len(blocks) + 1
+
+
+def test_shuffled_sync_leaves_no_orphans(generator):
+    node = ValidatorNode()
+    node.sync_with_network(generator.delivery_order(), headers_first=False)
+    assert len(node.orphan_blocks) == 0
+    assert node.blockchain.chain[-1].hash == generator.main_blocks[-1].hash
+
+
+def test_invalid_orphan_is_removed_when_its_parent_arrives(generator):
+    blocks = generator.main_blocks[:3]
+    # 工作量证明有效，但交易花费超过余额：父区块未知时无法检查，先存进孤块池
+    bad = Block([Transaction("nobody", "x", 1000.0, 0.1)], blocks[1].hash)
+    bad.timestamp = blocks[2].timestamp
+    bad.miner_address = blocks[2].miner_address
+    seal(bad, blocks[2].target)
+    node = ValidatorNode()
+    node.process_new_block(bad)
+    assert bad.hash in node.orphan_blocks
+    node.process_new_block(blocks[0])
+    node.process_new_block(blocks[1])  # 连接孤块时做完整验证，无效的孤块被移除
+    assert len(node.orphan_blocks) == 0
+    assert bad.hash not in node.block_index
+    assert node.blockchain.chain[-1].hash == blocks[1].hash
+
+
+def test_pool_evicts_oldest_and_expires(generator):
+    blocks = generator.main_blocks[:4]
+    pool = OrphanPool(max_size=2, max_age=10)
+    assert pool.add(blocks[0], now=0)
+    assert not pool.add(blocks[0], now=0)
+    pool.add(blocks[1], now=1)
+    pool.add(blocks[2], now=2)  # 池满，驱逐最早到达的
+    assert blocks[0].hash not in pool and pool.evicted_count == 1
+    assert pool.pop_children(blocks[1].hash) == [blocks[2]]
+    pool.expire(now=20)
+    assert len(pool) == 0 and pool.expired_count == 1
@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import assert_same_state, build_blocks
+from pow_demo import ValidatorNode
+
+
+def pruned_node(blocks, header_store: bool) -> ValidatorNode:
+    node = ValidatorNode()
+    if header_store:
+        node.use_header_store()
+    node.prune_depth = 8
+    node.sync_with_network(blocks)
+    return node
+
+
+def full_node(blocks) -> ValidatorNode:
+    node = ValidatorNode()
+    for block in blocks:
+        node.process_new_block(block)
+    return node
+
+
+@pytest.mark.parametrize("header_store", [False, True])
+def test_old_bodies_are_dropped(generator, header_store):
+    main = generator.main_blocks
+    node = pruned_node(main, header_store)
+    chain = node.blockchain.chain
+    assert chain[10].data is None
+    assert chain[-1].data is not None
+    assert chain[10].hash == main[9].hash
+    assert node.get_balance(main[-1].miner_address) == full_node(main).get_balance(main[-1].miner_address)
+
+
+@pytest.mark.parametrize("header_store", [False, True])
+def test_reorg_inside_window(generator, header_store):
+    main = generator.main_blocks
+    node = pruned_node(main, header_store)
+    replayed = main[-3].data
+    fork = build_blocks(generator.node, main[-4].hash, 5, generator, lambda i: replayed if i == 0 else [])
+    node.sync_with_network(fork)
+    assert node.blockchain.chain[-1].hash == fork[-1].hash
+    assert_same_state(node, full_node(main[:-3] + fork))
+
+
+@pytest.mark.parametrize("header_store", [False, True])
+def test_reorg_deeper_than_window_is_rejected(generator, header_store):
+    main = generator.main_blocks
+    node = pruned_node(main, header_store)
+    balances = dict(node.ledger.balances)
+    fork = build_blocks(generator.node, main[20].hash, len(main) - 10, generator)
+    unpruned = full_node(main)
+    unpruned.sync_with_network(fork)
+    assert unpruned.blockchain.chain[-1].hash == fork[-1].hash  # 分叉的工作量更大，不裁剪的节点会切换过去
+    node.sync_with_network(fork)
+    assert node.blockchain.chain[-1].hash == main[-1].hash
+    assert node.ledger.balances == balances
+    assert all(block.hash not in node.block_index for block in fork)
@@ -0,0 +1,89 @@
+import pytest
+
+from conftest import assert_same_state, build_blocks
+from pow_demo import Block, Transaction, ValidatorNode
+
+
+def synced(blocks):
+    node = ValidatorNode()
+    for block in blocks:
+        node.process_new_block(block)
+    return node
+
+
+def test_reorg_rolls_back_with_undo_logs_and_back_again(generator):
+    main = generator.main_blocks
+    node = synced(main)
+    fork_parent = main[-5]  # 分叉点在链末端之前4个区块
+
+    # 更长的分叉，第一个区块重新打包被抛弃的区块里的交易
+    replayed = main[-4].data
+    assert replayed
+    fork = build_blocks(node, fork_parent.hash, 6, generator, lambda i: replayed if i == 0 else [])
+    node.sync_with_network(fork)
+    assert node.blockchain.chain[-1].hash == fork[-1].hash
+    assert main[-1].hash in node.fork_tips  # 旧主链只记录末端
+    assert_same_state(node, synced(main[:-4] + fork))
+    fork_height = node.block_index[fork[0].hash].height
+    assert all(node.tx_index[tx.txid] == (fork_height, i) for i, tx in enumerate(replayed))
+    assert all(tx.txid not in node.tx_index for block in main[-3:] for tx in block.data)
+
+    # 原来的链再追上来并超过分叉，切换回去
+    extension = build_blocks(node, main[-1].hash, 3, generator, miner="main-miner")
+    node.sync_with_network(extension)
+    assert node.blockchain.chain[-1].hash == extension[-1].hash
+    assert_same_state(node, synced(main + extension))
+
+
+def test_equal_work_fork_keeps_first_seen_chain(generator):
+    main = generator.main_blocks
+    node = synced(main)
+    fork = build_blocks(node, main[-3].hash, 2, generator)
+    node.sync_with_network(fork, headers_first=False)
+    assert node.blockchain.chain[-1].hash == main[-1].hash
+    assert fork[-1].hash in node.fork_tips
+
+
+@pytest.mark.parametrize("headers_first", [True, False])
+def test_fork_with_invalid_body_is_not_reorged_to(generator, headers_first):
+    main = generator.main_blocks
+    node = synced(main)
+    # 分叉区块到达时父区块不在主链上，交易要等重组回滚到分叉点后才能检查
+    theft = Transaction("nobody", "thief", 1000.0, 0.1)
+    fork = build_blocks(node, main[-5].hash, 6, generator, lambda i: [theft] if i == 1 else [])
+    node.sync_with_network(fork, headers_first=headers_first)
+    assert node.blockchain.chain[-1].hash == main[-1].hash
+    assert_same_state(node, synced(main))
+    assert node.ledger.balances.get("nobody", 0) == 0
+    assert all(block.hash not in node.block_index for block in fork[1:])
+    assert fork[0].hash in node.fork_tips  # 无效区块之前的有效部分仍是一条分叉
+
+
+def test_fork_blocks_arriving_one_by_one_are_checked_on_reorg(generator):
+    main = generator.main_blocks
+    node = synced(main)
+    theft = Transaction("nobody", "thief", 1000.0, 0.1)
+    fork = build_blocks(node, main[-5].hash, 6, generator, lambda i: [theft] if i == 1 else [])
+    for block in fork:
+        node.process_new_block(block)
+    assert node.blockchain.chain[-1].hash == main[-1].hash
+    assert_same_state(node, synced(main))
+
+    # 有效的分叉仍然可以在保留下来的前缀上继续延长并重组
+    valid = build_blocks(node, fork[0].hash, 6, generator)
+    node.sync_with_network(valid)
+    assert node.blockchain.chain[-1].hash == valid[-1].hash
+    assert_same_state(node, synced(main[:-4] + fork[:1] + valid))
+
+
+def test_ledger_refuses_block_that_overdraws_a_sender(generator):
+    node = synced(generator.main_blocks)
+    ledger = node.ledger
+    balances = dict(ledger.balances)
+    height = ledger.height
+    block = Block([Transaction("nobody", "thief", 1000.0, 0.1)], node.blockchain.chain[-1].hash)
+    block.miner_address = "block-miner"
+    with pytest.raises(ValueError, match="overdraws nobody"):
+        ledger.apply_block(block)
+    assert ledger.balances == balances
+    assert ledger.height == height
@@ -0,0 +1,49 @@
+import random
+
+from conftest import build_blocks
+from pow_demo import Transaction, ValidatorNode
+
+
+def test_headers_first_sync_skips_losing_forks(generator):
+    blocks = generator.main_blocks + generator.fork_blocks
+    random.Random(5).shuffle(blocks)
+    node = ValidatorNode()
+    node.sync_with_network(blocks)
+    assert node.blockchain.chain[-1].hash == generator.main_blocks[-1].hash
+    assert len(node.orphan_blocks) == 0
+    # 只沿最优区块头链下载区块体，落败的分叉不会进入区块树
+    assert generator.fork_blocks
+    assert all(block.hash not in node.block_index for block in generator.fork_blocks)
+    assert not node.fork_tips
+
+
+def test_invalid_body_stops_sync_at_its_parent(generator):
+    main = generator.main_blocks
+    overspend = Transaction("nobody", "x", 1000.0, 0.1)
+    extension = build_blocks(generator.node, main[-1].hash, 3, generator, lambda i: [overspend] if i == 1 else [])
+    node = ValidatorNode()
+    node.sync_with_network(list(reversed(main + extension)))
+    assert node.blockchain.chain[-1].hash == extension[0].hash
+    assert extension[1].hash not in node.block_index
+    assert extension[2].hash not in node.block_index
+    assert len(node.orphan_blocks) == 0
+
+
+def test_headers_that_do_not_connect_are_ignored(generator):
+    node = ValidatorNode()
+    node.sync_with_network(generator.main_blocks[10:])
+    assert len(node.blockchain.chain) == 1
+    assert len(node.orphan_blocks) == 0
+    node.sync_with_network(generator.main_blocks[:10])
+    node.sync_with_network(generator.main_blocks[10:])
+    assert node.blockchain.chain[-1].hash == generator.main_blocks[-1].hash
+
+
+def test_headers_first_matches_block_by_block_sync(generator):
+    blocks = generator.delivery_order(generator.main_blocks, window=5)
+    headers_first = ValidatorNode()
+    headers_first.sync_with_network(blocks)
+    block_by_block = ValidatorNode()
+    block_by_block.sync_with_network(blocks, headers_first=False)
+    assert [block.hash for block in headers_first.blockchain.chain] == [block.hash for block in block_by_block.blockchain.chain]
+    assert headers_first.ledger.balances == block_by_block.ledger.balances
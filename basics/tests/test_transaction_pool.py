@@ -0,0 +1,72 @@
+from pow_demo import Transaction, TransactionPool
+
+
+def test_templates_take_highest_fee_rate_first():
+    pool = TransactionPool()
+    low = Transaction("alice", "x", 1.0, 0.01)
+    high = Transaction("bob", "x", 1.0, 0.5)
+    mid = Transaction("carol", "x", 1.0, 0.1)
+    for tx in (low, high, mid):
+        assert pool.add_transaction(tx)
+    balances = {"alice": 10, "bob": 10, "carol": 10}
+    assert pool.get_transactions(balances, max_count=3) == [high, mid, low]
+    assert pool.get_transactions(balances, max_count=1) == [high]
+
+
+def test_same_sender_keeps_arrival_order():
+    # 后到的交易手续费更高，但可能依赖前一笔的花费，不能排到前面
+    pool = TransactionPool()
+    first = Transaction("alice", "x", 1.0, 0.01)
+    second = Transaction("alice", "y", 1.0, 0.9)
+    other = Transaction("bob", "x", 1.0, 0.2)
+    for tx in (first, second, other):
+        pool.add_transaction(tx)
+    assert pool.get_transactions({"alice": 10, "bob": 10}, max_count=3) == [other, first, second]
+
+
+def test_sender_without_balance_is_skipped():
+    pool = TransactionPool()
+    broke = Transaction("alice", "x", 5.0, 1.0)
+    ok = Transaction("bob", "x", 1.0, 0.1)
+    pool.add_transaction(broke)
+    pool.add_transaction(ok)
+    assert pool.get_transactions({"alice": 1, "bob": 10}) == [ok]
+    assert len(pool) == 2  # 余额不足的交易留在池里，等余额到账
+
+
+def test_full_pool_evicts_lowest_fee_rate():
+    pool = TransactionPool(max_size=3)
+    txs = [Transaction(f"sender{i}", "x", 1.0, fee) for i, fee in enumerate((0.3, 0.1, 0.2))]
+    for tx in txs:
+        assert pool.add_transaction(tx)
+
+    # 手续费率不高于池中最低者的交易不能挤进来
+    assert not pool.add_transaction(Transaction("late", "x", 1.0, 0.1))
+    assert pool.evicted_count == 0
+
+    assert pool.add_transaction(Transaction("rich", "x", 1.0, 0.5))
+    assert pool.evicted_count == 1
+    assert txs[1] not in pool.pending_transactions
+    assert len(pool) == 3
+    fees = [tx.fee for tx in pool.get_transactions({f"sender{i}": 10 for i in range(3)} | {"rich": 10}, max_count=3)]
+    assert fees == [0.5, 0.3, 0.2]
+
+
+def test_removed_and_duplicate_transactions():
+    pool = TransactionPool()
+    tx = Transaction("alice", "x", 1.0, 0.1)
+    assert pool.add_transaction(tx)
+    assert not pool.add_transaction(Transaction("alice", "x", 1.0, 0.1))  # 同一个txid
+    pool.remove_transactions([tx])
+    assert len(pool) == 0
+    assert pool.get_transactions({"alice": 10}) == []
+
+
+def test_repeat_payment_with_new_nonce_is_a_new_transaction():
+    pool = TransactionPool()
+    first = Transaction("alice", "x", 1.0, 0.1, nonce=0)
+    again = Transaction("alice", "x", 1.0, 0.1, nonce=1)  # 同样的付款再付一次
+    assert first.txid != again.txid
+    assert pool.add_transaction(first) and pool.add_transaction(again)
+    assert pool.get_transactions({"alice": 10}) == [first, again]
+    assert Transaction.from_bytes(again.to_bytes()) == (again, len(again.to_bytes()))
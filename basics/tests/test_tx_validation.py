@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from conftest import build_blocks
+from pow_demo import PARALLEL_TX_MIN, Transaction, group_transactions
+
+
+def random_block(generator, rng):
+    """接在主链末端的随机区块：有效交易、超额花费、区块内重复和重放已上链的交易混在一起"""
+    node = generator.node
+    balances = node.ledger.balances
+    addresses = generator.addresses + ["nobody"]
+    confirmed = [tx for block in generator.main_blocks[:40] for tx in block.data]
+    txs = []
+    for _ in range(rng.choice([1, 5, 30, 200])):
+        roll = rng.random()
+        if roll < 0.003:
+            txs.append(rng.choice(confirmed))
+        elif roll < 0.006 and txs:
+            txs.append(rng.choice(txs))
+        else:
+            sender = rng.choice(addresses)
+            amount = round(balances.get(sender, 0) * rng.choice([0.001, 0.05, 0.3, 1.0]) * rng.random(), 4)
+            txs.append(Transaction(sender, rng.choice(addresses), amount, 0.01))
+    miner = rng.choice(addresses) if rng.random() < 0.2 else "block-miner"
+    return build_blocks(node, node.blockchain.chain[-1].hash, 1, generator, lambda i: txs, miner=miner)[0]
+
+
+def check(node, block, workers: int, threshold: int) -> bool:
+    node.tx_validation_workers = workers
+    node.parallel_tx_min = threshold
+    try:
+        return node.verify_block(block, check_pow=False)
+    finally:
+        node.tx_validation_workers = 1
+        node.parallel_tx_min = PARALLEL_TX_MIN
+
+
+def test_grouped_matches_sequential_on_random_blocks(generator):
+    rng = random.Random(7)
+    node = generator.node
+    outcomes = set()
+    for _ in range(40):
+        block = random_block(generator, rng)
+        sequential = check(node, block, 1, 10**9)
+        assert check(node, block, 2, 1) == sequential  # 各组分给两个进程
+        assert check(node, block, 4, 1) == sequential
+        outcomes.add(sequential)
+    assert outcomes == {True, False}
+    node.close()
+
+
+def test_validation_pool_is_reused_until_close(generator):
+    node = generator.node
+    balances = node.spendable_balances()
+    senders = [address for address in balances if balances[address] > 1][:4]
+    txs = [Transaction(sender, f"receiver{i}", 0.5, 0.01) for i, sender in enumerate(senders)]
+    block = build_blocks(node, node.blockchain.chain[-1].hash, 1, generator, lambda i: txs)[0]
+    assert check(node, block, 1, 10**9)
+    assert check(node, block, 2, 1)
+    pool = node._tx_pool
+    assert pool is not None
+    assert check(node, block, 2, 1)
+    assert node._tx_pool is pool  # 不再为每个区块创建进程池
+    node.close()
+    assert node._tx_pool is None
+
+
+@pytest.mark.parametrize("txs,miner,groups", [
+    ([("a", "b"), ("c", "d"), ("b", "e"), ("f", "f"), ("d", "x")], "m", [[0, 2], [1, 4], [3]]),
+    ([("a", "b"), ("m", "d")], "m", [[0, 1]]),  # 花费矿工地址的交易依赖之前交易的手续费
+])
+def test_group_transactions(txs, miner, groups):
+    assert group_transactions([Transaction(sender, receiver, 1, 0) for sender, receiver in txs], miner) == groups
+
+
+def test_repeat_payments_are_accepted_and_replays_rejected(generator):
+    node = generator.node
+    balances = node.spendable_balances()
+    sender = max(balances, key=balances.get)
+    payment = Transaction(sender, "shop", 1.0, 0.01, nonce=10**6)
+    repeat = Transaction(sender, "shop", 1.0, 0.01, nonce=10**6 + 1)
+    assert check(node, build_blocks(node, node.blockchain.chain[-1].hash, 1, generator, lambda i: [payment, repeat])[0], 1, 10**9)
+    assert not check(node, build_blocks(node, node.blockchain.chain[-1].hash, 1, generator, lambda i: [payment, payment])[0], 1, 10**9)
+
+    confirmed = next(tx for block in generator.main_blocks[:40] for tx in block.data)
+    replay = Transaction(confirmed.sender, confirmed.receiver, confirmed.amount, confirmed.fee, confirmed.nonce)
+    assert replay.txid in node.tx_index
+    assert not check(node, build_blocks(node, node.blockchain.chain[-1].hash, 1, generator, lambda i: [replay])[0], 1, 10**9)